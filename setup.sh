@@ -9,14 +9,6 @@ fi
 virtualenv -p python3 .
 source bin/activate
 
-mkdir flit
-cd flit
-git clone https://github.com/ipfs/py-ipfs-http-client.git
-cd py-ipfs-http-client
-pip install flit
-flit install --pth-file
-cd ../../
-
 pip install -r requirements.txt
 
 python src/manage.py migrate
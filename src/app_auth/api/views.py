@@ -11,6 +11,9 @@ from rest_framework.parsers import FormParser
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 
+from flack.db import run_write
+
+from ..authentication import TokenParameterAuthentication
 from .serializers import UserModelSerializer
 
 User = get_user_model()
@@ -95,7 +98,7 @@ class LoginAPIView(APIView):
         if not user.check_password(password):
             raise AuthenticationFailed(detail='invalid username or password')
 
-        token, created = Token.objects.get_or_create(user=user)
+        token, created = run_write(Token.objects.get_or_create, user=user)
 
         content = {
             'message': 'success',
@@ -187,11 +190,11 @@ class RegisterAPIView(APIView):
         if user.exists():
             raise ParseError(detail="user '{username}' already exists".format(username=username))
 
-        new_user = User.objects.create(username=username)
+        # hashing the password is slow, so it's kept off the writer thread
+        new_user = User(username=username)
         new_user.set_password(password)
-        new_user.save()
 
-        new_user_token, created = Token.objects.get_or_create(user=new_user)
+        new_user_token = run_write(create_user_with_token, new_user)
 
         content = {
             'message': 'success',
@@ -318,30 +321,25 @@ class PingAPIView(APIView):
 class UserListAPIView(generics.ListAPIView):
     queryset = User.objects.all()
     serializer_class = UserModelSerializer
+    authentication_classes = (TokenParameterAuthentication,)
 
     def get_queryset(self, *args, **kwargs):
-        qs = self.queryset.none()
-        token = self.request.GET.get("token")
         query = self.request.GET.get("q")
 
-        if token is not None:
-            token_objs = Token.objects.filter(key=token)
+        qs = self.queryset.all()
+        user_id = self.request.user.id
 
-            if token_objs.exists():
-                qs = self.queryset.all()
-                token_obj = token_objs.first()
-                user_id = token_obj.user.id
+        qs = qs.exclude(id=user_id)
 
-                qs = qs.exclude(id=user_id)
+        if query is not None:
+            qs = qs.filter(username__icontains=query)
 
-                if query is not None:
-                    qs = qs.filter(username__icontains=query)
+        qs = qs.order_by('username')
 
-                qs = qs.order_by('username')
+        return qs
 
-            else:
-                raise AuthenticationFailed(detail="token invalid")
-        else:
-            raise AuthenticationFailed(detail="token not provided")
 
-        return qs
+def create_user_with_token(user):
+    user.save()
+    token, created = Token.objects.get_or_create(user=user)
+    return token
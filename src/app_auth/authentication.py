@@ -0,0 +1,27 @@
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .tokens import resolve_token
+
+
+class TokenParameterAuthentication(BaseAuthentication):
+    """
+    Authenticates requests using the `token` query parameter or form field.
+    Used by endpoints which require a token, so a missing token is an error.
+    """
+
+    def authenticate(self, request):
+        token = request.query_params.get('token')
+
+        if token is None and request.method != 'GET':
+            token = request.POST.get('token')
+
+        if token is None:
+            raise AuthenticationFailed(detail="token not provided")
+
+        user = resolve_token(token)
+
+        if user is None:
+            raise AuthenticationFailed(detail="token invalid")
+
+        return user, token
@@ -0,0 +1,34 @@
+from django.contrib.auth.models import AnonymousUser
+from django.utils.functional import LazyObject
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+
+from .tokens import token_cache, resolve_token
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+    """
+    Populates scope["user"] using the token which makes up the first segment
+    of the WebSocket URL path.
+    """
+
+    def populate_scope(self, scope):
+        if "user" not in scope:
+            scope["user"] = LazyObject()
+
+    async def resolve_scope(self, scope):
+        token = scope["path"].strip("/").split("/")[0]
+
+        # the in-process cache is safe to use from the event loop, anything
+        # else requires a thread
+        user = token_cache.get_local(token)
+        if user is None:
+            user = await get_user(token)
+
+        scope["user"]._wrapped = user if user is not None else AnonymousUser()
+
+
+@database_sync_to_async
+def get_user(token):
+    return resolve_token(token)
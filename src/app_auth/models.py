@@ -1,3 +1,20 @@
-from django.db import models
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
-# Create your models here.
+from rest_framework.authtoken.models import Token
+
+from .tokens import token_cache
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, *args, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_tokens(sender, instance, created, *args, **kwargs):
+    # cached users would otherwise keep their old username or active status
+    if not created:
+        for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+            token_cache.invalidate(key)
@@ -1,3 +1,77 @@
+from django.contrib.auth import get_user_model
 from django.test import TestCase
 
-# Create your tests here.
+from rest_framework.authtoken.models import Token
+
+from .tokens import TokenCache, resolve_token, token_cache
+
+
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = get_user_model().objects.create(username='alice')
+        self.token = Token.objects.create(user=self.user)
+
+    def test_resolved_token_is_cached(self):
+        self.assertEqual(resolve_token(self.token.key), self.user)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_token(self.token.key), self.user)
+            self.assertEqual(token_cache.get_local(self.token.key), self.user)
+
+    def test_every_lookup_gets_a_user_of_its_own(self):
+        first = resolve_token(self.token.key)
+        second = resolve_token(self.token.key)
+        self.assertIsNot(first, second)
+
+        first.username = 'changed'
+        self.assertEqual(resolve_token(self.token.key).username, 'alice')
+
+    def test_unknown_token_is_not_resolved(self):
+        self.assertIsNone(resolve_token('unknown'))
+        self.assertIsNone(resolve_token(''))
+
+    def test_deleted_token_is_invalidated(self):
+        resolve_token(self.token.key)
+        self.token.delete()
+
+        self.assertIsNone(token_cache.get_local(self.token.key))
+        self.assertIsNone(resolve_token(self.token.key))
+
+    def test_changed_user_is_invalidated(self):
+        resolve_token(self.token.key)
+        self.user.username = 'alicia'
+        self.user.save()
+
+        self.assertIsNone(token_cache.get_local(self.token.key))
+        self.assertEqual(resolve_token(self.token.key).username, 'alicia')
+
+    def test_inactive_user_is_rejected(self):
+        resolve_token(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertIsNone(resolve_token(self.token.key))
+        self.assertIsNone(token_cache.get_local(self.token.key))
+
+
+class TokenCacheEvictionTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='alice')
+
+    def test_least_recently_used_token_is_evicted(self):
+        cache = TokenCache(max_size=2, ttl=60)
+        cache.set('a', self.user)
+        cache.set('b', self.user)
+        cache.get_local('a')
+        cache.set('c', self.user)
+
+        self.assertIsNotNone(cache.get_local('a'))
+        self.assertIsNone(cache.get_local('b'))
+        self.assertIsNotNone(cache.get_local('c'))
+
+    def test_expired_token_is_forgotten(self):
+        cache = TokenCache(max_size=2, ttl=0)
+        cache.set('a', self.user)
+
+        self.assertIsNone(cache.get_local('a'))
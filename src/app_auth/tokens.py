@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+
+from rest_framework.authtoken.models import Token
+
+# maximum number of tokens kept in the in-process cache of every worker
+AUTH_CACHE_SIZE = getattr(settings, 'FLACK_AUTH_CACHE_SIZE', 10000)
+# number of seconds a resolved token is trusted before it is looked up again.
+# Deleted tokens and changed users are only forgotten by the process making
+# the change and the shared cache, other processes trust them this long.
+AUTH_CACHE_TTL = getattr(settings, 'FLACK_AUTH_CACHE_TTL', 60)
+# alias of a Django cache shared between workers, or None to disable it
+AUTH_CACHE_ALIAS = getattr(settings, 'FLACK_AUTH_CACHE_ALIAS', None)
+
+SHARED_KEY_PREFIX = 'flack.token.'
+
+
+class TokenCache:
+    """
+    Maps authentication token keys to users. Lookups go through a bounded
+    in-process LRU cache first, then through an optional shared Django cache
+    and only hit the database when both miss.
+
+    Only the field values of users are cached, every lookup returns a user
+    instance of its own, so requests and consumers never share one.
+    """
+
+    def __init__(self, max_size, ttl, shared_cache_alias=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared_cache_alias = shared_cache_alias
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def shared_cache(self):
+        if self.shared_cache_alias is None:
+            return None
+        return caches[self.shared_cache_alias]
+
+    def get_local(self, key):
+        """Looks `key` up in the in-process cache only. Never blocks on I/O."""
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                state, expires = entry
+
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return _thaw(state)
+
+                del self._entries[key]
+
+        return None
+
+    def get(self, key):
+        user = self.get_local(key)
+        if user is not None:
+            return user
+
+        shared_cache = self.shared_cache
+        if shared_cache is not None:
+            state = shared_cache.get(SHARED_KEY_PREFIX + key)
+
+            if state is not None:
+                self._store(key, state)
+                return _thaw(state)
+
+        return None
+
+    def set(self, key, user):
+        state = _freeze(user)
+        self._store(key, state)
+
+        shared_cache = self.shared_cache
+        if shared_cache is not None:
+            shared_cache.set(SHARED_KEY_PREFIX + key, state, self.ttl)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+        shared_cache = self.shared_cache
+        if shared_cache is not None:
+            shared_cache.delete(SHARED_KEY_PREFIX + key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, key, state):
+        with self._lock:
+            self._entries[key] = (state, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+def _freeze(user):
+    fields = user._meta.concrete_fields
+    return user._state.db, tuple(f.attname for f in fields), tuple(getattr(user, f.attname) for f in fields)
+
+
+def _thaw(state):
+    db, field_names, values = state
+    return get_user_model().from_db(db, field_names, values)
+
+
+token_cache = TokenCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL, AUTH_CACHE_ALIAS)
+
+
+def resolve_token(key):
+    """
+    Returns the user owning the token `key`, or None if no such token exists
+    or its user is inactive. Inactive users aren't cached.
+    """
+    if not key:
+        return None
+
+    user = token_cache.get(key)
+
+    if user is None:
+        token_obj = Token.objects.select_related('user').filter(key=key).first()
+
+        if token_obj is None:
+            return None
+
+        user = token_obj.user
+        if not user.is_active:
+            return None
+
+        token_cache.set(key, user)
+
+    return user
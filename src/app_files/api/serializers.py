@@ -1,8 +1,8 @@
 import humanize
-from netifaces import interfaces, ifaddresses, AF_INET
 
 from rest_framework import serializers
 
+from ..localnode import local_node
 from ..models import File
 
 
@@ -24,27 +24,13 @@ class FileModelSerializer(serializers.ModelSerializer):
         ]
 
     def get_size(self, obj):
-        return humanize.naturalsize(obj.file.size)
+        return humanize.naturalsize(obj.file_size)
 
     def get_localnode_url(self, obj):
-        local_ip = None
-
-        for iface in interfaces():
-            if_addrs = ifaddresses(iface).get(AF_INET)
-            if if_addrs is not None:
-                addr = if_addrs[0].get('addr')
-                if addr != '127.0.0.1':
-                    local_ip = addr
-
-        if local_ip is None:
-            local_ip = '127.0.0.1'
-
-        return 'http://{local_ip}:8080/ipfs/{multihash}/{filename}'.format(
-            local_ip=local_ip, multihash=obj.file.name, filename=obj.name
-        )
+        return local_node.url(obj.file.name, obj.filename or obj.name)
 
     def get_shareable_url(self, obj):
-        return obj.file.url
+        return obj.url
 
     def get_hash(self, obj):
         return obj.file.name
@@ -1,27 +1,62 @@
+import os
+
 import humanize
 
 from django.utils.decorators import method_decorator
 
-from rest_framework import generics
+from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.authtoken.models import Token
-from rest_framework.exceptions import AuthenticationFailed
 
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 
-from ..models import File
+from app_auth.authentication import TokenParameterAuthentication
+from flack.db import run_write
+
+from ..models import File, find_by_digest
+from ..pipeline import submit_upload
+from ..uploadhandlers import (
+    IPFSStreamingUploadHandler, IPFSUploadedFile, StagingUploadHandler, content_digest
+)
 from .serializers import FileModelSerializer
 
 
 class UploadAPIView(APIView):
+    authentication_classes = (TokenParameterAuthentication,)
+
+    def initial(self, request, *args, **kwargs):
+        # upload handlers can only be changed before the request body is read.
+        # A token in the form has to be read from the body to authenticate the
+        # request, so only uploads passing it in the query string are streamed
+        # straight to IPFS instead of being spooled first. Uploads processed in
+        # the background and uploads announcing the digest of content which is
+        # already in IPFS are written to the staging directory instead, the
+        # latter so they never reach IPFS if the digest turns out to match.
+        # Digests are only looked up for authenticated requests.
+        self.streaming_handler = None
+        self.background = request.query_params.get('async') in ('1', 'true')
+        known = False
+
+        if 'token' in request.query_params:
+            self.perform_authentication(request)
+            known = find_by_digest(request.query_params.get('digest')) is not None
+
+        if self.background or known:
+            request._request.upload_handlers = [StagingUploadHandler(request)]
+        elif 'token' in request.query_params:
+            self.streaming_handler = IPFSStreamingUploadHandler(File._meta.get_field('file').storage, request)
+            request._request.upload_handlers = [self.streaming_handler]
+
+        super().initial(request, *args, **kwargs)
+
     @swagger_auto_schema(
         manual_parameters=[
             openapi.Parameter(
                 name="token",
                 in_=openapi.IN_FORM,
-                description="Token. Used to associate the uploaded file with its owner.",
+                description="Token. Used to associate the uploaded file with its owner. May also be passed in the "
+                            "query string, in which case the file is streamed to IPFS as it is uploaded.",
                 type=openapi.TYPE_STRING,
                 required=True
             ),
@@ -31,6 +66,23 @@ class UploadAPIView(APIView):
                 type=openapi.TYPE_FILE,
                 required=True
             ),
+            openapi.Parameter(
+                name="digest",
+                in_=openapi.IN_QUERY,
+                description="SHA-256 of the file, in hex. If the same content has been uploaded before, the file is "
+                            "received locally and not added to IPFS again once the digest is verified.",
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            openapi.Parameter(
+                name="async",
+                in_=openapi.IN_QUERY,
+                description="If 'true', the file is added to IPFS in the background and the request is answered "
+                            "with 202 as soon as the file is received. The owner is notified over WebSocket once "
+                            "the file is ready or its upload has failed.",
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
         ],
         responses={
             200: openapi.Response(
@@ -65,6 +117,37 @@ class UploadAPIView(APIView):
                                     type=openapi.TYPE_STRING,
                                     example='https://ipfs.io/ipfs/Qm1234567890abcdefghijklmnopqrstuvwxyzABCDEFGH/examplefile.ext'
                                 ),
+                                'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                                'deduplicated': openapi.Schema(
+                                    description="Whether the content was found among files uploaded earlier, "
+                                                "in which case it was not added to IPFS again.",
+                                    type=openapi.TYPE_BOOLEAN
+                                )
+                            }
+                        )
+                    }
+                )
+            ),
+            202: openapi.Response(
+                description="Returned for uploads processed in the background.",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'message': openapi.Schema(
+                            type=openapi.TYPE_STRING,
+                            example='accepted'
+                        ),
+                        'file': openapi.Schema(
+                            type=openapi.TYPE_OBJECT,
+                            properties={
+                                'name': openapi.Schema(
+                                    type=openapi.TYPE_STRING,
+                                    example='examplefile.ext'
+                                ),
+                                'status': openapi.Schema(
+                                    type=openapi.TYPE_STRING,
+                                    example='pending'
+                                ),
                                 'id': openapi.Schema(type=openapi.TYPE_INTEGER)
                             }
                         )
@@ -87,37 +170,79 @@ class UploadAPIView(APIView):
         }
     )
     def put(self, request, format=None):
-        file_obj = request.FILES.get('file')
+        try:
+            file_obj = request.FILES.get('file')
+        except Exception:
+            if self.streaming_handler is not None:
+                self.streaming_handler.abort()
+            raise
+
         file_name = file_obj.name
 
-        token = request.POST.get('token')
+        user = request.user
 
-        if token is not None:
-            token_objs = Token.objects.filter(key=token)
+        # content added to IPFS while it was streamed can't be deduplicated
+        if not isinstance(file_obj, IPFSUploadedFile):
+            digest = getattr(file_obj, 'digest', None) or content_digest(file_obj)
+            filename = os.path.basename(file_name)
+            existing = find_by_digest(digest, filename)
 
-            if token_objs.exists():
-                token_obj = token_objs.first()
-                user = token_obj.user
+            if existing is not None:
+                # unless a file with the same name is found, the content is
+                # wrapped anew under the name it was uploaded with, the existing
+                # file's name is none of the uploader's business
+                multihash = existing.file.name
+                if filename != existing.filename:
+                    multihash = existing.file.storage.rewrap(multihash, filename)
 
-                file = File.objects.create(file=file_obj, name=file_name, owner=user)
+                file = run_write(
+                    File.objects.create,
+                    file=multihash,
+                    name=file_name,
+                    owner=user,
+                    filename=filename,
+                    size=existing.size,
+                    digest=digest
+                )
+                return Response(self.success_content(file, deduplicated=True))
+
+            if self.background:
+                file = run_write(
+                    File.objects.create, name=file_name, owner=user, digest=digest, status=File.PENDING
+                )
+                submit_upload(file.id, file_obj.detach())
 
                 content = {
-                    'message': 'success',
+                    'message': 'accepted',
                     'file': {
                         'name': file.name,
-                        'hash': file.file.name,
-                        'size': humanize.naturalsize(file.file.size),
-                        'url': file.file.url,
+                        'status': file.status,
                         'id': file.id
                     }
                 }
-                return Response(content)
+                return Response(content, status=status.HTTP_202_ACCEPTED)
+
+            file_obj.digest = digest
 
-            else:
-                raise AuthenticationFailed(detail="token invalid")
+        file = File(file=file_obj, name=file_name, owner=user)
+        # added to IPFS first, only the row is written on the writer thread
+        file.save_content()
+        run_write(file.save)
 
-        else:
-            raise AuthenticationFailed(detail="token not provided")
+        return Response(self.success_content(file, deduplicated=False))
+
+    def success_content(self, file, deduplicated):
+        return {
+            'message': 'success',
+            'file': {
+                'name': file.name,
+                'hash': file.file.name,
+                'size': humanize.naturalsize(file.file_size),
+                'url': file.url,
+                'id': file.id,
+                'deduplicated': deduplicated
+            }
+        }
 
 
 @method_decorator(name='get', decorator=swagger_auto_schema(
@@ -150,24 +275,12 @@ class UploadAPIView(APIView):
 class FileListAPIView(generics.ListAPIView):
     queryset = File.objects.all()
     serializer_class = FileModelSerializer
+    authentication_classes = (TokenParameterAuthentication,)
 
     def get_queryset(self, *args, **kwargs):
-        qs = self.queryset.none()
-        token = self.request.GET.get("token")
-
-        if token is not None:
-            token_objs = Token.objects.filter(key=token)
-
-            if token_objs.exists():
-                qs = self.queryset.all()
-                token_obj = token_objs.first()
-                user = token_obj.user
-
-                qs = qs.filter(owner=user)
+        qs = self.queryset.all()
+        user = self.request.user
 
-            else:
-                raise AuthenticationFailed(detail="token invalid")
-        else:
-            raise AuthenticationFailed(detail="token not provided")
+        qs = qs.filter(owner=user, status=File.READY)
 
         return qs
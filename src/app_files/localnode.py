@@ -0,0 +1,73 @@
+import threading
+import time
+
+from django.conf import settings
+from netifaces import interfaces, ifaddresses, AF_INET
+
+# address advertised for the local IPFS gateway, or None to detect it
+LOCALNODE_ADDRESS = getattr(settings, 'IPFS_LOCALNODE_ADDRESS', None)
+# port the local IPFS gateway listens on
+LOCALNODE_PORT = getattr(settings, 'IPFS_LOCALNODE_PORT', 8080)
+# seconds a detected address is used before the interfaces are looked at again
+LOCALNODE_REFRESH = getattr(settings, 'IPFS_LOCALNODE_REFRESH', 300)
+
+
+def detect_address():
+    """Returns an IPv4 address of this host other than the loopback one, or 127.0.0.1 if there is none."""
+    local_ip = None
+
+    for iface in interfaces():
+        if_addrs = ifaddresses(iface).get(AF_INET)
+        if if_addrs is not None:
+            addr = if_addrs[0].get('addr')
+            if addr != '127.0.0.1':
+                local_ip = addr
+
+    if local_ip is None:
+        local_ip = '127.0.0.1'
+
+    return local_ip
+
+
+class LocalNodeResolver:
+    """
+    Builds URLs of files on the IPFS gateway of the local node. The address
+    is detected from the network interfaces at most once every
+    `refresh_interval` seconds, unless it is fixed by `address`.
+    """
+
+    def __init__(self, address=None, port=8080, refresh_interval=300):
+        self.fixed_address = address
+        self.port = port
+        self.refresh_interval = refresh_interval
+
+        self._address = None
+        self._expires = 0
+        self._lock = threading.Lock()
+
+    @property
+    def address(self):
+        if self.fixed_address:
+            return self.fixed_address
+
+        with self._lock:
+            if self._address is None or self._expires <= time.monotonic():
+                self._refresh()
+            return self._address
+
+    def refresh(self):
+        """Detects the address again, eg. after the network configuration has changed."""
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        self._address = detect_address()
+        self._expires = time.monotonic() + self.refresh_interval
+
+    def url(self, multihash, filename):
+        return 'http://{address}:{port}/ipfs/{multihash}/{filename}'.format(
+            address=self.address, port=self.port, multihash=multihash, filename=filename
+        )
+
+
+local_node = LocalNodeResolver(LOCALNODE_ADDRESS, LOCALNODE_PORT, LOCALNODE_REFRESH)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from app_files.models import File
+
+
+class Command(BaseCommand):
+    help = "Stores wrapped file names and sizes of files uploaded before they were stored on upload."
+
+    def handle(self, *args, **options):
+        files = File.objects.filter(filename='')
+
+        for file in files.iterator():
+            filename, size = file.file.storage.stat_wrapped_file(file.file.name)
+            File.objects.filter(pk=file.pk).update(filename=filename, size=size)
+
+            self.stdout.write("{hash}: {filename} ({size} bytes)".format(
+                hash=file.file.name, filename=filename, size=size
+            ))
+
+        self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,225 @@
+import email
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+from django.core.management.base import BaseCommand
+
+from app_files.storage.ipfs_client import EMPTY_DIRECTORY
+
+
+class FakeIPFSStore:
+    """In-memory content store standing in for an IPFS node."""
+
+    def __init__(self):
+        self.blobs = {}
+        self.directories = {}
+        self.pins = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def multihash(data):
+        return 'Qm' + hashlib.sha256(data).hexdigest()[:44]
+
+    def add(self, filename, data, wrap_with_directory, pin):
+        file_hash = self.multihash(data)
+        added = [{'Name': filename, 'Hash': file_hash, 'Size': str(len(data))}]
+
+        with self.lock:
+            self.blobs[file_hash] = data
+            root = file_hash
+
+            if wrap_with_directory:
+                root = self.multihash(filename.encode() + b'/' + file_hash.encode())
+                self.directories[root] = (filename, file_hash)
+                added.append({'Name': '', 'Hash': root, 'Size': str(len(data))})
+
+            if pin:
+                self.pins.add(root)
+
+        return added
+
+    def add_link(self, root, name, ref):
+        """Adds a link to the empty directory `root`, the only kind of directory this store can extend."""
+        if root != EMPTY_DIRECTORY or ref not in self.blobs:
+            raise KeyError(root if root != EMPTY_DIRECTORY else ref)
+
+        directory = self.multihash(name.encode() + b'/' + ref.encode())
+        with self.lock:
+            self.directories[directory] = (name, ref)
+
+        return directory
+
+    def resolve(self, path):
+        """Returns the multihash of the file at `path`, which may point inside a wrapping directory."""
+        root, _, filename = path.partition('/')
+
+        if root in self.directories:
+            wrapped_name, file_hash = self.directories[root]
+            if filename in ('', wrapped_name):
+                return file_hash, root
+
+        if root in self.blobs and not filename:
+            return root, None
+
+        raise KeyError(path)
+
+
+class FakeIPFSRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    store = None
+    latency = 0
+
+    def do_POST(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+        url = urlparse(self.path)
+        params = {key: values[0] if len(values) == 1 else values for key, values in parse_qs(url.query).items()}
+        endpoint = url.path.replace('/api/v0/', '', 1)
+
+        try:
+            body = self.read_body()
+        except (ValueError, OSError):
+            # the client went away in the middle of the body, as an aborted streamed add does
+            self.close_connection = True
+            return
+
+        handler = getattr(self, 'handle_' + endpoint.replace('/', '_').replace('-', '_'), None)
+        if handler is None:
+            return self.respond_error(404, "unknown endpoint '{endpoint}'".format(endpoint=endpoint))
+
+        try:
+            handler(params, body)
+        except KeyError as e:
+            self.respond_error(500, "no such object: {path}".format(path=e))
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b''.join(chunks)
+
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def respond(self, body, content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond_error(self, status, message):
+        body = json.dumps({'Message': message, 'Code': 0, 'Type': 'error'}).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_version(self, params, body):
+        self.respond({'Version': '0.0.0-fake'})
+
+    def handle_add(self, params, body):
+        message = email.message_from_bytes(
+            b'Content-Type: ' + self.headers.get('Content-Type', '').encode() + b'\r\n\r\n' + body
+        )
+        added = []
+
+        for part in message.get_payload():
+            filename = part.get_filename()
+            if filename is not None:
+                added += self.store.add(
+                    filename,
+                    part.get_payload(decode=True),
+                    params.get('wrap-with-directory') == 'true',
+                    params.get('pin', 'true') == 'true'
+                )
+
+        self.respond(''.join(json.dumps(item) + '\n' for item in added).encode())
+
+    def handle_pin_add(self, params, body):
+        self.store.resolve(params['arg'])
+        self.store.pins.add(params['arg'])
+        self.respond({'Pins': [params['arg']]})
+
+    def handle_pin_rm(self, params, body):
+        self.store.pins.discard(params['arg'])
+        self.respond({'Pins': [params['arg']]})
+
+    def handle_cat(self, params, body):
+        file_hash, _ = self.store.resolve(params['arg'])
+        self.respond(self.store.blobs[file_hash], 'text/plain')
+
+    def handle_ls(self, params, body):
+        file_hash, directory = self.store.resolve(params['arg'])
+        links = []
+
+        if directory is not None:
+            filename, _ = self.store.directories[directory]
+            links.append({'Name': filename, 'Hash': file_hash, 'Size': len(self.store.blobs[file_hash]), 'Type': 2})
+
+        self.respond({'Objects': [{'Hash': params['arg'], 'Links': links}]})
+
+    def handle_object_stat(self, params, body):
+        file_hash, _ = self.store.resolve(params['arg'])
+        self.respond({'Hash': params['arg'], 'CumulativeSize': len(self.store.blobs[file_hash])})
+
+    def handle_object_patch_add_link(self, params, body):
+        root, name, ref = params['arg']
+        self.respond({'Hash': self.store.add_link(root, name, ref)})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeIPFSServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_server(host='127.0.0.1', port=5001, latency=0):
+    """Returns a server with an empty store, answering every request after `latency` seconds."""
+    handler = type('Handler', (FakeIPFSRequestHandler,), {
+        'store': FakeIPFSStore(),
+        'latency': latency
+    })
+    return FakeIPFSServer((host, port), handler)
+
+
+class Command(BaseCommand):
+    help = "Runs an in-memory stand-in for the IPFS daemon HTTP API, for development and testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=5001)
+        parser.add_argument(
+            '--latency', type=float, default=0,
+            help="Seconds to wait before answering each request."
+        )
+
+    def handle(self, *args, **options):
+        server = make_server(options['host'], options['port'], options['latency'])
+
+        self.stdout.write("Fake IPFS API listening on http://{host}:{port}/api/v0/ with {latency}s latency".format(
+            host=options['host'], port=options['port'], latency=options['latency']
+        ))
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from app_files.pipeline import recover_uploads
+
+
+class Command(BaseCommand):
+    help = "Resumes uploads left pending by a server which stopped and removes orphaned staged files. " \
+           "Run it while no server is running."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fail', action='store_true',
+            help="Mark pending uploads failed instead of resuming them."
+        )
+
+    def handle(self, *args, **options):
+        resumed, failed, removed = recover_uploads(resume=not options['fail'])
+
+        self.stdout.write("{resumed} uploads resumed, {failed} failed, {removed} staged files removed".format(
+            resumed=resumed, failed=failed, removed=removed
+        ))
+        self.stdout.write(self.style.SUCCESS("Done."))
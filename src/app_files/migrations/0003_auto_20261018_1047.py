@@ -0,0 +1,27 @@
+# Generated by Django 2.1.5 on 2026-10-18 10:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_files', '0002_remove_file_ipfs_hash'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='file',
+            options={'ordering': ['name']},
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='filename',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
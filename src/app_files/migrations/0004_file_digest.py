@@ -0,0 +1,18 @@
+# Generated by Django 2.1.5 on 2026-10-18 11:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_files', '0003_auto_20261018_1047'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='digest',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
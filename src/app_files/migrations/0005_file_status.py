@@ -0,0 +1,24 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:14
+
+from django.db import migrations, models
+import app_files.storage.ipfs_storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_files', '0004_file_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=7),
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='file',
+            field=models.FileField(blank=True, storage=app_files.storage.ipfs_storage.InterPlanetaryFileSystemStorage(), upload_to=''),
+        ),
+    ]
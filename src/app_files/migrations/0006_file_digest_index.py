@@ -0,0 +1,18 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_files', '0005_file_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='digest',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
@@ -5,18 +5,77 @@ from .storage.ipfs_storage import InterPlanetaryFileSystemStorage
 
 
 class File(models.Model):
-    file = models.FileField(storage=InterPlanetaryFileSystemStorage())
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    )
+
+    # empty while a file uploaded in the background is not in IPFS yet
+    file = models.FileField(storage=InterPlanetaryFileSystemStorage(), blank=True)
     name = models.CharField(max_length=255)
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='files')
+    # name of the file inside the IPFS directory wrapping it and its size in
+    # bytes, stored on upload so the daemon doesn't have to be asked for them
+    filename = models.CharField(max_length=255, blank=True)
+    size = models.BigIntegerField(null=True, blank=True)
+    # SHA-256 of the content, used to find files with the same content as an upload
+    digest = models.CharField(max_length=64, blank=True, db_index=True)
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default=READY)
 
     class Meta:
         ordering = ['name']
 
-    # TODO: do something with the ipfs hash
-    # either:
-    #  * define on save, or
-    #  * make it a models.Manager, or ...
-    #  * move to a dedicated serializer
-
     def __str__(self):
         return str(self.name)
+
+    def save(self, *args, **kwargs):
+        self.save_content()
+        super().save(*args, **kwargs)
+
+    def save_content(self):
+        """
+        Adds new content to IPFS, if any. Callers writing the row on the
+        writer thread call it first, so the writer isn't held up by IPFS.
+        """
+        if self.file and not self.file._committed:
+            content = self.file.file
+            self.digest = getattr(content, 'digest', '') or self.digest
+            self.file.save(self.file.name, content, save=False)
+            # the storage leaves the name of the file inside the wrapping directory on the content
+            self.filename, self.size = content.wrapped_name, content.size
+
+    @property
+    def url(self):
+        if self.filename:
+            return self.file.storage.wrapped_file_url(self.file.name, self.filename)
+        return self.file.url
+
+    @property
+    def file_size(self):
+        if self.size is not None:
+            return self.size
+        return self.file.size
+
+
+def find_by_digest(digest, filename=None):
+    """
+    Returns a file in IPFS with content matching the SHA-256 `digest`, or None.
+    Files wrapped under the name `filename` are preferred.
+    """
+    if not digest:
+        return None
+
+    files = File.objects \
+        .filter(digest=digest, status=File.READY) \
+        .exclude(file='')
+
+    if filename:
+        file = files.filter(filename=filename).first()
+        if file is not None:
+            return file
+
+    return files.first()
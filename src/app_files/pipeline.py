@@ -0,0 +1,129 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import humanize
+
+from django.conf import settings
+from django.core.files.base import File as DjangoFile
+from django.db import connection, transaction
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from flack.db import run_write
+
+from app_ws.codecs import share_attr, shared_frame
+from app_ws.groups import user_group_name
+
+from .models import File
+from .uploadhandlers import UPLOAD_STAGING_DIR
+
+# number of uploads added to IPFS at the same time in every process
+UPLOAD_WORKERS = getattr(settings, 'FLACK_UPLOAD_WORKERS', 4)
+
+executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+
+
+def staged_upload_path(file_id):
+    return os.path.join(UPLOAD_STAGING_DIR, 'file-{id}'.format(id=file_id))
+
+
+def submit_upload(file_id, staged_path):
+    """Adds the staged file `staged_path` to IPFS in the background, once the pending File is committed."""
+    # named after the file, so the upload can be resumed by recover_uploads
+    # if the process stops before it is done
+    path = staged_upload_path(file_id)
+    os.replace(staged_path, path)
+    transaction.on_commit(lambda: executor.submit(process_upload, file_id, path))
+
+
+def recover_uploads(resume=True):
+    """
+    Resumes, or fails, uploads left pending by processes which stopped before
+    they were done, and removes staged files no upload refers to. Must only be
+    called while no other process handles uploads. Returns the numbers of
+    uploads resumed and failed, and of staged files removed.
+    """
+    resumed = []
+    failed = 0
+
+    for file in File.objects.filter(status=File.PENDING).iterator():
+        path = staged_upload_path(file.id)
+
+        if resume and os.path.exists(path):
+            resumed.append(executor.submit(process_upload, file.id, path))
+        else:
+            file.status = File.FAILED
+            run_write(File.objects.filter(pk=file.id).update, status=File.FAILED)
+            notify_owner(file, error="The upload was interrupted.")
+            failed += 1
+
+    wait(resumed)
+
+    removed = 0
+    for name in os.listdir(UPLOAD_STAGING_DIR) if os.path.isdir(UPLOAD_STAGING_DIR) else ():
+        # resumed uploads remove their files when done, whatever is left is orphaned
+        os.remove(os.path.join(UPLOAD_STAGING_DIR, name))
+        removed += 1
+
+    return len(resumed), failed, removed
+
+
+def process_upload(file_id, staged_path):
+    try:
+        file = File.objects.filter(pk=file_id).first()
+        if file is None:
+            return
+
+        try:
+            with open(staged_path, 'rb') as content:
+                file.file = DjangoFile(content, name=file.name)
+                file.status = File.READY
+                file.save_content()
+                run_write(file.save)
+        except Exception as e:
+            print("upload of file {id} failed: {error}".format(id=file_id, error=e))
+
+            file.status = File.FAILED
+            run_write(File.objects.filter(pk=file_id).update, status=File.FAILED)
+            notify_owner(file, error="An error occurred while uploading the file to IPFS.")
+        else:
+            notify_owner(file)
+    finally:
+        try:
+            os.remove(staged_path)
+        except FileNotFoundError:
+            pass
+
+        # worker threads outlive requests, so their connections are never
+        # closed by Django
+        connection.close()
+
+
+def notify_owner(file, error=None):
+    """Tells every WebSocket connection of the file's owner that the upload has finished or failed."""
+    notification_attr = {
+        'object': 'file',
+        'id': file.id,
+        'name': file.name,
+        'status': file.status,
+    }
+
+    if error is None:
+        notification_attr.update({
+            'hash': file.file.name,
+            'size': humanize.naturalsize(file.file_size),
+            'url': file.url,
+        })
+    else:
+        notification_attr['error'] = error
+
+    notification = {
+        'type': 'broadcast'
+    }
+    notification.update(shared_frame('notification', share_attr(notification_attr)))
+
+    async_to_sync(get_channel_layer().group_send)(
+        user_group_name(file.owner_id),
+        notification
+    )
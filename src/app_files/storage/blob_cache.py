@@ -0,0 +1,101 @@
+import os
+import tempfile
+import threading
+
+
+class BlobCache:
+    """On-disk cache of IPFS content, keyed by multihash.
+
+    Content behind a multihash never changes, so cached blobs never go stale and
+    are only evicted to keep the cache within `max_size` bytes, least recently
+    used first. Recency is tracked through file modification times, which lets
+    several processes share one cache directory.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+        # bytes in the cache as last seen by this process, None until counted
+        self._size = None
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[-2:], key)
+
+    def open(self, key):
+        """Returns the cached blob `key` opened for reading or None on a miss."""
+        path = self.path(key)
+
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+
+        # marks the blob as recently used
+        os.utime(f.fileno())
+
+        return f
+
+    def put(self, key, chunks):
+        """Stores the blob `key` made of the byte strings yielded by `chunks` and returns it opened for reading."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # written under a temporary name first so readers never see a partial blob
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        size = 0
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        # opened before evicting, so the blob stays readable even if it has to go
+        f = open(path, 'rb')
+
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+
+        # a blob larger than the whole budget is only kept for the reader at hand
+        self.evict(keep=key if size <= self.max_size else None)
+
+        return f
+
+    def evict(self, keep=None):
+        """Removes least recently used blobs, other than `keep`, until the cache fits its budget."""
+        with self._lock:
+            if self._size is not None and self._size <= self.max_size:
+                return
+
+            blobs = []
+            for entry in os.scandir(self.directory):
+                if not entry.is_dir():
+                    continue
+                for blob in os.scandir(entry.path):
+                    try:
+                        stat = blob.stat()
+                    except FileNotFoundError:
+                        continue
+                    blobs.append((stat.st_mtime, stat.st_size, blob.name, blob.path))
+
+            self._size = sum(size for _, size, _, _ in blobs)
+
+            for _, size, name, path in sorted(blobs):
+                if self._size <= self.max_size:
+                    break
+                if name == keep:
+                    continue
+
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                self._size -= size
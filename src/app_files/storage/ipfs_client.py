@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import queue
+import threading
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# multihash of the empty UnixFS directory, which every node has
+EMPTY_DIRECTORY = 'QmUNLLsPACCz1vLxQVkXqqLX5R1X345qqfHbsf67hvA3Nn'
+
+
+class IPFSError(IOError):
+    pass
+
+
+class IPFSClient:
+    """Client for the subset of the IPFS daemon HTTP API used by the storage backend.
+
+    Instances are thread-safe. All calls share one pooled HTTP session, at most
+    `max_concurrency` calls are in flight at once and every call times out after
+    `timeout` seconds unless told otherwise. Streamed adds last as long as the
+    upload they are fed by, so they are limited to `max_streams` at once
+    separately, and never hold up other calls.
+    """
+
+    def __init__(self, api_url, timeout=30, max_connections=10, max_concurrency=10, max_streams=10):
+        self.api_url = api_url.rstrip('/') + '/'
+        self.timeout = timeout
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._stream_semaphore = threading.BoundedSemaphore(max_streams)
+
+    def request(self, path, params=None, files=None, timeout=None, data=None, headers=None, semaphore=None):
+        """POST to the API endpoint `path` and return the response body."""
+        with semaphore or self._semaphore:
+            try:
+                response = self._session.post(
+                    self.api_url + path,
+                    params=params,
+                    files=files,
+                    data=data,
+                    headers=headers,
+                    timeout=timeout or self.timeout
+                )
+            except requests.RequestException as e:
+                raise IPFSError("IPFS daemon request to '{path}' failed: {error}".format(path=path, error=e))
+
+        if response.status_code != 200:
+            self._raise_for_response(path, response)
+
+        return response.content
+
+    @staticmethod
+    def _raise_for_response(path, response):
+        try:
+            message = response.json().get('Message')
+        except ValueError:
+            message = response.text
+        raise IPFSError("IPFS daemon request to '{path}' failed: {message}".format(path=path, message=message))
+
+    def request_json(self, path, params=None, files=None, timeout=None):
+        return json.loads(self.request(path, params, files, timeout).decode())
+
+    def version(self):
+        return self.request_json('version')
+
+    def add(self, file, wrap_with_directory=False, pin=True, timeout=None):
+        """Add a file-like object. Returns a list of added objects, the wrapping directory last."""
+        filename = os.path.basename(getattr(file, 'name', None) or 'file')
+        params = {
+            'wrap-with-directory': str(wrap_with_directory).lower(),
+            'pin': str(pin).lower()
+        }
+        body = self.request('add', params=params, files={'file': (filename, file)}, timeout=timeout)
+
+        return self._parse_added(body)
+
+    def add_stream(self, chunks, filename, wrap_with_directory=False, pin=True, timeout=None):
+        """Add a file whose content is produced by the iterable of byte strings `chunks`.
+
+        The request body is sent with chunked transfer encoding as `chunks` yields,
+        so the content is never held in memory as a whole. Returns a list of added
+        objects, the wrapping directory last.
+        """
+        boundary = uuid.uuid4().hex
+        params = {
+            'wrap-with-directory': str(wrap_with_directory).lower(),
+            'pin': str(pin).lower()
+        }
+
+        def body():
+            yield (
+                '--{boundary}\r\n'
+                'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                'Content-Type: application/octet-stream\r\n\r\n'
+            ).format(boundary=boundary, filename=filename.replace('"', '%22')).encode()
+            # an empty chunk would end a chunked request body early
+            yield from (chunk for chunk in chunks if chunk)
+            yield '\r\n--{boundary}--\r\n'.format(boundary=boundary).encode()
+
+        body = self.request(
+            'add',
+            params=params,
+            data=body(),
+            headers={'Content-Type': 'multipart/form-data; boundary=' + boundary},
+            timeout=timeout,
+            semaphore=self._stream_semaphore
+        )
+
+        return self._parse_added(body)
+
+    @staticmethod
+    def _parse_added(body):
+        return [json.loads(line) for line in body.decode().splitlines() if line.strip()]
+
+    def pin_add(self, multihash):
+        return self.request_json('pin/add', params={'arg': multihash})
+
+    def pin_rm(self, multihash):
+        return self.request_json('pin/rm', params={'arg': multihash})
+
+    def cat(self, path):
+        return self.request('cat', params={'arg': path})
+
+    def cat_stream(self, path, chunk_size=64 * 2 ** 10):
+        """Yield the content at `path` in chunks of up to `chunk_size` bytes as it arrives from the daemon."""
+        with self._semaphore:
+            try:
+                response = self._session.post(
+                    self.api_url + 'cat',
+                    params={'arg': path},
+                    stream=True,
+                    timeout=self.timeout
+                )
+            except requests.RequestException as e:
+                raise IPFSError("IPFS daemon request to 'cat' failed: {error}".format(error=e))
+
+            with response:
+                if response.status_code != 200:
+                    self._raise_for_response('cat', response)
+
+                try:
+                    yield from response.iter_content(chunk_size)
+                except requests.RequestException as e:
+                    raise IPFSError("IPFS daemon request to 'cat' failed: {error}".format(error=e))
+
+    def ls(self, multihash):
+        return self.request_json('ls', params={'arg': multihash})
+
+    def object_stat(self, multihash):
+        return self.request_json('object/stat', params={'arg': multihash})
+
+    def object_patch_add_link(self, root, name, ref):
+        """Returns the object made by adding a link named `name` to `ref` to the directory `root`."""
+        return self.request_json('object/patch/add-link', params={'arg': [root, name, ref]})
+
+
+class AddStream:
+    """Adds a file to IPFS while its content is still being written.
+
+    Written chunks are handed through a queue holding at most `queue_size` of
+    them to a thread performing the add call, so writing blocks while the daemon
+    falls behind and memory use does not grow with the size of the file. The
+    size and SHA-256 digest of the content are computed along the way.
+    """
+
+    _END = object()
+
+    def __init__(self, client, filename, queue_size=4, wrap_with_directory=True, pin=True):
+        self.filename = filename
+        # seconds to wait for the next chunk before giving up on a writer which went away
+        self.idle_timeout = client.timeout
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+
+        self._queue = queue.Queue(queue_size)
+        self._aborted = False
+        self._added = None
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._add,
+            args=(client, wrap_with_directory, pin),
+            daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def digest(self):
+        return self._sha256.hexdigest()
+
+    def _chunks(self):
+        idle = 0
+
+        while True:
+            try:
+                chunk = self._queue.get(timeout=1)
+                idle = 0
+            except queue.Empty:
+                chunk = None
+                idle += 1
+
+            if self._aborted or idle > self.idle_timeout:
+                # breaks the connection instead of finishing the request, so a
+                # partial file is never added
+                raise IPFSError("add of '{filename}' aborted".format(filename=self.filename))
+            if chunk is self._END:
+                return
+            if chunk is not None:
+                yield chunk
+
+    def _add(self, client, wrap_with_directory, pin):
+        try:
+            self._added = client.add_stream(self._chunks(), self.filename, wrap_with_directory, pin)
+        except Exception as e:
+            self._error = e
+
+    def _put(self, item):
+        while True:
+            if self._error is not None:
+                raise self._error
+
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                if not self._thread.is_alive():
+                    raise IPFSError("add of '{filename}' stopped unexpectedly".format(filename=self.filename))
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        self._sha256.update(chunk)
+        self._put(chunk)
+
+    def close(self):
+        """Finish the add call and return the list of added objects, the wrapping directory last."""
+        self._put(self._END)
+        self._thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+        return self._added
+
+    def abort(self):
+        self._aborted = True
+
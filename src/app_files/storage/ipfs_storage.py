@@ -7,19 +7,23 @@ Original author: Ben Jeffrey (@jeffbr13, https://github.com/jeffbr13)
 """
 
 
-from urllib.parse import urlparse
-import ipfshttpclient
-from IPy import IP
-from multiaddr import Multiaddr
-
 from django.conf import settings
 from django.core.files.base import File, ContentFile
 from django.core.files.storage import Storage
 from django.utils.deconstruct import deconstructible
 
+from flack.metrics import Histogram, timed
+
+from .blob_cache import BlobCache
+from .ipfs_client import EMPTY_DIRECTORY, IPFSClient, AddStream
+
 
 __version__ = '0.0.4'
 
+IPFS_CALL_SECONDS = Histogram(
+    'flack_ipfs_storage_seconds', "Time taken by calls to the IPFS storage, by method.", ['method']
+)
+
 
 @deconstructible
 class InterPlanetaryFileSystemStorage(Storage):
@@ -29,8 +33,11 @@ class InterPlanetaryFileSystemStorage(Storage):
     due to the nature of the IPFS protocol.
     """
 
-    def __init__(self, api_url=None, gateway_url=None):
-        """Connect to Interplanetary File System daemon API to add/pin files.
+    def __init__(self, api_url=None, gateway_url=None, timeout=None, max_connections=None, max_concurrency=None,
+                 stream_queue_size=None, cache_dir=None, cache_size=None, max_streams=None):
+        """Set up a pooled client for the Interplanetary File System daemon API to add/pin files.
+
+        No connection is made until the first call to the daemon.
 
         :param api_url: IPFS control API base URL.
                         Also configurable via `settings.IPFS_STORAGE_API_URL`.
@@ -38,41 +45,112 @@ class InterPlanetaryFileSystemStorage(Storage):
         :param gateway_url: Base URL for IPFS Gateway (for HTTP-only clients).
                             Also configurable via `settings.IPFS_STORAGE_GATEWAY_URL`.
                             Defaults to 'https://ipfs.io/ipfs/'.
+        :param timeout: Seconds to wait for the daemon on each call.
+                        Also configurable via `settings.IPFS_STORAGE_TIMEOUT`.
+                        Defaults to 30.
+        :param max_connections: Maximum number of pooled HTTP connections to the daemon.
+                                Also configurable via `settings.IPFS_STORAGE_MAX_CONNECTIONS`.
+                                Defaults to 10.
+        :param max_concurrency: Maximum number of daemon calls in flight at once; further calls wait.
+                                Also configurable via `settings.IPFS_STORAGE_MAX_CONCURRENCY`.
+                                Defaults to 10.
+        :param stream_queue_size: Maximum number of chunks buffered per streamed add while the daemon catches up.
+                                  Also configurable via `settings.IPFS_STORAGE_STREAM_QUEUE_SIZE`.
+                                  Defaults to 4.
+        :param cache_dir: Directory of the local cache of content read from IPFS, or None to always read from the
+                          daemon. Also configurable via `settings.IPFS_STORAGE_CACHE_DIR`.
+                          Defaults to None.
+        :param cache_size: Maximum number of bytes kept in the local cache.
+                           Also configurable via `settings.IPFS_STORAGE_CACHE_SIZE`.
+                           Defaults to 1 GiB.
+        :param max_streams: Maximum number of streamed adds in flight at once; further uploads wait. Not counted
+                            towards `max_concurrency`, as they last as long as the uploads feeding them.
+                            Also configurable via `settings.IPFS_STORAGE_MAX_STREAMS`.
+                            Defaults to 10.
         """
-        parsed_api_url = urlparse(api_url or getattr(settings, 'IPFS_STORAGE_API_URL', 'http://localhost:5001/api/v0/'))
-        self._ipfs_client = ipfshttpclient.connect(
-            IPFSHelper.url_to_multiaddr(parsed_api_url),
-            parsed_api_url.path.strip('/')
-        )
+        api_url = api_url or getattr(settings, 'IPFS_STORAGE_API_URL', 'http://localhost:5001/api/v0/')
+        timeout = timeout or getattr(settings, 'IPFS_STORAGE_TIMEOUT', 30)
+        max_connections = max_connections or getattr(settings, 'IPFS_STORAGE_MAX_CONNECTIONS', 10)
+        max_concurrency = max_concurrency or getattr(settings, 'IPFS_STORAGE_MAX_CONCURRENCY', 10)
+        self.stream_queue_size = stream_queue_size or getattr(settings, 'IPFS_STORAGE_STREAM_QUEUE_SIZE', 4)
+        max_streams = max_streams or getattr(settings, 'IPFS_STORAGE_MAX_STREAMS', 10)
+
+        self._ipfs_client = IPFSClient(api_url, timeout, max_connections, max_concurrency, max_streams)
+        cache_dir = cache_dir or getattr(settings, 'IPFS_STORAGE_CACHE_DIR', None)
+        cache_size = cache_size or getattr(settings, 'IPFS_STORAGE_CACHE_SIZE', 2 ** 30)
+        self.blob_cache = BlobCache(cache_dir, cache_size) if cache_dir else None
         self.gateway_url = gateway_url or getattr(settings, 'IPFS_STORAGE_GATEWAY_URL', 'https://ipfs.io/ipfs/')
 
+    @timed(IPFS_CALL_SECONDS, 'open')
     def _open(self, name: str, mode='rb') -> File:
         """Retrieve the file content identified by multihash.
 
         :param name: IPFS Content ID multihash.
         :param mode: Ignored. The returned File instance is read-only.
         """
-        return ContentFile(self._ipfs_client.cat(name), name=name)
+        if self.blob_cache is None:
+            return ContentFile(self._ipfs_client.cat(name), name=name)
+
+        # content behind a multihash never changes, so a cached copy is always good
+        f = self.blob_cache.open(name)
+        if f is None:
+            f = self.blob_cache.put(name, self._ipfs_client.cat_stream(name))
 
+        return File(f, name=name)
+
+    @timed(IPFS_CALL_SECONDS, 'save')
     def _save(self, name: str, content: File) -> str:
         """Add and pin content to IPFS daemon.
 
+        The name of the file inside the wrapping directory is left on `content` as `wrapped_name`.
+
         :param name: Ignored. Provided to comply with `Storage` interface.
         :param content: Django File instance to save.
         :return: IPFS Content ID multihash.
         """
-        file = self._ipfs_client.add(content, wrap_with_directory=True)
+        if getattr(content, 'multihash', None):
+            # content has already been streamed to the daemon by `add_stream`
+            return content.multihash
+
+        # the daemon pins the wrapping directory, and the file with it, while adding
+        file = self._ipfs_client.add(content, wrap_with_directory=True, pin=True)
 
         if len(file) == 2:
             # storing hash for wrapping directory (file[1]) instead of the hash of file itself (file[0]) as only this
             # way file's name will not be lost
             file_wrapped = file[1]
-            file_hash = file_wrapped.get('Hash')
-            self._ipfs_client.pin.add(file_hash)
-            return file_hash
+            content.wrapped_name = file[0].get('Name')
+
+            return file_wrapped.get('Hash')
         else:
             raise IOError("An error occurred while uploading the file to IPFS.")
 
+    def add_stream(self, filename: str) -> AddStream:
+        """Start adding and pinning a file named `filename` whose content is written to the returned stream in
+        chunks. Closing the stream returns the list of added objects, the wrapping directory last.
+        """
+        return AddStream(self._ipfs_client, filename, self.stream_queue_size, wrap_with_directory=True, pin=True)
+
+    @timed(IPFS_CALL_SECONDS, 'stat_wrapped_file')
+    def stat_wrapped_file(self, name: str):
+        """Returns the name and size, in bytes, of the file wrapped in the directory with multihash `name`."""
+        link = self._ipfs_client.ls(name).get('Objects')[0].get('Links')[0]
+
+        return link.get('Name'), link.get('Size')
+
+    @timed(IPFS_CALL_SECONDS, 'rewrap')
+    def rewrap(self, name: str, filename: str) -> str:
+        """Wraps the file wrapped in the directory with multihash `name` in a new directory, named `filename`.
+        Only links are added, the content is not transferred again.
+
+        :return: IPFS Content ID multihash of the new, pinned, wrapping directory.
+        """
+        file_hash = self._ipfs_client.ls(name).get('Objects')[0].get('Links')[0].get('Hash')
+        directory = self._ipfs_client.object_patch_add_link(EMPTY_DIRECTORY, filename, file_hash).get('Hash')
+        self._ipfs_client.pin_add(directory)
+
+        return directory
+
     def get_valid_name(self, name):
         """Returns name. Only provided for compatibility with Storage interface."""
         return name
@@ -81,14 +159,17 @@ class InterPlanetaryFileSystemStorage(Storage):
         """Returns name. Only provided for compatibility with Storage interface."""
         return name
 
+    @timed(IPFS_CALL_SECONDS, 'size')
     def size(self, name: str) -> int:
         """Total size, in bytes, of IPFS content with multihash `name`."""
-        return self._ipfs_client.object.stat(name)['CumulativeSize']
+        return self._ipfs_client.object_stat(name)['CumulativeSize']
 
+    @timed(IPFS_CALL_SECONDS, 'delete')
     def delete(self, name: str):
         """Unpin IPFS content from the daemon."""
-        self._ipfs_client.pin.rm(name)
+        self._ipfs_client.pin_rm(name)
 
+    @timed(IPFS_CALL_SECONDS, 'url')
     def url(self, name: str):
         """Returns an HTTP-accessible Gateway URL by default.
 
@@ -101,56 +182,11 @@ class InterPlanetaryFileSystemStorage(Storage):
 
         filename = obj_list.get('Objects')[0].get('Links')[0].get('Name')
 
-        return '{gateway_url}{multihash}/{filename}'.format(gateway_url=self.gateway_url, multihash=name, filename=filename)
-
-
-class IPFSHelper:
-    @staticmethod
-    def _detect_dns_type(hostname):
-        try:
-            ip = IP(hostname)
-            return "ip" + str(ip.version())
-        except ValueError:
-            return "dns4"
-
-    @staticmethod
-    def _detect_port_number(scheme):
-        if scheme == "http" or scheme == "ws":
-            return 80
-        elif scheme == "https" or scheme == "wss":
-            return 443
-        else:
-            return 0
-
-    @staticmethod
-    def url_to_multiaddr(url, dns_type=None):
-        multiaddr_str = ""
+        return self.wrapped_file_url(name, filename)
 
-        hostname = url.hostname
-        scheme = url.scheme
-
-        # dns type
-        dt = dns_type
-        if dt is None:
-            dt = IPFSHelper._detect_dns_type(hostname)
-        multiaddr_str += f'/{dt}'
-
-        # hostname
-        multiaddr_str += f'/{hostname}'
-
-        # transport layer protocol
-        tlp = "tcp"
-        if scheme == "udp":
-            tlp = "udp"
-        multiaddr_str += f'/{tlp}'
-
-        # port
-        port = url.port
-        if port is None:
-            port = IPFSHelper._detect_port_number(scheme)
-        multiaddr_str += f'/{port}'
-
-        if scheme != tlp:
-            multiaddr_str += f'/{scheme}'
+    def wrapped_file_url(self, name: str, filename: str):
+        """Returns the Gateway URL of the file `filename` wrapped in the directory with multihash `name`, without
+        contacting the daemon.
+        """
+        return '{gateway_url}{multihash}/{filename}'.format(gateway_url=self.gateway_url, multihash=name, filename=filename)
 
-        return Multiaddr(multiaddr_str)
@@ -1,3 +1,289 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+
+from rest_framework.authtoken.models import Token
+
+from . import pipeline
+from .management.commands.fakeipfs import make_server
+from .models import File
+from .storage.ipfs_client import AddStream, IPFSClient, IPFSError
+from .uploadhandlers import StagingUploadHandler
+
+
+class FakeIPFSMixin:
+    """Points the file storage at a fake IPFS daemon, served from a thread of the test process."""
+    latency = 0
+
+    def setUp(self):
+        super().setUp()
+        self.server = make_server(port=0, latency=self.latency)
+        self.store = self.server.RequestHandlerClass.store
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.storage = File._meta.get_field('file').storage
+        self.ipfs_client = self.make_client()
+        patcher = mock.patch.object(self.storage, '_ipfs_client', self.ipfs_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def make_client(self, **kwargs):
+        return IPFSClient('http://127.0.0.1:{port}/api/v0/'.format(port=self.server.server_port), **kwargs)
+
+
+class IPFSClientTests(FakeIPFSMixin, SimpleTestCase):
+    def test_add_wraps_file_in_directory(self):
+        file, directory = self.ipfs_client.add(ContentFile(b'zdravo', name='notes.txt'), wrap_with_directory=True)
+
+        self.assertEqual(file['Name'], 'notes.txt')
+        self.assertEqual(self.ipfs_client.cat(directory['Hash'] + '/notes.txt'), b'zdravo')
+        self.assertEqual(self.ipfs_client.ls(directory['Hash'])['Objects'][0]['Links'][0]['Hash'], file['Hash'])
+        self.assertIn(directory['Hash'], self.store.pins)
+
+    def test_daemon_errors_are_raised(self):
+        with self.assertRaises(IPFSError):
+            self.ipfs_client.cat('QmMissing')
+
+    def test_add_stream(self):
+        chunks = [bytes([i]) * 2 ** 16 for i in range(20)]
+
+        stream = AddStream(self.ipfs_client, 'big.bin', queue_size=2)
+        for chunk in chunks:
+            stream.write(chunk)
+        file, directory = stream.close()
+
+        self.assertEqual(self.ipfs_client.cat(directory['Hash'] + '/big.bin'), b''.join(chunks))
+        self.assertEqual(stream.size, 20 * 2 ** 16)
+        self.assertEqual(stream.digest, hashlib.sha256(b''.join(chunks)).hexdigest())
+
+    def test_aborted_add_stream_adds_nothing(self):
+        stream = AddStream(self.ipfs_client, 'big.bin')
+        stream.write(b'partial')
+        stream.abort()
+
+        with self.assertRaises(IPFSError):
+            stream.close()
+        self.assertEqual(self.store.blobs, {})
+
+
+class IPFSClientPoolTests(FakeIPFSMixin, SimpleTestCase):
+    latency = 0.2
+
+    def call_concurrently(self, func, count):
+        threads = [threading.Thread(target=func) for _ in range(count)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.monotonic() - start
+
+    def test_calls_beyond_max_concurrency_wait(self):
+        self.assertGreaterEqual(self.call_concurrently(self.make_client(max_concurrency=2).version, 4), 0.4)
+        self.assertLess(self.call_concurrently(self.make_client(max_concurrency=4).version, 4), 0.4)
+
+    def test_streams_have_a_pool_of_their_own(self):
+        client = self.make_client(max_concurrency=1, max_streams=1)
+
+        first = AddStream(client, 'first.txt')
+        first.write(b'first')
+        while first._queue.qsize():
+            time.sleep(0.01)
+
+        second = AddStream(client, 'second.txt')
+        second.write(b'second')
+
+        # other calls aren't held up by the open stream, the second stream is
+        self.assertLess(self.call_concurrently(client.version, 1), 0.4)
+        self.assertEqual(second._queue.qsize(), 1)
+
+        first.close()
+        second.close()
+        self.assertEqual(client.cat(self.store.multihash(b'second')), b'second')
+
+
+class FileMetadataTests(FakeIPFSMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create(username='alice')
+
+    def test_metadata_is_stored_on_upload(self):
+        file = File.objects.create(name='notes', owner=self.user, file=ContentFile(b'zdravo', name='notes.txt'))
+
+        self.assertEqual((file.filename, file.size), ('notes.txt', 6))
+        self.assertEqual(file.url, self.storage.wrapped_file_url(file.file.name, 'notes.txt'))
+
+    def test_identical_concurrent_uploads_get_their_own_metadata(self):
+        files = [
+            File(name='notes', owner=self.user, file=ContentFile(b'zdravo', name='notes.txt')) for _ in range(4)
+        ]
+        barrier = threading.Barrier(len(files))
+        save = self.storage._save
+
+        def _save(name, content):
+            name = save(name, content)
+            # every upload is added before any of them gets to its metadata
+            barrier.wait(5)
+            return name
+
+        threads = [threading.Thread(target=file.save_content) for file in files]
+        with mock.patch.object(self.storage, '_save', _save):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len({file.file.name for file in files}), 1)
+        for file in files:
+            self.assertEqual((file.filename, file.size), ('notes.txt', 6))
+
+
+class DeduplicationTests(FakeIPFSMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = get_user_model().objects.create(username='alice')
+        self.bob = get_user_model().objects.create(username='bob')
+        self.original = self.upload(self.alice, 'notes.txt')
+
+    def upload(self, user, name, content=b'zdravo'):
+        token, _ = Token.objects.get_or_create(user=user)
+        response = self.client.put(
+            '/api/files/upload/',
+            encode_multipart(BOUNDARY, {'token': token.key, 'file': SimpleUploadedFile(name, content)}),
+            content_type=MULTIPART_CONTENT
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['file']
+
+    def test_same_content_and_name_asks_the_daemon_nothing(self):
+        wrapped = self.upload(self.bob, 'report.txt')
+
+        with mock.patch.object(self.ipfs_client, 'request', wraps=self.ipfs_client.request) as request:
+            file = self.upload(self.alice, 'report.txt')
+
+        request.assert_not_called()
+        self.assertTrue(file['deduplicated'])
+        self.assertEqual((file['hash'], file['url']), (wrapped['hash'], wrapped['url']))
+
+    def test_same_content_is_wrapped_under_the_uploaders_name(self):
+        with mock.patch.object(self.ipfs_client, 'request', wraps=self.ipfs_client.request) as request:
+            file = self.upload(self.bob, 'report.txt')
+
+        # the content itself is never added again
+        self.assertEqual([call[0][0] for call in request.call_args_list], ['ls', 'object/patch/add-link', 'pin/add'])
+        self.assertTrue(file['deduplicated'])
+        self.assertNotEqual(file['hash'], self.original['hash'])
+        self.assertTrue(file['url'].endswith('/report.txt'))
+        self.assertEqual(self.ipfs_client.cat(file['hash'] + '/report.txt'), b'zdravo')
+        self.assertIn(file['hash'], self.store.pins)
+        self.assertEqual(File.objects.get(pk=file['id']).filename, 'report.txt')
+
+    def test_different_content_is_added(self):
+        file = self.upload(self.bob, 'notes.txt', b'bok')
+
+        self.assertFalse(file['deduplicated'])
+        self.assertEqual(self.ipfs_client.cat(file['hash'] + '/notes.txt'), b'bok')
+
+
+class BackgroundUploadTests(FakeIPFSMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create(username='alice')
+        self.token = Token.objects.create(user=self.user).key
+
+        self.staging_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.staging_dir)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+
+        for patcher in (
+            mock.patch('app_files.api.views.StagingUploadHandler',
+                       partial(StagingUploadHandler, staging_dir=self.staging_dir)),
+            mock.patch('app_files.pipeline.UPLOAD_STAGING_DIR', self.staging_dir),
+            mock.patch('app_files.pipeline.executor', self.executor),
+            mock.patch('app_files.pipeline.notify_owner'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def upload(self, name, content):
+        return self.client.put(
+            '/api/files/upload/?async=true&token={token}'.format(token=self.token),
+            encode_multipart(BOUNDARY, {'file': SimpleUploadedFile(name, content)}),
+            content_type=MULTIPART_CONTENT
+        )
+
+    def stage(self, file, content):
+        with open(pipeline.staged_upload_path(file.id), 'wb') as f:
+            f.write(content)
+
+    def test_upload_is_added_in_the_background(self):
+        response = self.upload('notes.txt', b'zdravo')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['file']['status'], File.PENDING)
+
+        self.executor.shutdown(wait=True)
+        file = File.objects.get(pk=response.json()['file']['id'])
+
+        self.assertEqual((file.status, file.filename, file.size), (File.READY, 'notes.txt', 6))
+        self.assertEqual(self.ipfs_client.cat(file.file.name + '/' + file.filename), b'zdravo')
+        pipeline.notify_owner.assert_called_once_with(mock.ANY)
+        self.assertEqual(os.listdir(self.staging_dir), [])
+
+    def test_failed_upload_is_marked_failed(self):
+        with mock.patch.object(self.ipfs_client, 'add', side_effect=IPFSError("daemon is down")):
+            response = self.upload('notes.txt', b'zdravo')
+            self.executor.shutdown(wait=True)
+
+        file = File.objects.get(pk=response.json()['file']['id'])
+
+        self.assertEqual(file.status, File.FAILED)
+        pipeline.notify_owner.assert_called_once_with(mock.ANY, error=mock.ANY)
+        self.assertEqual(os.listdir(self.staging_dir), [])
+
+    def test_recovery_resumes_staged_uploads(self):
+        staged = File.objects.create(name='staged.txt', owner=self.user, status=File.PENDING)
+        lost = File.objects.create(name='lost.txt', owner=self.user, status=File.PENDING)
+        self.stage(staged, b'zdravo')
+        open(os.path.join(self.staging_dir, 'upload-orphan'), 'wb').close()
+
+        self.assertEqual(pipeline.recover_uploads(), (1, 1, 1))
+
+        staged.refresh_from_db()
+        lost.refresh_from_db()
+        self.assertEqual((staged.status, staged.filename), (File.READY, 'staged.txt'))
+        self.assertEqual(self.ipfs_client.cat(staged.file.name + '/' + staged.filename), b'zdravo')
+        self.assertEqual(lost.status, File.FAILED)
+        self.assertEqual(os.listdir(self.staging_dir), [])
+
+    def test_recovery_can_fail_staged_uploads(self):
+        staged = File.objects.create(name='staged.txt', owner=self.user, status=File.PENDING)
+        self.stage(staged, b'zdravo')
+
+        out = io.StringIO()
+        call_command('recover_uploads', '--fail', stdout=out)
+
+        self.assertIn('0 uploads resumed, 1 failed, 1 staged files removed', out.getvalue())
+        staged.refresh_from_db()
+        self.assertEqual(staged.status, File.FAILED)
+        self.assertEqual(os.listdir(self.staging_dir), [])
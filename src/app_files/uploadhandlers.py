@@ -0,0 +1,171 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+
+# size of the request body chunks passed on to the IPFS daemon while streaming
+UPLOAD_CHUNK_SIZE = getattr(settings, 'FLACK_UPLOAD_CHUNK_SIZE', 64 * 2 ** 10)
+# directory uploads are kept in until they are added to IPFS in the background
+UPLOAD_STAGING_DIR = getattr(settings, 'FLACK_UPLOAD_STAGING_DIR', os.path.join(tempfile.gettempdir(), 'flack-uploads'))
+
+
+def content_digest(file):
+    """Returns the SHA-256 of the content of an uploaded `file`, in hex, leaving it at the start."""
+    sha256 = hashlib.sha256()
+
+    for chunk in file.chunks():
+        sha256.update(chunk)
+
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+class IPFSUploadedFile(UploadedFile):
+    """
+    A file which has already been added to IPFS while being uploaded. Saving it
+    to the IPFS storage only records the multihash of its wrapping directory.
+    """
+
+    def __init__(self, name, content_type, size, charset, multihash, wrapped_name, digest, content_type_extra=None):
+        super().__init__(None, name, content_type, size, charset, content_type_extra)
+        self.multihash = multihash
+        self.wrapped_name = wrapped_name
+        self.digest = digest
+
+    def open(self, mode=None):
+        raise ValueError("The content of a streamed upload is only available from IPFS.")
+
+    def close(self):
+        pass
+
+
+class IPFSStreamingUploadHandler(FileUploadHandler):
+    """
+    Streams uploaded files to IPFS as the request body is read instead of
+    spooling them to memory or disk first. Only as many chunks as the storage
+    queues for a streamed add are held in memory at a time.
+    """
+
+    chunk_size = UPLOAD_CHUNK_SIZE
+
+    def __init__(self, storage, request=None):
+        super().__init__(request)
+        self.storage = storage
+        self.stream = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.stream = self.storage.add_stream(self.file_name)
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.stream.write(raw_data)
+
+    def file_complete(self, file_size):
+        stream, self.stream = self.stream, None
+        added = stream.close()
+
+        if len(added) != 2:
+            raise IOError("An error occurred while uploading the file to IPFS.")
+
+        return IPFSUploadedFile(
+            name=self.file_name,
+            content_type=self.content_type,
+            size=stream.size,
+            charset=self.charset,
+            multihash=added[1].get('Hash'),
+            wrapped_name=added[0].get('Name'),
+            digest=stream.digest,
+            content_type_extra=self.content_type_extra
+        )
+
+    def upload_complete(self):
+        # a stream still open here belongs to a file whose content was cut short
+        self.abort()
+
+    def abort(self):
+        """Abandon the file being streamed, if any, without adding it to IPFS."""
+        if self.stream is not None:
+            self.stream.abort()
+            self.stream = None
+
+
+class StagedUploadedFile(UploadedFile):
+    """
+    A file uploaded to the staging directory. The staged file is removed when
+    the upload is closed, unless it has been handed over with `detach`.
+    """
+
+    def __init__(self, file, name, content_type, size, charset, digest, content_type_extra=None):
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        self.digest = digest
+        self.detached = False
+
+    @property
+    def staged_path(self):
+        return self.file.name
+
+    def detach(self):
+        """Keeps the staged file around after the upload is closed and returns its path."""
+        self.detached = True
+        return self.staged_path
+
+    def close(self):
+        try:
+            return self.file.close()
+        finally:
+            if not self.detached:
+                try:
+                    os.remove(self.staged_path)
+                except FileNotFoundError:
+                    pass
+
+
+class StagingUploadHandler(FileUploadHandler):
+    """
+    Writes uploaded files to the staging directory, computing their SHA-256
+    digest along the way, so they can be added to IPFS after the response.
+    """
+
+    chunk_size = UPLOAD_CHUNK_SIZE
+
+    def __init__(self, request=None, staging_dir=UPLOAD_STAGING_DIR):
+        super().__init__(request)
+        self.staging_dir = staging_dir
+        self.file = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        os.makedirs(self.staging_dir, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=self.staging_dir, prefix='upload-', delete=False)
+        self.sha256 = hashlib.sha256()
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file.write(raw_data)
+        self.sha256.update(raw_data)
+
+    def file_complete(self, file_size):
+        file, self.file = self.file, None
+        file.flush()
+        file.seek(0)
+
+        return StagedUploadedFile(
+            file=file,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            digest=self.sha256.hexdigest(),
+            content_type_extra=self.content_type_extra
+        )
+
+    def upload_complete(self):
+        # a file still open here had its content cut short
+        if self.file is not None:
+            self.file.close()
+            os.remove(self.file.name)
+            self.file = None
@@ -1,6 +1,5 @@
 from django.contrib import admin
 
-from .models import Location, Message
+from .models import Message
 
-admin.site.register(Location)
 admin.site.register(Message)
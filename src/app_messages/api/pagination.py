@@ -0,0 +1,60 @@
+from collections import OrderedDict
+
+from django.conf import settings
+
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# number of messages in a history page unless the client asks for another
+HISTORY_PAGE_SIZE = getattr(settings, 'FLACK_HISTORY_PAGE_SIZE', 50)
+# maximum number of messages in a history page
+HISTORY_MAX_PAGE_SIZE = getattr(settings, 'FLACK_HISTORY_MAX_PAGE_SIZE', 200)
+
+
+def int_param(request, name, default=None):
+    value = request.query_params.get(name)
+    if value is None:
+        return default
+
+    try:
+        return int(value)
+    except ValueError:
+        raise ParseError(detail="invalid {name} provided".format(name=name))
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pages through a queryset from the newest object to the oldest one. A page
+    holds objects with a primary key lower than `before`, so it is a single
+    index range scan no matter how far back it is.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+
+        before = int_param(request, 'before')
+        limit = min(max(int_param(request, 'limit', HISTORY_PAGE_SIZE), 1), HISTORY_MAX_PAGE_SIZE)
+
+        if before is not None:
+            queryset = queryset.filter(pk__lt=before)
+
+        # one more than asked for tells whether there is another page
+        page = list(queryset.order_by('-pk')[:limit + 1])
+
+        self.before = page[limit - 1].pk if len(page) > limit else None
+        return page[:limit]
+
+    def get_next_link(self):
+        if self.before is None:
+            return None
+
+        return replace_query_param(self.request.build_absolute_uri(), 'before', self.before)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('before', self.before),
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
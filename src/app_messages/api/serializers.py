@@ -10,17 +10,14 @@ class MessageModelSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Message
-        fields = '__all__'
+        exclude = ('latitude', 'longitude')
 
     def get_location(self, obj):
-        if obj.location:
-            # keeping it ISO 6709
-            return {'latitude': obj.location.lat, 'longitude': obj.location.lon}
-        return None
+        return obj.location
 
     def get_file(self, obj):
         if obj.file:
-            return {'name': obj.file.name, 'url': obj.file.file.url}
+            return {'name': obj.file.name, 'url': obj.file.url}
         return None
 
     def get_sender(self, obj):
@@ -1,9 +1,10 @@
 from django.urls import path
 
-from .views import MessageListAPIView
+from .views import MessageListAPIView, MessageHistoryAPIView
 
 app_name = 'api'
 
 urlpatterns = [
-    path('', MessageListAPIView.as_view(), name='list')
+    path('', MessageListAPIView.as_view(), name='list'),
+    path('history/', MessageHistoryAPIView.as_view(), name='history')
 ]
@@ -1,10 +1,17 @@
+from django.utils.decorators import method_decorator
+
 from rest_framework import generics
-from rest_framework.authtoken.models import Token
-from rest_framework.exceptions import ParseError, AuthenticationFailed
+from rest_framework.exceptions import NotFound, ParseError
+
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
+
+from app_auth.authentication import TokenParameterAuthentication
 
 from app_rooms.models import Room
 
 from ..models import Message
+from .pagination import KeysetPagination, int_param
 from .serializers import MessageModelSerializer
 
 
@@ -16,51 +23,96 @@ class MessageListAPIView(generics.ListAPIView):
     """
     queryset = Message.objects.all()
     serializer_class = MessageModelSerializer
+    authentication_classes = (TokenParameterAuthentication,)
 
     def get_queryset(self, *args, **kwargs):
-        qs = self.queryset.none()
-        token = self.request.GET.get("token")
         room_since = self.request.GET.get("room")
         message_since = self.request.GET.get("message")
 
-        if token is not None:
-            token_objs = Token.objects.filter(key=token)
+        qs = self.queryset.all()
+        user = self.request.user
+
+        qs = qs.filter(room__participants=user)
 
-            if token_objs.exists():
-                qs = self.queryset.all()
-                token_obj = token_objs.first()
-                user = token_obj.user
+        if room_since is not None:
+            room_objs = Room.objects.filter(pk=room_since)
 
-                qs = qs.filter(room__participants=user)
+            if room_objs.exists():
+                room_obj = room_objs.first()
+                time_since = room_obj.time_created
 
-                if room_since is not None:
-                    room_objs = Room.objects.filter(pk=room_since)
+                qs = qs.filter(time__gt=time_since)
 
-                    if room_objs.exists():
-                        room_obj = room_objs.first()
-                        time_since = room_obj.time_created
+            else:
+                raise ParseError(detail="invalid room id provided")
 
-                        qs = qs.filter(time__gt=time_since)
+        elif message_since is not None:
+            message_objs = Message.objects.filter(pk=message_since)
 
-                    else:
-                        raise ParseError(detail="invalid room id provided")
+            if message_objs.exists():
+                message_obj = message_objs.first()
+                time_since = message_obj.time
 
-                elif message_since is not None:
-                    message_objs = Message.objects.filter(pk=message_since)
+                qs = qs.filter(time__gt=time_since)
 
-                    if message_objs.exists():
-                        message_obj = message_objs.first()
-                        time_since = message_obj.time
+            else:
+                raise ParseError(detail="invalid message id provided")
 
-                        qs = qs.filter(time__gt=time_since)
+        return qs
 
-                    else:
-                        raise ParseError(detail="invalid message id provided")
 
-            else:
-                raise AuthenticationFailed(detail="token invalid")
+@method_decorator(name='get', decorator=swagger_auto_schema(
+    manual_parameters=[
+        openapi.Parameter(
+            name="token",
+            in_=openapi.IN_QUERY,
+            type=openapi.TYPE_STRING,
+            required=True
+        ),
+        openapi.Parameter(
+            name="room",
+            in_=openapi.IN_QUERY,
+            description="ID of the room. The user has to participate in it.",
+            type=openapi.TYPE_INTEGER,
+            required=True
+        ),
+        openapi.Parameter(
+            name="before",
+            in_=openapi.IN_QUERY,
+            description="Only messages with a lower ID are returned. Pass the 'before' value of the previous page "
+                        "to get the next one, or leave it out to start from the newest message.",
+            type=openapi.TYPE_INTEGER,
+            required=False
+        ),
+        openapi.Parameter(
+            name="limit",
+            in_=openapi.IN_QUERY,
+            description="Number of messages in the page, 50 by default and at most 200.",
+            type=openapi.TYPE_INTEGER,
+            required=False
+        ),
+    ]
+))
+class MessageHistoryAPIView(generics.ListAPIView):
+    """
+    Message history of a room, one page at a time, from the newest message to the oldest one. Pages are
+    returned along with the `before` value of the next page and its URL, both `null` on the last page.
+    """
+    queryset = Message.objects.all()
+    serializer_class = MessageModelSerializer
+    authentication_classes = (TokenParameterAuthentication,)
+    pagination_class = KeysetPagination
 
-        else:
-            raise AuthenticationFailed(detail="token not provided")
+    def get_queryset(self, *args, **kwargs):
+        room = int_param(self.request, 'room')
 
-        return qs
+        if room is None:
+            raise ParseError(detail="no room id provided")
+
+        if not Room.objects.filter(pk=room, participants=self.request.user).exists():
+            raise NotFound(detail="invalid room id provided")
+
+        # messages of a room ordered by ID come straight from the (room, id)
+        # index
+        return self.queryset.filter(room_id=room) \
+            .select_related('sender', 'file')
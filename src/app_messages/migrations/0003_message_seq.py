@@ -0,0 +1,41 @@
+# Generated by Django 2.1.5 on 2026-10-18 11:04
+
+from django.db import migrations, models
+
+
+def number_messages(apps, schema_editor):
+    Room = apps.get_model('app_rooms', 'Room')
+    Message = apps.get_model('app_messages', 'Message')
+
+    for room in Room.objects.all():
+        seq = 0
+
+        for message in Message.objects.filter(room=room).order_by('time', 'pk'):
+            seq += 1
+            message.seq = seq
+            message.save(update_fields=['seq'])
+
+        room.last_seq = seq
+        room.save(update_fields=['last_seq'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_rooms', '0006_room_last_seq'),
+        ('app_messages', '0002_auto_20180823_0855'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveIntegerField(default=0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.RunPython(number_messages, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='message',
+            unique_together={('room', 'seq')},
+        ),
+    ]
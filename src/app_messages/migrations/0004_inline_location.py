@@ -0,0 +1,53 @@
+# Generated by Django 2.1.5 on 2026-10-18 13:26
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fold_in_locations(apps, schema_editor):
+    Location = apps.get_model('app_messages', 'Location')
+    Message = apps.get_model('app_messages', 'Message')
+
+    locations = Location.objects.filter(pk=OuterRef('location_id'))
+
+    Message.objects.filter(location__isnull=False).update(
+        latitude=Subquery(locations.values('lat')[:1]),
+        longitude=Subquery(locations.values('lon')[:1])
+    )
+
+
+def split_out_locations(apps, schema_editor):
+    Location = apps.get_model('app_messages', 'Location')
+    Message = apps.get_model('app_messages', 'Message')
+
+    for message in Message.objects.filter(latitude__isnull=False, longitude__isnull=False):
+        message.location = Location.objects.create(lat=message.latitude, lon=message.longitude)
+        message.save(update_fields=['location'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_messages', '0003_message_seq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(fold_in_locations, split_out_locations),
+        migrations.RemoveField(
+            model_name='message',
+            name='location',
+        ),
+        migrations.DeleteModel(
+            name='Location',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.1.5 on 2026-10-18 11:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_messages', '0004_inline_location'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'id'], name='app_message_room_id_idx'),
+        ),
+    ]
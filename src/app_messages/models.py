@@ -1,15 +1,11 @@
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 
 from app_files.models import File
 from app_rooms.models import Room
 
 
-class Location(models.Model):
-    lat = models.FloatField()
-    lon = models.FloatField()
-
-
 class Message(models.Model):
     content = models.TextField()
     # TODO: maybe replace CASCADE with a nicer alternative
@@ -17,5 +13,44 @@ class Message(models.Model):
     file = models.ForeignKey(File, on_delete=models.CASCADE, null=True, blank=True)
     room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    location = models.OneToOneField(Location, on_delete=models.CASCADE, null=True, blank=True)
+    # location the message was sent from, if shared by the sender
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
     time = models.DateTimeField(auto_now_add=True)
+    # position of the message in its room, starting from 1 and increasing by
+    # one with every message sent to the room
+    seq = models.PositiveIntegerField(editable=False)
+
+    class Meta:
+        unique_together = ('room', 'seq')
+        indexes = [
+            # history pages of a room are read by ID
+            models.Index(fields=['room', 'id'], name='app_message_room_id_idx'),
+        ]
+
+    @property
+    def location(self):
+        if self.latitude is None or self.longitude is None:
+            return None
+
+        # keeping it ISO 6709
+        return {'latitude': self.latitude, 'longitude': self.longitude}
+
+    def save(self, *args, **kwargs):
+        if self.seq is None:
+            with transaction.atomic():
+                self.seq = allocate_seq(self.room_id)
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+
+
+def allocate_seq(room_id, count=1):
+    """
+    Reserves `count` consecutive sequence numbers in a room and returns the
+    first one. Has to be called inside a transaction, which keeps the room row
+    locked until the messages using the numbers are stored.
+    """
+    Room.objects.filter(pk=room_id).update(last_seq=F('last_seq') + count)
+    last_seq = Room.objects.filter(pk=room_id).values_list('last_seq', flat=True).get()
+    return last_seq - count + 1
@@ -1,3 +1,109 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.test import TestCase
 
-# Create your tests here.
+from rest_framework.authtoken.models import Token
+
+from app_rooms.models import Room
+
+from .models import Message, allocate_seq
+
+
+def create_room(creator, *participants):
+    room = Room.objects.create(creator=creator, name='room')
+    # rooms have at least 2 participants
+    room.participants.add(creator, *participants)
+    return room
+
+
+class SeqAllocationTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+
+    def test_seq_counts_messages_of_each_room(self):
+        room = create_room(self.alice, self.bob)
+        other_room = create_room(self.bob, self.alice)
+
+        seqs = [Message.objects.create(room=room, sender=self.alice, content=str(i)).seq for i in range(3)]
+        other_seq = Message.objects.create(room=other_room, sender=self.bob, content='hi').seq
+
+        self.assertEqual(seqs, [1, 2, 3])
+        self.assertEqual(other_seq, 1)
+        room.refresh_from_db()
+        self.assertEqual(room.last_seq, 3)
+
+    def test_allocate_seq_reserves_consecutive_numbers(self):
+        room = create_room(self.alice, self.bob)
+
+        with transaction.atomic():
+            first = allocate_seq(room.pk, count=5)
+
+        self.assertEqual(first, 1)
+        self.assertEqual(Message.objects.create(room=room, sender=self.alice, content='hi').seq, 6)
+
+    def test_given_seq_is_kept(self):
+        room = create_room(self.alice, self.bob)
+
+        message = Message.objects.create(room=room, sender=self.alice, content='hi', seq=42)
+
+        self.assertEqual(message.seq, 42)
+        room.refresh_from_db()
+        self.assertEqual(room.last_seq, 0)
+
+
+class HistoryPaginationTests(TestCase):
+    url = '/api/messages/history/'
+
+    def setUp(self):
+        User = get_user_model()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.carol = User.objects.create(username='carol')
+        self.token = Token.objects.create(user=self.alice).key
+
+        self.room = create_room(self.alice, self.bob)
+        self.messages = [
+            Message.objects.create(room=self.room, sender=self.bob, content=str(i)) for i in range(7)
+        ]
+        # messages of other rooms never show up
+        Message.objects.create(room=create_room(self.bob, self.carol), sender=self.bob, content='other')
+
+    def get(self, **params):
+        params.setdefault('token', self.token)
+        params.setdefault('room', self.room.pk)
+        return self.client.get(self.url, params)
+
+    def test_pages_go_from_newest_to_oldest(self):
+        ids = [message.pk for message in reversed(self.messages)]
+
+        first = self.get(limit=3).json()
+        self.assertEqual([message['id'] for message in first['results']], ids[:3])
+        self.assertEqual(first['before'], ids[2])
+        self.assertIn('before={before}'.format(before=ids[2]), first['next'])
+
+        second = self.get(limit=3, before=first['before']).json()
+        self.assertEqual([message['id'] for message in second['results']], ids[3:6])
+
+        last = self.get(limit=3, before=second['before']).json()
+        self.assertEqual([message['id'] for message in last['results']], ids[6:])
+        self.assertIsNone(last['before'])
+        self.assertIsNone(last['next'])
+
+    def test_last_page_filled_exactly_has_no_next_page(self):
+        response = self.get(limit=7).json()
+
+        self.assertEqual(len(response['results']), 7)
+        self.assertIsNone(response['before'])
+
+    def test_limit_is_clamped(self):
+        self.assertEqual(len(self.get(limit=0).json()['results']), 1)
+
+    def test_invalid_before_is_rejected(self):
+        self.assertEqual(self.get(before='x').status_code, 400)
+
+    def test_rooms_of_others_are_not_found(self):
+        token = Token.objects.create(user=self.carol).key
+
+        self.assertEqual(self.get(token=token).status_code, 404)
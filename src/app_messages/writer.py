@@ -0,0 +1,130 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from flack.db import run_write
+from flack.metrics import Gauge
+
+from .models import Message, allocate_seq
+
+# whether messages sent over WebSocket are stored in batches by a writer thread
+MESSAGE_BATCHING = getattr(settings, 'FLACK_MESSAGE_BATCHING', False)
+# maximum number of messages stored in a single transaction
+MESSAGE_BATCH_SIZE = getattr(settings, 'FLACK_MESSAGE_BATCH_SIZE', 100)
+# seconds the writer waits for more messages after the first one of a batch
+MESSAGE_BATCH_DELAY = getattr(settings, 'FLACK_MESSAGE_BATCH_DELAY', 0.005)
+
+
+def bulk_create_with_pks(model, objs):
+    """
+    Inserts `objs` with a single query and makes sure their primary keys are
+    set, even on databases which don't return them from bulk inserts. Has to
+    be called inside a transaction, so no other rows are inserted meanwhile.
+    """
+    model.objects.bulk_create(objs)
+
+    if objs and objs[0].pk is None:
+        # rows inserted by one statement get consecutive keys, in order
+        pks = model.objects.order_by('-pk').values_list('pk', flat=True)[:len(objs)]
+        for obj, pk in zip(objs, reversed(pks)):
+            obj.pk = pk
+            obj._state.adding = False
+            obj._state.db = model.objects.db
+
+    return objs
+
+
+class MessageWriter:
+    """
+    Stores messages from all consumers of the process in batches, each in a
+    single transaction, so every message doesn't cost a commit of its own.
+
+    Messages are queued by `save` and written by a thread which waits up to
+    `max_delay` seconds for up to `max_size` messages to gather after the
+    first one. The futures returned by `save` resolve once the batch commits.
+    """
+
+    def __init__(self, max_size=100, max_delay=0.005):
+        self.max_size = max_size
+        self.max_delay = max_delay
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def save(self, message):
+        """Queues `message` and returns a Future resolving to it once it is stored."""
+        self._start()
+
+        future = Future()
+        self._queue.put((message, future))
+        return future
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+
+            while len(batch) < self.max_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            close_old_connections()
+            run_write(self._write, batch)
+
+    def _write(self, batch):
+        try:
+            self._write_batch(batch)
+        except Exception as e:
+            print("writing a batch of {count} messages failed, writing them one by one: {error}".format(
+                count=len(batch), error=e
+            ))
+
+            # one bad message must not take the others down with it
+            for message, future in batch:
+                # drop anything assigned by the rolled back batch
+                message.pk = message.seq = None
+
+                try:
+                    message.save()
+                    future.set_result(message)
+                except Exception as e:
+                    future.set_exception(e)
+        else:
+            for message, future in batch:
+                future.set_result(message)
+
+    def _write_batch(self, batch):
+        with transaction.atomic():
+            messages_by_room = defaultdict(list)
+            for message, _ in batch:
+                messages_by_room[message.room_id].append(message)
+
+            for room_id, messages in messages_by_room.items():
+                first_seq = allocate_seq(room_id, len(messages))
+                for offset, message in enumerate(messages):
+                    message.seq = first_seq + offset
+
+            bulk_create_with_pks(Message, [message for message, _ in batch])
+
+
+message_writer = MessageWriter(MESSAGE_BATCH_SIZE, MESSAGE_BATCH_DELAY) if MESSAGE_BATCHING else None
+
+Gauge('flack_message_writer_queued', "Messages waiting to be stored by the writer thread.",
+      function=lambda: message_writer._queue.qsize() if message_writer is not None else 0)
@@ -12,3 +12,11 @@ class RoomModelSerializer(serializers.ModelSerializer):
             'time_created',
             'participants',
         ]
+
+
+class RoomSummarySerializer(serializers.Serializer):
+    """Serializes summaries from the room cache the same way RoomModelSerializer serializes rooms."""
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    time_created = serializers.DateTimeField()
+    participants = serializers.ListField(child=serializers.IntegerField())
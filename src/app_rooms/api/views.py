@@ -1,13 +1,15 @@
 from datetime import datetime
 
 from rest_framework import generics
-from rest_framework.authtoken.models import Token
-from rest_framework.exceptions import ParseError, AuthenticationFailed
+from rest_framework.exceptions import ParseError
+
+from app_auth.authentication import TokenParameterAuthentication
 
 from app_messages.models import Message
 
+from ..cache import room_cache
 from ..models import Room
-from .serializers import RoomModelSerializer
+from .serializers import RoomSummarySerializer
 
 
 class RoomListAPIView(generics.ListAPIView):
@@ -17,52 +19,42 @@ class RoomListAPIView(generics.ListAPIView):
     Room list API endpoint. Updates are delivered via WS, so this endpoint should **not** be used.
     """
     queryset = Room.objects.all()
-    serializer_class = RoomModelSerializer
+    serializer_class = RoomSummarySerializer
+    authentication_classes = (TokenParameterAuthentication,)
 
     def get_queryset(self, *args, **kwargs):
-        qs = self.queryset.none()
-        token = self.request.GET.get("token")
         room_since = self.request.GET.get("room")
         message_since = self.request.GET.get("message")
 
-        if token is not None:
-            token_objs = Token.objects.filter(key=token)
-
-            if token_objs.exists():
-                qs = self.queryset.all()
-                token_obj = token_objs.first()
-                user = token_obj.user
-
-                qs = qs.filter(participants=user)
+        user = self.request.user
 
-                if room_since is not None:
-                    room_objs = Room.objects.filter(pk=room_since)
+        # summaries of the user's rooms, from the cache unless it is cold
+        rooms = room_cache.rooms_of(user.pk)
 
-                    if room_objs.exists():
-                        room_obj = room_objs.first()
-                        time_since = room_obj.time_created
+        if room_since is not None:
+            try:
+                room_obj = room_cache.get(int(room_since))
+            except ValueError:
+                room_obj = None
 
-                        qs = qs.filter(time_created__gt=time_since)
+            if room_obj is not None:
+                time_since = room_obj.time_created
 
-                    else:
-                        raise ParseError(detail="invalid room id provided")
+                rooms = [room for room in rooms if room.time_created > time_since]
 
-                elif message_since is not None:
-                    message_objs = Message.objects.filter(pk=message_since)
+            else:
+                raise ParseError(detail="invalid room id provided")
 
-                    if message_objs.exists():
-                        message_obj = message_objs.first()
-                        time_since = message_obj.time
+        elif message_since is not None:
+            message_objs = Message.objects.filter(pk=message_since)
 
-                        qs = qs.filter(time_created__gt=time_since)
+            if message_objs.exists():
+                message_obj = message_objs.first()
+                time_since = message_obj.time
 
-                    else:
-                        raise ParseError(detail="invalid message id provided")
+                rooms = [room for room in rooms if room.time_created > time_since]
 
             else:
-                raise AuthenticationFailed(detail="token invalid")
-
-        else:
-            raise AuthenticationFailed(detail="token not provided")
+                raise ParseError(detail="invalid message id provided")
 
-        return qs
+        return rooms
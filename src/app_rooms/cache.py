@@ -0,0 +1,251 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+
+from django.conf import settings
+
+# maximum number of rooms and of users whose rooms are kept in the
+# in-process cache of every worker
+ROOM_CACHE_SIZE = getattr(settings, 'FLACK_ROOM_CACHE_SIZE', 50000)
+ROOM_CACHE_USERS = getattr(settings, 'FLACK_ROOM_CACHE_USERS', 10000)
+# number of seconds cached rooms are trusted before they are loaded again,
+# which bounds how long changes made by other processes go unnoticed
+ROOM_CACHE_TTL = getattr(settings, 'FLACK_ROOM_CACHE_TTL', 300)
+
+RoomSummary = namedtuple('RoomSummary', [
+    'id', 'name', 'time_created', 'creator_id', 'creator_username', 'participants'
+])
+
+
+def load_summaries(**filters):
+    """Returns summaries of the rooms matching `filters`, ordered by ID. Uses two queries."""
+    from .models import Room
+
+    rooms = Room.objects.filter(**filters).order_by('pk') \
+        .values_list('pk', 'name', 'time_created', 'creator_id', 'creator__username')
+
+    rooms = list(rooms)
+
+    participants = defaultdict(list)
+    memberships = Room.participants.through.objects.filter(room_id__in=[room[0] for room in rooms]) \
+        .order_by('room_id', 'user_id') \
+        .values_list('room_id', 'user_id')
+
+    for room_id, user_id in memberships:
+        participants[room_id].append(user_id)
+
+    return [RoomSummary(*room, participants=tuple(participants[room[0]])) for room in rooms]
+
+
+class RoomCache:
+    """
+    Keeps summaries of rooms, along with the IDs of the rooms of every user,
+    so room lists and participants can be looked up without touching the
+    database. Both are bounded LRU maps. Entries are updated as rooms and
+    their participants change in this process and expire after `ttl`
+    seconds, so changes made by other processes are eventually picked up.
+    The cached users of every room are indexed, so a change of a room only
+    touches the entries of its users.
+    """
+
+    def __init__(self, max_rooms, max_users, ttl):
+        self.max_rooms = max_rooms
+        self.max_users = max_users
+        self.ttl = ttl
+        self._rooms = OrderedDict()
+        self._users = OrderedDict()
+        # IDs of the users in _users whose rooms include a room, by room ID
+        self._members = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def get_local(self, room_id):
+        """Looks the summary of a room up in the cache only. Never blocks on I/O."""
+        with self._lock:
+            return self._get(self._rooms, room_id)
+
+    def get(self, room_id):
+        """Returns the summary of a room, or None if there is no such room."""
+        summary = self.get_local(room_id)
+
+        if summary is None:
+            summaries = load_summaries(pk=room_id)
+            if not summaries:
+                return None
+
+            summary = summaries[0]
+            self._store_rooms(summaries)
+
+        return summary
+
+    def rooms_of_local(self, user_id):
+        """
+        Returns summaries of the rooms of a user ordered by ID, or None if
+        they aren't all in the cache. Never blocks on I/O.
+        """
+        with self._lock:
+            room_ids = self._get_user(user_id)
+            if room_ids is None:
+                return None
+
+            summaries = []
+            for room_id in sorted(room_ids):
+                summary = self._get(self._rooms, room_id)
+                if summary is None:
+                    return None
+                summaries.append(summary)
+
+            return summaries
+
+    def rooms_of(self, user_id):
+        """Returns summaries of the rooms of a user ordered by ID."""
+        summaries = self.rooms_of_local(user_id)
+
+        if summaries is None:
+            summaries = load_summaries(participants=user_id)
+            self._store_rooms(summaries)
+
+            with self._lock:
+                self._put_user(user_id, frozenset(summary.id for summary in summaries))
+
+        return summaries
+
+    def refresh(self, room_id, added=(), removed=()):
+        """
+        Loads the summary of a room again after it has changed, adding it to
+        the rooms of the users in `added` and removing it from the rooms of
+        the users in `removed`.
+        """
+        summaries = load_summaries(pk=room_id)
+        if not summaries:
+            self.discard(room_id)
+            return
+
+        summary = summaries[0]
+        self._store_rooms(summaries)
+
+        with self._lock:
+            for user_id in added:
+                self._update_user(user_id, lambda room_ids: room_ids | {room_id})
+            for user_id in removed:
+                self._update_user(user_id, lambda room_ids: room_ids - {room_id})
+
+            # participants removed without saying which, eg. by clear()
+            for user_id in list(self._members.get(room_id, ())):
+                if user_id not in summary.participants:
+                    self._update_user(user_id, lambda room_ids: room_ids - {room_id})
+
+    def participants_changed(self, instance_id, action, reverse, pk_set):
+        """Applies a change of Room.participants, as described by m2m_changed."""
+        if not reverse:
+            self.refresh(
+                instance_id,
+                added=pk_set if action == 'post_add' else (),
+                removed=pk_set if action == 'post_remove' else ()
+            )
+        elif pk_set is None:
+            # rooms a user was removed from by clear() are unknown
+            self.clear()
+        else:
+            for room_id in pk_set:
+                self.refresh(
+                    room_id,
+                    added=(instance_id,) if action == 'post_add' else (),
+                    removed=(instance_id,) if action == 'post_remove' else ()
+                )
+
+    def discard(self, room_id):
+        """Forgets a deleted room."""
+        with self._lock:
+            self._rooms.pop(room_id, None)
+
+            for user_id in list(self._members.get(room_id, ())):
+                self._update_user(user_id, lambda room_ids: room_ids - {room_id})
+
+    def invalidate_user(self, user_id):
+        """Forgets the rooms of a user, eg. after being told a room was created by another process."""
+        with self._lock:
+            self._remove_user(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._rooms.clear()
+            self._users.clear()
+            self._members.clear()
+
+    def _store_rooms(self, summaries):
+        with self._lock:
+            for summary in summaries:
+                self._put(self._rooms, summary.id, summary, self.max_rooms)
+
+    def _get_user(self, user_id):
+        entry = self._users.get(user_id)
+        if entry is None:
+            return None
+
+        room_ids, expires = entry
+        if expires <= time.monotonic():
+            self._remove_user(user_id)
+            return None
+
+        self._users.move_to_end(user_id)
+        return room_ids
+
+    def _put_user(self, user_id, room_ids):
+        self._remove_user(user_id)
+        self._users[user_id] = (room_ids, time.monotonic() + self.ttl)
+        self._link(user_id, room_ids)
+
+        while len(self._users) > self.max_users:
+            self._remove_user(next(iter(self._users)))
+
+    def _remove_user(self, user_id):
+        entry = self._users.pop(user_id, None)
+        if entry is not None:
+            self._unlink(user_id, entry[0])
+
+    def _update_user(self, user_id, update):
+        # only users whose rooms are all known are cached, so changes can be
+        # applied in place without loading anything
+        entry = self._users.get(user_id)
+        if entry is not None:
+            room_ids, expires = entry
+            updated = update(room_ids)
+            self._users[user_id] = (updated, expires)
+            self._unlink(user_id, room_ids - updated)
+            self._link(user_id, updated - room_ids)
+
+    def _link(self, user_id, room_ids):
+        for room_id in room_ids:
+            self._members[room_id].add(user_id)
+
+    def _unlink(self, user_id, room_ids):
+        for room_id in room_ids:
+            members = self._members.get(room_id)
+            if members is not None:
+                members.discard(user_id)
+                if not members:
+                    del self._members[room_id]
+
+    def _get(self, entries, key):
+        entry = entries.get(key)
+
+        if entry is not None:
+            value, expires = entry
+
+            if expires > time.monotonic():
+                entries.move_to_end(key)
+                return value
+
+            del entries[key]
+
+        return None
+
+    def _put(self, entries, key, value, max_size):
+        entries[key] = (value, time.monotonic() + self.ttl)
+        entries.move_to_end(key)
+
+        while len(entries) > max_size:
+            entries.popitem(last=False)
+
+
+room_cache = RoomCache(ROOM_CACHE_SIZE, ROOM_CACHE_USERS, ROOM_CACHE_TTL)
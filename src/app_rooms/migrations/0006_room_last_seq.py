@@ -0,0 +1,18 @@
+# Generated by Django 2.1.5 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_rooms', '0005_auto_20180908_2155'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='last_seq',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
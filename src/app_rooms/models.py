@@ -1,19 +1,30 @@
 from django.conf import settings
-from django.db import models
-from django.db.models.signals import m2m_changed
+from django.db import models, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
 
+from .cache import room_cache
+
 
 class Room(models.Model):
     participants = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='rooms')
     creator = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
     time_created = models.DateTimeField(auto_now_add=True)
+    # sequence number of the last message sent to the room
+    last_seq = models.PositiveIntegerField(default=0, editable=False)
 
 
 @receiver(m2m_changed, sender=Room.participants.through)
 def validate_room_m2m(sender, instance, action, reverse, model, pk_set, using, *args, **kwargs):
+    if action in ['post_add', 'post_remove', 'post_clear']:
+        # cached rooms follow the database once the change is committed
+        transaction.on_commit(
+            lambda: room_cache.participants_changed(instance.pk, action, reverse, pk_set),
+            using=using
+        )
+
     if action in ['post_add', 'post_remove']:
         print("m2m_changed for Room")
 
@@ -21,3 +32,15 @@ def validate_room_m2m(sender, instance, action, reverse, model, pk_set, using, *
 
         if participants_count < 2:
             raise ValidationError("A room must contain at least 2 participants")
+
+
+@receiver(post_save, sender=Room)
+def refresh_cached_room(sender, instance, created, using, **kwargs):
+    # new rooms are cached once they have participants
+    if not created:
+        transaction.on_commit(lambda: room_cache.refresh(instance.pk), using=using)
+
+
+@receiver(post_delete, sender=Room)
+def discard_cached_room(sender, instance, using, **kwargs):
+    transaction.on_commit(lambda: room_cache.discard(instance.pk), using=using)
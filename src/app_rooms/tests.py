@@ -1,3 +1,95 @@
+from django.contrib.auth import get_user_model
 from django.test import TestCase
 
-# Create your tests here.
+from rest_framework.authtoken.models import Token
+
+from .cache import RoomCache, room_cache
+from .models import Room
+
+
+class RoomCacheTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.carol = User.objects.create(username='carol')
+
+        self.room = self.create_room(self.alice, self.bob)
+        self.other_room = self.create_room(self.bob, self.carol)
+        self.cache = RoomCache(max_rooms=100, max_users=100, ttl=60)
+
+    def create_room(self, *participants):
+        room = Room.objects.create(creator=participants[0], name='room')
+        room.participants.add(*participants)
+        return room
+
+    def room_ids(self, user):
+        return [summary.id for summary in self.cache.rooms_of_local(user.pk)]
+
+    def test_warm_cache_serves_rooms_without_queries(self):
+        with self.assertNumQueries(2):
+            rooms = self.cache.rooms_of(self.bob.pk)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.rooms_of(self.bob.pk), rooms)
+            self.assertEqual(self.cache.get(self.room.pk), rooms[0])
+
+        self.assertEqual([room.id for room in rooms], [self.room.pk, self.other_room.pk])
+        self.assertEqual(rooms[0].participants, (self.alice.pk, self.bob.pk))
+
+    def test_warm_cache_lists_rooms_without_queries(self):
+        room_cache.clear()
+        self.addCleanup(room_cache.clear)
+        url = '/api/rooms/?token={token}'.format(token=Token.objects.create(user=self.alice).key)
+        rooms = self.client.get(url).json()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).json(), rooms)
+
+        self.assertEqual([room['id'] for room in rooms], [self.room.pk])
+
+    def test_added_participant_is_applied_to_cached_users(self):
+        for user in (self.alice, self.carol):
+            self.cache.rooms_of(user.pk)
+
+        self.room.participants.add(self.carol)
+        self.cache.refresh(self.room.pk, added=(self.carol.pk,))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.room_ids(self.carol), [self.room.pk, self.other_room.pk])
+        self.assertEqual(self.cache.get_local(self.room.pk).participants, (self.alice.pk, self.bob.pk, self.carol.pk))
+        # bob's rooms aren't cached
+        self.assertEqual(self.cache._members[self.room.pk], {self.alice.pk, self.carol.pk})
+
+    def test_participants_removed_without_saying_which_are_found(self):
+        room = self.create_room(self.alice, self.bob, self.carol)
+        for user in (self.alice, self.bob, self.carol):
+            self.cache.rooms_of(user.pk)
+
+        room.participants.remove(self.carol)
+        self.cache.refresh(room.pk)
+
+        self.assertEqual(self.room_ids(self.carol), [self.other_room.pk])
+        self.assertEqual(self.room_ids(self.alice), [self.room.pk, room.pk])
+        self.assertEqual(self.cache._members[room.pk], {self.alice.pk, self.bob.pk})
+
+    def test_discarded_room_is_removed_from_its_users(self):
+        for user in (self.alice, self.bob):
+            self.cache.rooms_of(user.pk)
+
+        self.cache.discard(self.room.pk)
+
+        self.assertEqual(self.room_ids(self.alice), [])
+        self.assertEqual(self.room_ids(self.bob), [self.other_room.pk])
+        self.assertNotIn(self.room.pk, self.cache._members)
+
+    def test_users_leaving_the_cache_leave_the_index(self):
+        cache = RoomCache(max_rooms=100, max_users=1, ttl=60)
+        cache.rooms_of(self.alice.pk)
+        cache.rooms_of(self.carol.pk)
+
+        self.assertIsNone(cache.rooms_of_local(self.alice.pk))
+        self.assertNotIn(self.room.pk, cache._members)
+
+        cache.invalidate_user(self.carol.pk)
+        self.assertEqual(dict(cache._members), {})
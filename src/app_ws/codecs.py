@@ -0,0 +1,109 @@
+import json
+import uuid
+from collections import OrderedDict
+
+import msgpack
+
+
+class JSONCodec:
+    """Frames as JSON text. Used unless the client negotiates another codec."""
+
+    subprotocol = 'flack.json'
+    # key of the encoded frame in websocket.send messages
+    key = 'text'
+
+    def encode(self, obj):
+        return json.dumps(obj)
+
+    def decode(self, data):
+        return json.loads(data)
+
+    def frame(self, frame_type, encoded_attr):
+        # same output as encoding the whole frame, without encoding attr again
+        return '{"type": ' + json.dumps(frame_type) + ', "attr": ' + encoded_attr + '}'
+
+    def array(self, encoded_items):
+        return '[' + ', '.join(encoded_items) + ']'
+
+    def to_bytes(self, data):
+        return data.encode('utf-8')
+
+
+class MessagePackCodec:
+    """Frames as binary MessagePack."""
+
+    subprotocol = 'flack.msgpack'
+    key = 'bytes'
+
+    def encode(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+    def frame(self, frame_type, encoded_attr):
+        # a map of two entries, 'type' and 'attr'
+        return b'\x82' + self.encode('type') + self.encode(frame_type) + self.encode('attr') + encoded_attr
+
+    def array(self, encoded_items):
+        return msgpack.Packer().pack_array_header(len(encoded_items)) + b''.join(encoded_items)
+
+    def to_bytes(self, data):
+        return data
+
+
+JSON = JSONCodec()
+MESSAGEPACK = MessagePackCodec()
+
+CODECS = (JSON, MESSAGEPACK)
+
+# number of shared attrs whose encodings are kept, see encode_shared_frame
+ENCODED_ATTRS_SIZE = 1024
+
+_encoded_attrs = OrderedDict()
+
+
+def negotiate(subprotocols):
+    """
+    Picks the codec of the first subprotocol offered by the client which is
+    supported. Returns the codec and the subprotocol to accept, which is None
+    when the client offered none of them and gets JSON.
+    """
+    for subprotocol in subprotocols:
+        for codec in CODECS:
+            if codec.subprotocol == subprotocol:
+                return codec, subprotocol
+
+    return JSON, None
+
+
+def share_attr(attr):
+    """
+    Prepares `attr` for frames sent to many connections. It is encoded by the
+    connections sending the frames, at most once per codec in every process,
+    so it is never encoded with codecs no connection uses.
+    """
+    return {'attr': attr, 'attr_id': uuid.uuid4().hex}
+
+
+def shared_frame(frame_type, shared_attr):
+    """
+    Describes a frame of type `frame_type` around an attr prepared by
+    `share_attr`, in a dict which can be merged into channel layer events.
+    """
+    return dict(shared_attr, frame_type=frame_type)
+
+
+def encode_shared_frame(codec, frame):
+    """Encodes a frame described by `shared_frame`, reusing the attr if this process encoded it before."""
+    # only used from the event loop, which needs no lock
+    key = (frame['attr_id'], codec.key)
+    encoded_attr = _encoded_attrs.get(key)
+
+    if encoded_attr is None:
+        encoded_attr = _encoded_attrs[key] = codec.encode(frame['attr'])
+
+        if len(_encoded_attrs) > ENCODED_ATTRS_SIZE:
+            _encoded_attrs.popitem(last=False)
+
+    return codec.frame(frame['frame_type'], encoded_attr)
@@ -1,41 +1,132 @@
-import json
+import asyncio
+import time
+from urllib.parse import parse_qsl
 
 from channels.consumer import AsyncConsumer
 from channels.exceptions import StopConsumer
 from channels.db import database_sync_to_async
 
-from rest_framework.authtoken.models import Token
+from flack.db import database_write_to_async
 
 from app_files.models import File
+from app_rooms.cache import room_cache
 from app_rooms.models import Room
-from app_messages.models import Location, Message
+from app_messages.models import Message
+from app_messages.writer import message_writer
+
+from .codecs import negotiate, share_attr, shared_frame, encode_shared_frame
+from .groups import user_group_name, room_group_name
+from .metrics import (
+    WS_CONNECTIONS,
+    WS_EVENT_SECONDS,
+    WS_EVENT_DB_SECONDS,
+    GROUP_SEND_SECONDS,
+    CATCHUP_SECONDS,
+    CATCHUP_OBJECTS,
+    CREATED,
+    REJECTED,
+    timed_database
+)
+from .outbound import (
+    OUTBOUND_HIGH_WATERMARK,
+    OUTBOUND_LOW_WATERMARK,
+    OUTBOUND_POLICY,
+    OutboundQueue
+)
+from .presence import presence_tracker
+from .throttle import (
+    WS_MAX_FRAME_SIZE,
+    MESSAGE_MAX_LENGTH,
+    typing_throttle,
+    message_throttle,
+    room_throttle
+)
+from .replay import (
+    REPLAY_CHUNK_SIZE,
+    REPLAY_COMPRESSED_BATCHES,
+    dt_to_long,
+    load_message_chunk,
+    compress_frames,
+    QuerysetReplay,
+    RoomReplay,
+    CursorReplay
+)
 
 
 class GlobalConsumer(AsyncConsumer):
+    async def dispatch(self, message):
+        # database time of the event is added up by the calls decorated with
+        # timed_database, events are handled one at a time
+        self.event_db_seconds = 0
+
+        try:
+            with WS_EVENT_SECONDS.time(message['type']):
+                await super().dispatch(message)
+        finally:
+            if self.event_db_seconds:
+                WS_EVENT_DB_SECONDS.observe(self.event_db_seconds, message['type'])
+
     async def websocket_connect(self, event):
         self.token = None
         self.user = None
-        self.name = 'flack_notifications'
+        self.name = None
+        self.room_groups = set()
+        self.outbound = None
+        # users who came online and went offline since the last presence
+        # frame sent, see presence()
+        self.presence_pending = None
+        # JSON unless the client asks for another codec through the subprotocol
+        self.codec, subprotocol = negotiate(self.scope.get('subprotocols', []))
+        # clients connecting with ?compress=true receive replays in
+        # compressed frames
+        query = dict(parse_qsl(self.scope.get('query_string', b'').decode()))
+        self.compress_replay = query.get('compress') in ('1', 'true')
 
         token = self.scope['url_route']['kwargs']['token']
-        room_since = int(self.scope['url_route']['kwargs']['room'])
-        message_since = int(self.scope['url_route']['kwargs']['message'])
+        room_since = self.scope['url_route']['kwargs'].get('room')
+        message_since = self.scope['url_route']['kwargs'].get('message')
 
-        if await self.check_token_exists(token):
+        if self.scope['user'].is_authenticated:
             self.token = token
-            self.user = await self.get_user_from_token()
+            self.user = self.scope['user']
+            self.name = user_group_name(self.user.pk)
 
+            # room creations are delivered to the groups of the participants,
+            # messages to the groups of the rooms they belong to
             await self.channel_layer.group_add(
                 self.name,
                 self.channel_name
             )
 
-            await self.send({
+            for room in await self.get_rooms():
+                await self.join_room_group(room.id)
+
+            accept = {
                 'type': 'websocket.accept'
-            })
+            }
+            if subprotocol is not None:
+                accept['subprotocol'] = subprotocol
+
+            await self.send(accept)
+
+            # everything else sent to the client goes through the queue
+            self.outbound = OutboundQueue(
+                self.send,
+                self.resync_message,
+                self.close_outbound,
+                OUTBOUND_HIGH_WATERMARK,
+                OUTBOUND_LOW_WATERMARK,
+                OUTBOUND_POLICY
+            )
+            WS_CONNECTIONS.inc()
+
+            if presence_tracker is not None:
+                presence_tracker.connect(self.user.pk, self.channel_name)
 
-            await self.send_room_updates_to_client(room_since, message_since)
-            await self.send_message_updates_to_client(room_since, message_since)
+            # clients connecting without the last room and message IDs
+            # catch up by sending a sync request instead
+            if room_since is not None and message_since is not None:
+                await self.send_updates_to_client(int(room_since), int(message_since))
 
         else:
             await self.send({
@@ -43,11 +134,87 @@ class GlobalConsumer(AsyncConsumer):
             })
 
     async def websocket_receive(self, event):
+        request_data = event.get(self.codec.key)
+
+        # oversized frames are rejected before being decoded, or even logged
+        if request_data is not None and len(request_data) > WS_MAX_FRAME_SIZE:
+            await self.send_error(None, 'frame_too_large')
+            return
+
         print("message received", event)
-        request_json = event.get('text')
 
-        if request_json is not None:
-            request = json.loads(request_json)
+        if request_data is not None:
+            try:
+                request = self.codec.decode(request_data)
+            except ValueError:
+                request = None
+
+            # every request has an attr, which the handlers below rely on
+            if not isinstance(request, dict) or not isinstance(request.get("attr"), dict):
+                await self.send_error(request, 'invalid_request')
+                return
+
+            # a sync request looks like this:
+            #
+            #  {
+            #      type: "sync",
+            #      attr: {
+            #          cursor: {
+            #              "<room id>": <seq of the last message received in the room>,
+            #              ...
+            #          }
+            #      }
+            #  }
+
+            if request.get("type") == "sync":
+                cursor = self.parse_cursor(request.get("attr"))
+
+                if cursor is None:
+                    await self.send_error(request, 'invalid_request')
+                else:
+                    await self.send_updates_since_cursor_to_client(cursor)
+
+            # a typing request looks like this:
+            #
+            #  {
+            #      type: "typing",
+            #      attr: {
+            #          room: <any valid room pk/id>,
+            #          sender_unique: "<username>_aH4x"
+            #      }
+            #  }
+
+            if request.get("type") == "typing":
+                attr = request.get("attr")
+
+                # clients may send room IDs as strings, groups are joined by int
+                try:
+                    room = int(attr.get("room"))
+                except (TypeError, ValueError):
+                    room = None
+
+                # relayed to the other participants at most once per
+                # TYPING_INTERVAL, the rest are dropped. Rooms of the user are
+                # known from the groups joined, without asking the database.
+                if room is None:
+                    await self.send_error(request, 'invalid_request')
+                elif room in self.room_groups and typing_throttle.allow((self.user.pk, room)):
+                    notification = {
+                        'type': 'typing.broadcast',
+                        'room': room,
+                        'sender_id': self.user.pk
+                    }
+                    notification.update(shared_frame('typing', share_attr({
+                        'room': room,
+                        'sender': self.user.username,
+                        'sender_id': self.user.pk,
+                        'sender_unique': attr.get("sender_unique")
+                    })))
+
+                    await self.group_send(
+                        room_group_name(room),
+                        notification
+                    )
 
             #
             # check if request properly structured
@@ -73,20 +240,33 @@ class GlobalConsumer(AsyncConsumer):
                 #  }
 
                 if attr.get("object") == "message":
+                    content = attr.get("content")
+
+                    # requests over the limits are rejected before anything
+                    # is looked up or stored
+                    if isinstance(content, str) and len(content) > MESSAGE_MAX_LENGTH:
+                        await self.send_error(request, 'content_too_long')
+                        return
+
+                    if not await self.allow_create(request, message_throttle):
+                        return
+
+                    # only participants can send messages to a room
+                    room = attr.get("room")
+                    room_obj = await self.get_participated_room(room)
+                    if room_obj is None:
+                        await self.send_error(request, 'room_not_found')
+                        return
+
                     #
                     # create message in database
                     #
-                    content = attr.get("content")
-
                     file = attr.get("file")
                     if file is not None:
                         file_obj = await self.get_file(file)
                     else:
                         file_obj = None
 
-                    room = attr.get("room")
-                    room_obj = await self.get_room(room)
-
                     sender = self.user
 
                     loc_dict = attr.get("location")
@@ -94,20 +274,20 @@ class GlobalConsumer(AsyncConsumer):
                     if loc_dict is not None:
                         lat = loc_dict.get("latitude")
                         lon = loc_dict.get("longitude")
-                        location = await self.create_location(lat, lon)
                     else:
-                        location = None
+                        lat = lon = None
 
-                    message_obj = await self.create_message(content, file_obj, room_obj, sender, location)
+                    message_obj = await self.create_message(content, file_obj, room_obj, sender, lat, lon)
+                    CREATED.inc('message')
 
                     #
                     # respond to sender
                     #
-                    if file is not None:
+                    if file_obj is not None:
                         response_file = {
                             'name': message_obj.file.name,
                             'hash': message_obj.file.file.name,
-                            'url': message_obj.file.file.url
+                            'url': message_obj.file.url
                         }
                     else:
                         response_file = None
@@ -123,7 +303,7 @@ class GlobalConsumer(AsyncConsumer):
                     response_time = self.dt_to_long(message_obj.time)
                     response_id = message_obj.id
                     response_room_name = room_obj.name
-                    response_room_participants = self.pk_array_from_queryset(room_obj.participants.all())
+                    response_room_participants = list(room_obj.participants)
                     response_sender_unique = attr.get("sender_unique")
 
                     response_attr = {
@@ -138,33 +318,27 @@ class GlobalConsumer(AsyncConsumer):
                         'sender_unique': response_sender_unique,
                         'location': response_location,
                         'message_id': response_id,
+                        'seq': message_obj.seq,
                         'time': response_time,
                     }
 
-                    response = {
-                        'type': 'response',
-                        'attr': response_attr
-                    }
-                    await self.send({
-                        'type': 'websocket.send',
-                        'text': json.dumps(response)
-                    })
+                    # the response and the notification share their attr,
+                    # which is encoded only once per codec
+                    shared_attr = share_attr(response_attr)
+
+                    await self.send_shared(shared_frame('response', shared_attr))
 
                     #
                     # broadcast message creation
                     #
-                    notification_attr = response_attr
-
                     notification = {
-                        'type': 'notification',
-                        'attr': notification_attr
+                        'type': 'broadcast'
                     }
-                    await self.channel_layer.group_send(
-                        self.name,
-                        {
-                            'type': 'broadcast',
-                            'text': json.dumps(notification)
-                        }
+                    notification.update(shared_frame('notification', shared_attr))
+
+                    await self.group_send(
+                        room_group_name(room_obj.id),
+                        notification
                     )
 
                 # a proper room creation request looks like this:
@@ -180,13 +354,19 @@ class GlobalConsumer(AsyncConsumer):
                 #  }
 
                 elif attr.get("object") == "room":
+                    if not await self.allow_create(request, room_throttle):
+                        return
+
                     #
                     # create room in database
                     #
                     name = attr.get("name")
                     participants = attr.get("participants")
 
-                    room_obj = await self.create_room(name, participants)
+                    room_obj, participants = await self.create_room(name, participants)
+                    CREATED.inc('room')
+
+                    await self.join_room_group(room_obj.pk)
 
                     #
                     # respond to sender
@@ -201,15 +381,7 @@ class GlobalConsumer(AsyncConsumer):
                         'time': response_time
                     }
 
-                    response = {
-                        'type': 'response',
-                        'attr': response_attr
-                    }
-
-                    await self.send({
-                        'type': 'websocket.send',
-                        'text': json.dumps(response)
-                    })
+                    await self.send_frame('response', response_attr)
 
                     #
                     # broadcast room creation
@@ -233,169 +405,438 @@ class GlobalConsumer(AsyncConsumer):
                     }
 
                     notification = {
-                        'type': 'notification',
-                        'attr': notification_attr
+                        'type': 'room.broadcast',
+                        'room': notification_id
                     }
-                    await self.channel_layer.group_send(
-                        self.name,
-                        {
-                            'type': 'broadcast',
-                            'text': json.dumps(notification)
-                        }
-                    )
+                    notification.update(shared_frame('notification', share_attr(notification_attr)))
 
-    async def broadcast(self, event):
-        await self.send({
+                    for participant in participants:
+                        await self.group_send(
+                            user_group_name(participant),
+                            notification
+                        )
+
+    def frame_message(self, frame_type, attr):
+        return {
+            'type': 'websocket.send',
+            self.codec.key: self.codec.encode({
+                'type': frame_type,
+                'attr': attr
+            })
+        }
+
+    def shared_message(self, frame):
+        """Encodes a frame described by `shared_frame` with the codec of this connection."""
+        return {
             'type': 'websocket.send',
-            'text': event['text']
+            self.codec.key: encode_shared_frame(self.codec, frame)
+        }
+
+    async def group_send(self, group, message):
+        with GROUP_SEND_SECONDS.time():
+            await self.channel_layer.group_send(group, message)
+
+    async def send_frame(self, frame_type, attr):
+        """Sends a frame meant only for this connection."""
+        await self.outbound.put(self.frame_message(frame_type, attr))
+
+    async def send_shared(self, frame):
+        """Sends a frame described by `shared_frame` meant only for this connection."""
+        await self.outbound.put(self.shared_message(frame))
+
+    async def send_error(self, request, reason, **attr):
+        # an error frame looks like this:
+        #
+        #  {
+        #      type: "error",
+        #      attr: {
+        #          reason: "rate_limited",
+        #          request: "create",
+        #          object: "message",
+        #          sender_unique: "<username>_aH4x",
+        #          retry_after: 1.5
+        #      }
+        #  }
+        #
+        # request, object and sender_unique are those of the rejected
+        # request, null if it couldn't be decoded
+        REJECTED.inc(reason)
+
+        request = request if isinstance(request, dict) else {}
+        request_attr = request.get("attr")
+        request_attr = request_attr if isinstance(request_attr, dict) else {}
+
+        attr.update({
+            'reason': reason,
+            'request': request.get("type"),
+            'object': request_attr.get("object"),
+            'sender_unique': request_attr.get("sender_unique")
         })
 
+        await self.send_frame('error', attr)
+
+    async def allow_create(self, request, throttle):
+        """Tells whether a create request of the user is within the rate limit, rejecting it otherwise."""
+        if throttle is None or throttle.allow(self.user.pk):
+            return True
+
+        await self.send_error(request, 'rate_limited', retry_after=round(throttle.retry_after(self.user.pk), 3))
+        return False
+
+    @staticmethod
+    def parse_cursor(attr):
+        """Returns the cursor of a sync request's attr by room ID, or None if it isn't one."""
+        cursor = attr.get("cursor")
+        if not isinstance(cursor, dict):
+            return None
+
+        try:
+            return {int(room): int(seq) for room, seq in cursor.items()}
+        except (TypeError, ValueError):
+            return None
+
+    def resync_message(self):
+        # a resync frame looks like this:
+        #
+        #  {
+        #      type: "resync",
+        #      attr: {
+        #          reason: "lagging"
+        #      }
+        #  }
+        #
+        # the client missed notifications and catches up with a sync request
+        return self.frame_message('resync', {'reason': 'lagging'})
+
+    async def close_outbound(self, reason):
+        print("closing connection of", self.user.username, "outbound queue", reason)
+
+        # 1013: try again later, 1011: server error
+        await self.send({
+            'type': 'websocket.close',
+            'code': 1013 if reason == 'lagging' else 1011
+        })
+
+    async def broadcast(self, event):
+        # notifications are dropped or coalesced if the client falls behind
+        await self.outbound.offer(self.shared_message(event))
+
+    async def room_broadcast(self, event):
+        # every connection of a participant has to start listening to the
+        # new room's group before any message can be sent to it
+        if room_cache.get_local(event['room']) is None:
+            # created by another process, this one's cache doesn't know yet
+            room_cache.invalidate_user(self.user.pk)
+
+        await self.join_room_group(event['room'])
+
+        await self.broadcast(event)
+
+    async def typing_broadcast(self, event):
+        # devices of the user typing don't need to know
+        if event['sender_id'] != self.user.pk:
+            # only the latest typing frame of a sender in a room is kept
+            await self.outbound.offer(
+                self.shared_message(event), key=('typing', event['room'], event['sender_id'])
+            )
+
+    async def presence(self, event):
+        # changes arriving while a presence frame is queued are merged into it
+        # rather than dropped, since they can't be caught up on with a sync
+        if self.presence_pending is None:
+            self.presence_pending = (set(), set())
+            await self.outbound.offer(self.pending_presence_message, key='presence', droppable=False)
+
+        online, offline = self.presence_pending
+        online.difference_update(event['offline'])
+        online.update(event['online'])
+        offline.difference_update(event['online'])
+        offline.update(event['offline'])
+
+    def pending_presence_message(self):
+        online, offline = self.presence_pending
+        self.presence_pending = None
+
+        return self.frame_message('presence', {
+            'online': sorted(online),
+            'offline': sorted(offline)
+        })
+
+    async def join_room_group(self, room_id):
+        if room_id not in self.room_groups:
+            await self.channel_layer.group_add(
+                room_group_name(room_id),
+                self.channel_name
+            )
+            self.room_groups.add(room_id)
+
     async def websocket_disconnect(self, event):
         print("disconnected", event)
+
+        if self.outbound is not None:
+            self.outbound.stop()
+            WS_CONNECTIONS.dec()
+
+        if self.user is not None:
+            if presence_tracker is not None:
+                presence_tracker.disconnect(self.user.pk, self.channel_name)
+
+            await self.channel_layer.group_discard(
+                self.name,
+                self.channel_name
+            )
+
+            for room_id in self.room_groups:
+                await self.channel_layer.group_discard(
+                    room_group_name(room_id),
+                    self.channel_name
+                )
+
         raise StopConsumer()
 
     def pk_array_from_queryset(self, qs):
         return [item.pk for item in qs]
 
     def dt_to_long(self, dt):
-        return dt.timestamp() * 1000
+        return dt_to_long(dt)
 
-    async def send_room_updates_to_client(self, room_since, message_since):
+    async def send_updates_to_client(self, room_since, message_since):
         if room_since != -1:
             rooms = await self.get_rooms_since_room(room_since)
-        elif message_since != -1:
-            rooms = await self.get_rooms_since_message(message_since)
-        else:
-            rooms = await self.get_rooms()
-
-        for room in rooms:
-            print("SENDING ROOM {id} TO CLIENT".format(id=room.pk))
-            notification_attr = {
-                'object': 'room',
-                'name': room.name,
-                'id': room.pk,
-                'time': self.dt_to_long(room.time_created),
-                'sender': room.creator.username,
-                'sender_id': room.creator.pk,
-                'sender_unique': "server-notification-repeat",
-                'participants': self.pk_array_from_queryset(room.participants.all())
-            }
-
-            notification = {
-                'type': 'notification',
-                'attr': notification_attr
-            }
-
-            await self.send({
-                'type': 'websocket.send',
-                'text': json.dumps(notification)
-            })
-
-    async def send_message_updates_to_client(self, room_since, message_since):
-        if room_since != -1:
             messages = await self.get_messages_since_room(room_since)
         elif message_since != -1:
+            rooms = await self.get_rooms_since_message(message_since)
             messages = await self.get_messages_since_message(message_since)
         else:
+            rooms = await self.get_rooms()
             messages = await self.get_messages()
 
-        for message in messages:
-            print("SENDING MESSAGE {id} TO CLIENT".format(id=message.pk))
-            notification_location = None
-            if message.location is not None:
-                notification_location = {
-                    'latitude': message.location.lat,
-                    'longitude': message.location.lon
-                }
-
-            notification_file = None
-            if message.file is not None:
-                notification_file = {
-                    'hash': message.file.file.name,
-                    'name': message.file.name
-                }
-
-            notification_attr = {
-                'object': 'message',
-                'content': message.content,
-                'message_id': message.pk,
-                'time': self.dt_to_long(message.time),
-                'sender': message.sender.username,
-                'sender_id': message.sender.pk,
-                'sender_unique': "server-notification-repeat",
-                'room_participants': self.pk_array_from_queryset(message.room.participants.all()),
-                'room': message.room.pk,
-                'room_name': message.room.name,
-                'location': notification_location,
-                'file': notification_file
-            }
+        await self.send_replays_to_client([
+            RoomReplay(rooms),
+            QuerysetReplay('message', messages, load_message_chunk, 'message_id')
+        ])
+
+    async def send_updates_since_cursor_to_client(self, cursor):
+        room_cursor = await self.get_room_cursor()
+
+        # rooms missing from the cursor are new to the client, so all of their
+        # messages are sent as well. rooms without new messages are skipped.
+        rooms = await self.get_rooms_excluding(list(cursor))
+        message_cursor = {
+            room_id: cursor.get(room_id, 0)
+            for room_id, last_seq in room_cursor.items() if last_seq > cursor.get(room_id, 0)
+        }
+
+        await self.send_replays_to_client([
+            RoomReplay(rooms),
+            CursorReplay(message_cursor, room_cursor)
+        ], room_cursor)
+
+    async def send_replays_to_client(self, replays, room_cursor=None):
+        time_started = time.monotonic()
+        counts = {'room': 0, 'message': 0}
+        frames = 0
+        # batch frames of a compressed replay are collected instead of sent
+        buffer = [] if self.compress_replay else None
+
+        for replay in replays:
+            replay_count, replay_frames = await self.send_batches_to_client(replay, buffer)
+            counts[replay.object_name] += replay_count
+            frames += replay_frames
+
+        if buffer:
+            await self.send_compressed_to_client(buffer)
+            frames += 1
+
+        if room_cursor is None:
+            room_cursor = await self.get_room_cursor()
+
+        duration = (time.monotonic() - time_started) * 1000
+
+        CATCHUP_SECONDS.observe(duration / 1000)
+        for object_name, count in counts.items():
+            CATCHUP_OBJECTS.inc(object_name, amount=count)
+
+        print("SENT {rooms} ROOMS AND {messages} MESSAGES TO CLIENT IN {duration:.1f} ms".format(
+            rooms=counts['room'], messages=counts['message'], duration=duration
+        ))
+
+        await self.send_frame('sync', {
+            'status': 'complete',
+            'rooms': counts['room'],
+            'messages': counts['message'],
+            'frames': frames,
+            'duration': duration,
+            'cursor': {str(room_id): last_seq for room_id, last_seq in room_cursor.items()}
+        })
 
-            notification = {
-                'type': 'notification',
-                'attr': notification_attr
+    async def send_batches_to_client(self, replay, buffer=None):
+        """
+        Sends notifications for every object replayed in batch frames of at
+        most REPLAY_CHUNK_SIZE notifications each, or appends the encoded
+        frames to `buffer` if one is given, sending them compressed whenever
+        it holds REPLAY_COMPRESSED_BATCHES of them. Returns the number of
+        notifications and the number of frames sent.
+        """
+        count = 0
+        frames = 0
+
+        while True:
+            notifications = await self.get_next_chunk(replay)
+
+            if not notifications:
+                break
+
+            batch_attr = {
+                'object': replay.object_name,
+                'notifications': notifications
             }
 
-            await self.send({
-                'type': 'websocket.send',
-                'text': json.dumps(notification)
-            })
+            count += len(notifications)
+
+            if buffer is not None:
+                buffer.append(self.codec.encode({
+                    'type': 'batch',
+                    'attr': batch_attr
+                }))
+                if len(buffer) >= REPLAY_COMPRESSED_BATCHES:
+                    await self.send_compressed_to_client(buffer)
+                    frames += 1
+            else:
+                await self.send_frame('batch', batch_attr)
+                frames += 1
+
+            if len(notifications) < REPLAY_CHUNK_SIZE:
+                break
+
+        return count, frames
+
+    async def send_compressed_to_client(self, buffer):
+        """Sends the encoded frames in `buffer` in a single compressed frame and empties it."""
+        compressed = await asyncio.get_event_loop().run_in_executor(
+            None, compress_frames, self.codec, list(buffer)
+        )
+        buffer.clear()
+
+        await self.outbound.put({
+            'type': 'websocket.send',
+            'bytes': compressed
+        })
 
+    @timed_database
     @database_sync_to_async
-    def check_token_exists(self, token):
-        return Token.objects.filter(key=token).exists()
+    def get_file(self, file_id):
+        # files still being added to IPFS in the background can't be attached yet
+        return File.objects.filter(pk=file_id, status=File.READY).first()
 
-    @database_sync_to_async
-    def get_user_from_token(self):
-        return Token.objects.filter(key=self.token).first().user
+    async def get_room(self, room_id):
+        """Returns the summary of a room, served by the room cache once it is warm."""
+        room = room_cache.get_local(room_id)
+        if room is None:
+            room = await self.load_room(room_id)
+        return room
 
+    @timed_database
     @database_sync_to_async
-    def get_file(self, file_id):
-        return File.objects.filter(pk=file_id).first()
+    def load_room(self, room_id):
+        return room_cache.get(room_id)
 
-    @database_sync_to_async
-    def get_room(self, room_id):
-        return Room.objects.filter(pk=room_id).first()
+    async def get_participated_room(self, room_id):
+        """Returns the summary of a room if the user participates in it, None otherwise."""
+        try:
+            room_id = int(room_id)
+        except (TypeError, ValueError):
+            return None
 
-    @database_sync_to_async
-    def create_location(self, latitude, longitude):
-        return Location.objects.create(lat=latitude, lon=longitude)
+        room = await self.get_room(room_id)
 
-    @database_sync_to_async
-    def create_message(self, content, file, room, sender, location):
-        return Message.objects.create(content=content, file=file, room=room, sender=sender, location=location)
+        if room is None or self.user.pk not in room.participants:
+            # the user may have joined through another process, which the
+            # cached summary doesn't know about yet
+            room = await self.reload_room(room_id)
 
+        if room is None or self.user.pk not in room.participants:
+            return None
+
+        return room
+
+    @timed_database
     @database_sync_to_async
+    def reload_room(self, room_id):
+        room_cache.refresh(room_id)
+        return room_cache.get(room_id)
+
+    @timed_database
+    async def create_message(self, content, file, room, sender, latitude, longitude):
+        message = Message(
+            content=content, file=file, room_id=room.id, sender=sender, latitude=latitude, longitude=longitude
+        )
+
+        if message_writer is not None:
+            # stored along with messages from other connections, the response
+            # and broadcast wait until the batch is committed
+            return await asyncio.wrap_future(message_writer.save(message))
+
+        return await self.save_message(message)
+
+    @database_write_to_async
+    def save_message(self, message):
+        message.save()
+        return message
+
+    @timed_database
+    @database_write_to_async
     def create_room(self, name, participants):
         room_obj = Room.objects.create(creator=self.user, name=name)
         room_obj.participants.add(*participants)
-        return room_obj
+        return room_obj, self.pk_array_from_queryset(room_obj.participants.all())
 
+    @timed_database
     @database_sync_to_async
-    def get_rooms_since_room(self, room):
-        rooms = Room.objects.filter(participants=self.user)
+    def get_next_chunk(self, replay):
+        return replay.next_chunk()
 
-        room_since_obj = Room.objects.filter(pk=room).first()
+    @timed_database
+    @database_sync_to_async
+    def get_room_cursor(self):
+        return dict(Room.objects.filter(participants=self.user).values_list('pk', 'last_seq'))
+
+    async def get_rooms(self):
+        """Returns summaries of the rooms of the user, served by the room cache once it is warm."""
+        rooms = room_cache.rooms_of_local(self.user.pk)
+        if rooms is None:
+            rooms = await self.load_rooms()
+        return rooms
 
-        time_since = room_since_obj.time_created
+    @timed_database
+    @database_sync_to_async
+    def load_rooms(self):
+        return room_cache.rooms_of(self.user.pk)
 
-        return rooms.filter(time_created__gt=time_since)
+    async def get_rooms_excluding(self, room_ids):
+        room_ids = set(room_ids)
+        return [room for room in await self.get_rooms() if room.id not in room_ids]
 
-    @database_sync_to_async
-    def get_rooms_since_message(self, message):
-        rooms = Room.objects.filter(participants=self.user)
+    async def get_rooms_since_room(self, room):
+        room_since = await self.get_room(room)
 
-        message_since_obj = Message.objects.filter(pk=message).first()
+        time_since = room_since.time_created
 
-        time_since = message_since_obj.time
+        return [room for room in await self.get_rooms() if room.time_created > time_since]
 
-        return rooms.filter(time_created__gt=time_since)
+    async def get_rooms_since_message(self, message):
+        time_since = await self.get_message_time(message)
 
+        return [room for room in await self.get_rooms() if room.time_created > time_since]
+
+    @timed_database
     @database_sync_to_async
-    def get_rooms(self):
-        rooms = Room.objects.filter(participants=self.user)
+    def get_message_time(self, message):
+        message_since_obj = Message.objects.filter(pk=message).first()
 
-        return rooms
+        return message_since_obj.time
 
+    @timed_database
     @database_sync_to_async
     def get_messages_since_room(self, room):
         messages = Message.objects.filter(room__participants=self.user)
@@ -406,6 +847,7 @@ class GlobalConsumer(AsyncConsumer):
 
         return messages.filter(time__gt=time_since)
 
+    @timed_database
     @database_sync_to_async
     def get_messages_since_message(self, message):
         messages = Message.objects.filter(room__participants=self.user)
@@ -416,6 +858,7 @@ class GlobalConsumer(AsyncConsumer):
 
         return messages.filter(time__gt=time_since)
 
+    @timed_database
     @database_sync_to_async
     def get_messages(self):
         messages = Message.objects.filter(room__participants=self.user)
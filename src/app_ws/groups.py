@@ -0,0 +1,10 @@
+def user_group_name(user_id):
+    return 'user.{id}'.format(id=user_id)
+
+
+def room_group_name(room_id):
+    return 'room.{id}'.format(id=room_id)
+
+
+# group of the presence trackers of all processes
+PRESENCE_GROUP_NAME = 'presence'
@@ -0,0 +1,106 @@
+import zlib
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from app_messages.models import Message
+from app_rooms.cache import room_cache
+from app_ws.codecs import CODECS
+from app_ws.replay import (
+    REPLAY_CHUNK_SIZE,
+    REPLAY_COMPRESSED_BATCHES,
+    REPLAY_COMPRESSION_LEVEL,
+    compress_frames,
+    load_message_chunk,
+    QuerysetReplay,
+    RoomReplay
+)
+from app_ws.server import WS_COMPRESSION_WINDOW_BITS, WS_COMPRESSION_MEM_LEVEL
+
+
+def header_size(payload_size):
+    """Size of the header of an unmasked WebSocket frame, as sent by the server."""
+    if payload_size < 126:
+        return 2
+    if payload_size < 2 ** 16:
+        return 4
+    return 10
+
+
+def deflated_sizes(frames, level, window_bits, mem_level, context_takeover):
+    """Sizes of `frames` compressed as permessage-deflate messages of a single connection."""
+    compressor = None
+
+    for frame in frames:
+        if compressor is None or not context_takeover:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -window_bits, mem_level)
+
+        # every message ends with a sync flush, minus its trailing 4 bytes
+        yield len(compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+
+class Command(BaseCommand):
+    help = "Reports the bytes sent on the wire when replaying every room and message of a user."
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--level', type=int, default=zlib.Z_DEFAULT_COMPRESSION)
+        parser.add_argument('--window-bits', type=int, default=WS_COMPRESSION_WINDOW_BITS)
+        parser.add_argument('--mem-level', type=int, default=WS_COMPRESSION_MEM_LEVEL)
+        parser.add_argument('--replay-level', type=int, default=REPLAY_COMPRESSION_LEVEL)
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.filter(username=options['username']).first()
+        if user is None:
+            raise CommandError("User '{username}' does not exist.".format(username=options['username']))
+
+        replays = [
+            RoomReplay(room_cache.rooms_of(user.pk)),
+            QuerysetReplay('message', Message.objects.filter(room__participants=user), load_message_chunk, 'message_id')
+        ]
+
+        batches = []
+        for replay in replays:
+            while True:
+                notifications = replay.next_chunk()
+                if notifications:
+                    batches.append({
+                        'type': 'batch',
+                        'attr': {
+                            'object': replay.object_name,
+                            'notifications': notifications
+                        }
+                    })
+                if len(notifications) < REPLAY_CHUNK_SIZE:
+                    break
+
+        self.stdout.write("{frames} batch frames, {notifications} notifications".format(
+            frames=len(batches), notifications=sum(len(batch['attr']['notifications']) for batch in batches)
+        ))
+
+        for codec in CODECS:
+            encoded = [codec.encode(batch) for batch in batches]
+            frames = [codec.to_bytes(frame) for frame in encoded]
+
+            sizes = {
+                'uncompressed': [len(frame) for frame in frames],
+                'permessage-deflate': list(deflated_sizes(
+                    frames, options['level'], options['window_bits'], options['mem_level'], True
+                )),
+                'permessage-deflate, no context takeover': list(deflated_sizes(
+                    frames, options['level'], options['window_bits'], options['mem_level'], False
+                )),
+                'compressed frames': [
+                    len(compress_frames(codec, encoded[i:i + REPLAY_COMPRESSED_BATCHES], options['replay_level']))
+                    for i in range(0, len(encoded), REPLAY_COMPRESSED_BATCHES)
+                ],
+            }
+
+            uncompressed = sum(size + header_size(size) for size in sizes['uncompressed'])
+
+            self.stdout.write(codec.subprotocol)
+            for name, frame_sizes in sizes.items():
+                on_wire = sum(size + header_size(size) for size in frame_sizes)
+                self.stdout.write("  {name:<40} {bytes:>12} bytes {ratio:>7.1%}".format(
+                    name=name, bytes=on_wire, ratio=on_wire / uncompressed if uncompressed else 1
+                ))
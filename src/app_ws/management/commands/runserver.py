@@ -0,0 +1,12 @@
+from channels.management.commands.runserver import Command as ChannelsRunserverCommand
+
+from app_ws.server import FlackServer
+
+
+class Command(ChannelsRunserverCommand):
+    help = (
+        "Starts the ASGI development server, compressing WebSocket connections with permessage-deflate "
+        "and holding back frames sent to clients which can't keep up."
+    )
+
+    server_cls = FlackServer
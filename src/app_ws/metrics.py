@@ -0,0 +1,57 @@
+import functools
+import time
+
+from flack.metrics import Counter, Gauge, Histogram
+
+from .outbound import outbound_stats
+
+WS_CONNECTIONS = Gauge('flack_ws_connections', "WebSocket connections accepted and still open.")
+WS_EVENT_SECONDS = Histogram(
+    'flack_ws_event_seconds', "Time taken by consumers to handle events, by event type.", ['event']
+)
+WS_EVENT_DB_SECONDS = Histogram(
+    'flack_ws_event_db_seconds', "Time spent waiting for the database while handling events, by event type.",
+    ['event']
+)
+DB_CALL_SECONDS = Histogram(
+    'flack_ws_db_call_seconds', "Time taken by database calls of consumers, thread pool wait included.",
+    ['function']
+)
+GROUP_SEND_SECONDS = Histogram('flack_group_send_seconds', "Time taken by group sends to the channel layer.")
+CATCHUP_SECONDS = Histogram('flack_catchup_seconds', "Time taken to send missed rooms and messages to clients.")
+CATCHUP_OBJECTS = Counter('flack_catchup_objects_total', "Rooms and messages resent to clients.", ['object'])
+CREATED = Counter('flack_ws_created_total', "Messages and rooms created over WebSocket.", ['object'])
+REJECTED = Counter('flack_ws_rejected_total', "Requests rejected with an error frame, by reason.", ['reason'])
+
+Gauge('flack_ws_lagging_connections', "Connections lagging behind their outbound queue.",
+      function=lambda: outbound_stats.lagging)
+Gauge('flack_ws_outbound_queued', "Frames waiting in outbound queues.", function=lambda: outbound_stats.queued)
+Counter('flack_ws_lag_events_total', "Times connections started lagging.", function=lambda: outbound_stats.lag_events)
+Counter('flack_ws_outbound_dropped_total', "Notifications dropped for lagging connections.",
+        function=lambda: outbound_stats.dropped)
+Counter('flack_ws_outbound_coalesced_total', "Notifications replaced by a newer one with the same key.",
+        function=lambda: outbound_stats.coalesced)
+Counter('flack_ws_outbound_disconnected_total', "Connections closed for lagging.",
+        function=lambda: outbound_stats.disconnected)
+
+
+def timed_database(func):
+    """
+    Decorates a coroutine function of a consumer waiting for the database,
+    observing how long its calls take and adding it to the database time of
+    the event being handled.
+    """
+    # database_sync_to_async returns a callable object holding the function
+    name = getattr(func, '__name__', None) or func.func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(consumer, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(consumer, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_CALL_SECONDS.observe(elapsed, name)
+            consumer.event_db_seconds += elapsed
+
+    return wrapper
@@ -0,0 +1,215 @@
+import asyncio
+from collections import deque
+
+from django.conf import settings
+
+# number of frames waiting to be sent to a client at which its connection is
+# lagging, and the number it has to get down to before it isn't anymore
+OUTBOUND_HIGH_WATERMARK = getattr(settings, 'FLACK_OUTBOUND_HIGH_WATERMARK', 256)
+OUTBOUND_LOW_WATERMARK = getattr(settings, 'FLACK_OUTBOUND_LOW_WATERMARK', 64)
+# what happens to notifications for a lagging connection, see OutboundQueue
+OUTBOUND_POLICY = getattr(settings, 'FLACK_OUTBOUND_POLICY', 'coalesce')
+
+COALESCE = 'coalesce'
+DROP = 'drop'
+DISCONNECT = 'disconnect'
+
+
+class OutboundStats:
+    """Counters of lagging connections of the process."""
+
+    def __init__(self):
+        # connections lagging right now, and frames queued for all connections
+        self.lagging = 0
+        self.queued = 0
+        # times connections started lagging
+        self.lag_events = 0
+        # notifications dropped, or replaced by a newer one with the same key
+        self.dropped = 0
+        self.coalesced = 0
+        # connections closed for lagging
+        self.disconnected = 0
+
+    def snapshot(self):
+        return dict(vars(self))
+
+
+outbound_stats = OutboundStats()
+
+
+class _Item:
+    __slots__ = ('message', 'key', 'droppable')
+
+    def __init__(self, message, key, droppable):
+        self.message = message
+        self.key = key
+        self.droppable = droppable
+
+
+class OutboundQueue:
+    """
+    Frames waiting to be sent to a client, sent in order by a task of their
+    own. Messages are ASGI messages, or callables returning one once it is
+    its turn to be sent.
+
+    Frames the connection sends on its own, such as responses and replays,
+    are queued by `put`, notifications by `offer`. Neither ever waits, as
+    the consumer handles one event at a time and waiting would hold up
+    everything else it receives from the channel layer. A notification with
+    a key replaces a queued one with the same key. Once the queue reaches
+    the high watermark, the connection is lagging until it gets down to the
+    low watermark. Meanwhile, frames are handled according to `policy`:
+
+    * 'coalesce': frames in the queue are replaced by a single resync
+      frame, which tells the client to catch up by sending a sync request.
+      Frames are dropped until the resync frame is sent.
+    * 'drop': frames are dropped, and a resync frame is queued once the
+      connection stops lagging.
+    * 'disconnect': the connection is closed by calling `close` with
+      'lagging'.
+
+    Frames queued with `droppable` unset, such as merged presence changes,
+    are always kept. If sending fails, the queue stops and `close` is called
+    with 'failed'.
+    """
+
+    def __init__(self, send, resync_message, close, high_watermark=256, low_watermark=64, policy=COALESCE):
+        self.send = send
+        self.resync_message = resync_message
+        self.close = close
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.policy = policy
+        self.lagging = False
+        self.stopped = False
+
+        self._items = deque()
+        self._keys = {}
+        self._resync = False
+        self._ready = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    def __len__(self):
+        return len(self._items)
+
+    async def put(self, message):
+        # responses and replays missed are caught up on with a sync request
+        # just like notifications
+        await self.offer(message)
+
+    async def offer(self, message, key=None, droppable=True):
+        if self.stopped:
+            return
+
+        queued = self._keys.get(key) if key is not None else None
+        if queued is not None:
+            queued.message = message
+            outbound_stats.coalesced += 1
+            return
+
+        if len(self._items) >= self.high_watermark:
+            self._start_lagging()
+
+        if self.lagging and droppable:
+            if self.policy == DISCONNECT:
+                outbound_stats.disconnected += 1
+                self.stop()
+                await self.close('lagging')
+                return
+
+            if self.policy == COALESCE and not self._resync:
+                self._coalesce()
+
+            self._resync = True
+            outbound_stats.dropped += 1
+            return
+
+        self._append(message, key, droppable)
+
+    def stop(self):
+        self._task.cancel()
+        self._clear()
+
+    def _clear(self):
+        self.stopped = True
+        outbound_stats.queued -= len(self._items)
+        self._items.clear()
+        self._keys.clear()
+        self._stop_lagging()
+
+    def _append(self, message, key, droppable):
+        item = _Item(message, key, droppable)
+        self._items.append(item)
+        outbound_stats.queued += 1
+        if key is not None:
+            self._keys[key] = item
+
+        if len(self._items) >= self.high_watermark:
+            self._start_lagging()
+
+        self._ready.set()
+
+    def _coalesce(self):
+        kept = deque(item for item in self._items if not item.droppable)
+        outbound_stats.dropped += len(self._items) - len(kept)
+        outbound_stats.queued -= len(self._items) - len(kept)
+
+        self._items = kept
+        self._keys = {item.key: item for item in kept if item.key is not None}
+        self._append(self.resync_message, 'resync', False)
+
+    def _start_lagging(self):
+        if not self.lagging:
+            self.lagging = True
+            outbound_stats.lagging += 1
+            outbound_stats.lag_events += 1
+
+            print("connection lagging, {count} frames queued, {lagging} lagging connections".format(
+                count=len(self._items), lagging=outbound_stats.lagging
+            ))
+
+    def _stop_lagging(self):
+        if self.lagging:
+            self.lagging = False
+            outbound_stats.lagging -= 1
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+
+            while self._items:
+                item = self._items.popleft()
+                outbound_stats.queued -= 1
+                if item.key is not None and self._keys.get(item.key) is item:
+                    del self._keys[item.key]
+
+                if item.key == 'resync':
+                    self._resync = False
+
+                message = item.message() if callable(item.message) else item.message
+                if message is not None:
+                    try:
+                        await self.send(message)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        # nothing queued after it could be sent either
+                        print("sending frame failed: {error}".format(error=e))
+                        self._clear()
+                        await self._close_failed()
+                        return
+
+                if self.lagging and len(self._items) <= self.low_watermark:
+                    self._stop_lagging()
+
+                    # notifications dropped meanwhile are caught up on
+                    if self._resync and 'resync' not in self._keys:
+                        self._append(self.resync_message, 'resync', False)
+
+            self._ready.clear()
+
+    async def _close_failed(self):
+        try:
+            await self.close('failed')
+        except Exception as e:
+            print("closing connection failed: {error}".format(error=e))
@@ -0,0 +1,246 @@
+import asyncio
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+
+from app_rooms.cache import room_cache
+
+from .groups import PRESENCE_GROUP_NAME
+
+# whether users sharing a room are told when each other come online or go
+# offline
+PRESENCE = getattr(settings, 'FLACK_PRESENCE', True)
+# seconds between presence frames, changes in between are sent together
+PRESENCE_INTERVAL = getattr(settings, 'FLACK_PRESENCE_INTERVAL', 1.0)
+# whether processes share their connected users through the channel layer,
+# so users connected to other processes are known to be online
+PRESENCE_SHARED = getattr(settings, 'FLACK_PRESENCE_SHARED', False)
+# seconds between full lists of connected users sent to other processes. The
+# users of a process not heard from in three times as long are offline.
+PRESENCE_SNAPSHOT_INTERVAL = getattr(settings, 'FLACK_PRESENCE_SNAPSHOT_INTERVAL', 30)
+
+
+class PresenceTracker:
+    """
+    Knows which users are online, i.e. have at least one connection, and
+    tells users sharing a room with them when that changes. Only used from
+    the event loop of the process.
+
+    Changes are collected and sent every `interval` seconds, as a single
+    presence frame per connection listing the users who came online and the
+    ones who went offline, if any of them share a room with its user. A user
+    who reconnects in between isn't reported at all. Connections receive the
+    users who are online when their first frame is sent.
+
+    With `shared` enabled, the users connected to every process are
+    exchanged through the channel layer: changes along with the frames and
+    full lists every `snapshot_interval` seconds.
+    """
+
+    def __init__(self, interval=1.0, shared=False, snapshot_interval=30):
+        self.interval = interval
+        self.shared = shared
+        self.snapshot_interval = snapshot_interval
+        self.channel_name = None
+
+        # number of connections of every user connected to this process, and
+        # the channels of the connections
+        self._connections = {}
+        self._channels = defaultdict(set)
+        # users connected to other processes, by channel of the process
+        self._remote = {}
+        # users reported online
+        self._online = set()
+        # users who might have come online or gone offline, and connections
+        # waiting for their first frame
+        self._changed = set()
+        self._new = set()
+        # users who connected to or left this process, for other processes
+        self._local_changed = set()
+        self._next_snapshot = 0
+        self._task = None
+
+    def is_online(self, user_id):
+        if user_id in self._connections:
+            return True
+
+        return any(user_id in users for users, _ in self._remote.values())
+
+    def connect(self, user_id, channel_name):
+        self._start()
+
+        self._connections[user_id] = self._connections.get(user_id, 0) + 1
+        self._channels[user_id].add(channel_name)
+        self._changed.add(user_id)
+        self._local_changed.add(user_id)
+        self._new.add((user_id, channel_name))
+
+    def disconnect(self, user_id, channel_name):
+        count = self._connections.get(user_id, 0) - 1
+        if count > 0:
+            self._connections[user_id] = count
+        else:
+            self._connections.pop(user_id, None)
+
+        self._channels[user_id].discard(channel_name)
+        if not self._channels[user_id]:
+            del self._channels[user_id]
+
+        self._changed.add(user_id)
+        self._local_changed.add(user_id)
+        self._new.discard((user_id, channel_name))
+
+    def _start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        channel_layer = get_channel_layer()
+
+        if self.shared:
+            self.channel_name = await channel_layer.new_channel()
+            await channel_layer.group_add(PRESENCE_GROUP_NAME, self.channel_name)
+            asyncio.ensure_future(self._receive(channel_layer))
+
+            # other processes send their users along with their next frames
+            await channel_layer.group_send(PRESENCE_GROUP_NAME, {
+                'type': 'presence.hello',
+                'process': self.channel_name
+            })
+
+        while True:
+            await asyncio.sleep(self.interval)
+
+            try:
+                await self.flush(channel_layer)
+            except Exception as e:
+                print("sending presence failed: {error}".format(error=e))
+
+    async def flush(self, channel_layer):
+        """Sends the changes since the last flush."""
+        if self.shared:
+            await self._publish(channel_layer)
+            self._expire_remote()
+
+        changed, self._changed = self._changed, set()
+        new, self._new = self._new, set()
+
+        came_online = {user_id for user_id in changed if user_id not in self._online and self.is_online(user_id)}
+        went_offline = {user_id for user_id in changed if user_id in self._online and not self.is_online(user_id)}
+        self._online = (self._online | came_online) - went_offline
+
+        if not (came_online or went_offline or new):
+            return
+
+        channels = {user_id: set(user_channels) for user_id, user_channels in self._channels.items()}
+        frames = await database_sync_to_async(build_frames)(
+            came_online, went_offline, new, set(self._online), channels
+        )
+
+        # connections closed meanwhile don't receive anything anymore
+        connected = set().union(*self._channels.values())
+
+        for channel_name, online, offline in frames:
+            if channel_name not in connected:
+                continue
+
+            await channel_layer.send(channel_name, {
+                'type': 'presence',
+                'online': online,
+                'offline': offline
+            })
+
+    async def _publish(self, channel_layer):
+        local_changed, self._local_changed = self._local_changed, set()
+
+        if self._next_snapshot <= time.monotonic():
+            self._next_snapshot = time.monotonic() + self.snapshot_interval
+
+            # also renews the membership, which expires on some layers
+            await channel_layer.group_add(PRESENCE_GROUP_NAME, self.channel_name)
+            await channel_layer.group_send(PRESENCE_GROUP_NAME, {
+                'type': 'presence.snapshot',
+                'process': self.channel_name,
+                'online': list(self._connections)
+            })
+        elif local_changed:
+            await channel_layer.group_send(PRESENCE_GROUP_NAME, {
+                'type': 'presence.delta',
+                'process': self.channel_name,
+                'online': [user_id for user_id in local_changed if user_id in self._connections],
+                'offline': [user_id for user_id in local_changed if user_id not in self._connections]
+            })
+
+    async def _receive(self, channel_layer):
+        while True:
+            message = await channel_layer.receive(self.channel_name)
+
+            process = message.get('process')
+            if process == self.channel_name:
+                continue
+
+            if message['type'] == 'presence.hello':
+                self._next_snapshot = 0
+                continue
+
+            users, _ = self._remote.get(process, (set(), 0))
+
+            if message['type'] == 'presence.snapshot':
+                online = set(message['online'])
+                self._changed |= users ^ online
+                users = online
+            else:
+                self._changed |= set(message['online']) | set(message['offline'])
+                users = (users | set(message['online'])) - set(message['offline'])
+
+            self._remote[process] = (users, time.monotonic() + 3 * self.snapshot_interval)
+
+    def _expire_remote(self):
+        now = time.monotonic()
+
+        for process, (users, expires) in list(self._remote.items()):
+            if expires <= now:
+                del self._remote[process]
+                self._changed |= users
+
+
+def contacts_of(user_id):
+    """IDs of the users sharing at least one room with a user."""
+    return {
+        participant for room in room_cache.rooms_of(user_id) for participant in room.participants
+    } - {user_id}
+
+
+def build_frames(came_online, went_offline, new, online, channels):
+    """
+    Returns (channel name, online, offline) of every presence frame to send,
+    given the users who came online and went offline, the new connections
+    as (user ID, channel name), the users online and the channels of the
+    users connected to this process.
+    """
+    changes = defaultdict(lambda: (set(), set()))
+
+    for user_id in came_online | went_offline:
+        for contact in contacts_of(user_id):
+            if contact in channels:
+                changes[contact][0 if user_id in came_online else 1].add(user_id)
+
+    frames = []
+
+    for user_id, (contacts_online, contacts_offline) in changes.items():
+        for channel_name in channels[user_id]:
+            if (user_id, channel_name) not in new:
+                frames.append((channel_name, sorted(contacts_online), sorted(contacts_offline)))
+
+    for user_id, channel_name in new:
+        if channel_name in channels.get(user_id, ()):
+            frames.append((channel_name, sorted(contacts_of(user_id) & online), []))
+
+    return frames
+
+
+presence_tracker = PresenceTracker(PRESENCE_INTERVAL, PRESENCE_SHARED, PRESENCE_SNAPSHOT_INTERVAL) if PRESENCE else None
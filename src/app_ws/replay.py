@@ -0,0 +1,151 @@
+import zlib
+
+from django.conf import settings
+
+from app_messages.models import Message
+
+# number of rooms or messages loaded with a single query and sent to the
+# client in a single batch frame when catching up on connect
+REPLAY_CHUNK_SIZE = getattr(settings, 'FLACK_REPLAY_CHUNK_SIZE', 500)
+# zlib compression level of replays sent in compressed frames
+REPLAY_COMPRESSION_LEVEL = getattr(settings, 'FLACK_REPLAY_COMPRESSION_LEVEL', 9)
+# maximum number of batch frames compressed into a single frame, which are
+# held in memory until it is sent
+REPLAY_COMPRESSED_BATCHES = getattr(settings, 'FLACK_REPLAY_COMPRESSED_BATCHES', 10)
+
+REPLAY_SENDER_UNIQUE = 'server-notification-repeat'
+
+
+def dt_to_long(dt):
+    return dt.timestamp() * 1000
+
+
+def compress_frames(codec, encoded_frames, level=REPLAY_COMPRESSION_LEVEL):
+    """Returns an array of frames encoded by `codec`, encoded and compressed with zlib."""
+    return zlib.compress(codec.to_bytes(codec.array(encoded_frames)), level)
+
+
+def room_notification_attr(room):
+    """Notification attributes of a room, described by its summary from the room cache."""
+    return {
+        'object': 'room',
+        'name': room.name,
+        'id': room.id,
+        'time': dt_to_long(room.time_created),
+        'sender': room.creator_username,
+        'sender_id': room.creator_id,
+        'sender_unique': REPLAY_SENDER_UNIQUE,
+        'participants': list(room.participants)
+    }
+
+
+def message_notification_attr(message):
+    notification_file = None
+    if message.file is not None:
+        notification_file = {
+            'hash': message.file.file.name,
+            'name': message.file.name
+        }
+
+    return {
+        'object': 'message',
+        'content': message.content,
+        'message_id': message.pk,
+        'seq': message.seq,
+        'time': dt_to_long(message.time),
+        'sender': message.sender.username,
+        'sender_id': message.sender.pk,
+        'sender_unique': REPLAY_SENDER_UNIQUE,
+        'room_participants': [user.pk for user in message.room.participants.all()],
+        'room': message.room.pk,
+        'room_name': message.room.name,
+        'location': message.location,
+        'file': notification_file
+    }
+
+
+def load_message_chunk(messages, after):
+    """
+    Returns notification attributes for the next chunk of messages with a
+    primary key greater than `after`. Uses a constant number of queries per
+    chunk.
+    """
+    chunk = messages.filter(pk__gt=after).order_by('pk') \
+        .select_related('sender', 'room', 'file') \
+        .prefetch_related('room__participants')[:REPLAY_CHUNK_SIZE]
+
+    return [message_notification_attr(message) for message in chunk]
+
+
+class QuerysetReplay:
+    """
+    Replays every object in a queryset, one chunk at a time, in the order of
+    primary keys.
+    """
+
+    def __init__(self, object_name, queryset, load_chunk, key):
+        self.object_name = object_name
+        self.queryset = queryset
+        self.load_chunk = load_chunk
+        self.key = key
+        self.after = 0
+
+    def next_chunk(self):
+        notifications = self.load_chunk(self.queryset, self.after)
+
+        if notifications:
+            self.after = notifications[-1][self.key]
+
+        return notifications
+
+
+class RoomReplay:
+    """Replays rooms out of their summaries, one chunk at a time."""
+    object_name = 'room'
+
+    def __init__(self, rooms):
+        self.rooms = list(rooms)
+
+    def next_chunk(self):
+        chunk, self.rooms = self.rooms[:REPLAY_CHUNK_SIZE], self.rooms[REPLAY_CHUNK_SIZE:]
+        return [room_notification_attr(room) for room in chunk]
+
+
+class CursorReplay:
+    """
+    Replays messages newer than the ones described by a cursor, i.e. a dict
+    mapping room IDs to the sequence number of the last message in that room
+    known to the client, up to the sequence numbers in `last_seqs`, the cursor
+    the sync ends with. Every room is read by a query of its own, ordered by
+    sequence number and bounded on both ends, so it is an index range scan on
+    (room, seq).
+    """
+    object_name = 'message'
+
+    def __init__(self, cursor, last_seqs):
+        # (room ID, last seq known, last seq replayed) of rooms left to replay
+        self.ranges = sorted(
+            (room_id, seq, last_seqs[room_id])
+            for room_id, seq in cursor.items() if last_seqs.get(room_id, 0) > seq
+        )
+
+    def next_chunk(self):
+        chunk = []
+
+        while self.ranges and len(chunk) < REPLAY_CHUNK_SIZE:
+            room_id, after, last_seq = self.ranges[0]
+            limit = REPLAY_CHUNK_SIZE - len(chunk)
+
+            messages = list(
+                Message.objects.filter(room_id=room_id, seq__gt=after, seq__lte=last_seq).order_by('seq')
+                .select_related('sender', 'room', 'file')
+                .prefetch_related('room__participants')[:limit]
+            )
+            chunk += messages
+
+            if len(messages) == limit and messages[-1].seq < last_seq:
+                self.ranges[0] = (room_id, messages[-1].seq, last_seq)
+            else:
+                self.ranges.pop(0)
+
+        return [message_notification_attr(message) for message in chunk]
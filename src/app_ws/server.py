@@ -0,0 +1,125 @@
+import asyncio
+
+from django.conf import settings
+
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from daphne.server import Server
+from twisted.internet import reactor
+from twisted.internet.interfaces import IPushProducer
+from zope.interface import implementer
+
+from .throttle import WS_MAX_FRAME_SIZE
+
+# whether WebSocket connections of clients offering permessage-deflate are
+# compressed, at the default zlib compression level
+WS_COMPRESSION = getattr(settings, 'FLACK_WS_COMPRESSION', True)
+# base two logarithm of the window used by the server, 9 to 15
+WS_COMPRESSION_WINDOW_BITS = getattr(settings, 'FLACK_WS_COMPRESSION_WINDOW_BITS', 15)
+# zlib memory level of the compressor of every connection, 1 to 9
+WS_COMPRESSION_MEM_LEVEL = getattr(settings, 'FLACK_WS_COMPRESSION_MEM_LEVEL', 8)
+# whether sending a frame waits while the socket buffers of its connection
+# are full, so frames pile up in the outbound queue of the consumer instead
+WS_BACKPRESSURE = getattr(settings, 'FLACK_WS_BACKPRESSURE', True)
+
+
+def accept_deflate(offers):
+    """
+    Accepts the first permessage-deflate offer of a client. The server
+    compresses with a window of WS_COMPRESSION_WINDOW_BITS, or a smaller one
+    if the client asks for it.
+    """
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            window_bits = WS_COMPRESSION_WINDOW_BITS
+            if offer.request_max_window_bits:
+                window_bits = min(window_bits, offer.request_max_window_bits)
+
+            return PerMessageDeflateOfferAccept(
+                offer,
+                window_bits=window_bits,
+                mem_level=WS_COMPRESSION_MEM_LEVEL
+            )
+
+    return None
+
+
+@implementer(IPushProducer)
+class TransportBackpressure:
+    """
+    Registered as the producer of a connection's transport, which pauses it
+    while its write buffer is full and resumes it once it has been flushed.
+    """
+
+    def __init__(self):
+        self.writable = asyncio.Event()
+        self.writable.set()
+
+    def pauseProducing(self):
+        self.writable.clear()
+
+    def resumeProducing(self):
+        self.writable.set()
+
+    def stopProducing(self):
+        # nothing is ever sent over a lost connection, there is no use waiting
+        self.writable.set()
+
+
+class FlackServer(Server):
+    """
+    Daphne server negotiating permessage-deflate on WebSocket connections
+    when WS_COMPRESSION is enabled, and holding back WebSocket frames sent
+    to connections whose transport is paused when WS_BACKPRESSURE is.
+    Messages received are limited to a few times WS_MAX_FRAME_SIZE.
+    """
+
+    def run(self):
+        # the factory is created by run, right before the reactor starts
+        reactor.callWhenRunning(self.configure_protocol)
+
+        super().run()
+
+    def configure_protocol(self):
+        # frames over WS_MAX_FRAME_SIZE characters are rejected by the
+        # consumer, anything which can't possibly be that small in UTF-8
+        # closes the connection before being buffered entirely
+        options = {
+            'maxMessagePayloadSize': 4 * WS_MAX_FRAME_SIZE
+        }
+        if WS_COMPRESSION:
+            options['perMessageCompressionAccept'] = accept_deflate
+
+        self.ws_factory.setProtocolOptions(**options)
+
+    async def handle_reply(self, protocol, message):
+        await super().handle_reply(protocol, message)
+
+        if WS_BACKPRESSURE and message['type'] == 'websocket.send':
+            backpressure = self.backpressure(protocol)
+            if backpressure is not None:
+                await backpressure.writable.wait()
+
+    def backpressure(self, protocol):
+        connection = self.connections.get(protocol)
+        if connection is None or connection.get('disconnected'):
+            return None
+
+        if 'backpressure' not in connection:
+            backpressure = TransportBackpressure()
+
+            # WebSocket connections keep the transport of the HTTP connection
+            # they were upgraded from, whose channel is the producer of the
+            # transport and passes pauses on to a producer registered with it
+            transport = getattr(protocol, 'transport', None)
+            channel = getattr(transport, 'producer', None)
+            consumer = channel if hasattr(channel, 'registerProducer') else transport
+
+            try:
+                consumer.registerProducer(backpressure, True)
+            except (AttributeError, RuntimeError):
+                # no transport, or one with a producer of its own
+                backpressure = None
+
+            connection['backpressure'] = backpressure
+
+        return connection['backpressure']
@@ -1,3 +1,428 @@
-from django.test import TestCase
+import asyncio
+import zlib
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from channels.testing import WebsocketCommunicator
+from rest_framework.authtoken.models import Token
+
+from app_messages.models import Message
+from app_rooms.models import Room
+
+from .codecs import CODECS, JSON, MESSAGEPACK, encode_shared_frame, negotiate, share_attr, shared_frame
+from .consumers import GlobalConsumer
+from .outbound import COALESCE, DISCONNECT, DROP, OutboundQueue
+from .replay import CursorReplay
+from .throttle import IntervalThrottle
+
+
+class CursorReplayTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+
+        self.rooms = []
+        for count in (5, 3):
+            room = Room.objects.create(creator=self.alice, name='room')
+            room.participants.add(self.alice, self.bob)
+            for i in range(count):
+                Message.objects.create(room=room, sender=self.bob, content=str(i))
+            self.rooms.append(room)
+
+    def replay(self, cursor, last_seqs):
+        replay = CursorReplay(cursor, last_seqs)
+        chunks = []
+        while True:
+            chunk = replay.next_chunk()
+            if not chunk:
+                return chunks
+            chunks.append([(attr['room'], attr['seq']) for attr in chunk])
+
+    def test_replays_rooms_up_to_the_cursor_snapshot(self):
+        first, second = [room.pk for room in self.rooms]
+
+        with mock.patch('app_ws.replay.REPLAY_CHUNK_SIZE', 2):
+            chunks = self.replay({first: 2, second: 0}, {first: 4, second: 3})
+
+        self.assertEqual(chunks, [
+            [(first, 3), (first, 4)],
+            [(second, 1), (second, 2)],
+            [(second, 3)],
+        ])
+
+    def test_rooms_missing_from_the_snapshot_are_skipped(self):
+        first, second = [room.pk for room in self.rooms]
+
+        with self.assertNumQueries(2):
+            chunks = self.replay({first: 3, second: 0}, {first: 5})
+
+        self.assertEqual(chunks, [[(first, 4), (first, 5)]])
+
+
+class CodecTests(SimpleTestCase):
+    attr = {
+        'object': 'message',
+        'content': 'zdravo, svijete ☃',
+        'room': 1,
+        'room_participants': [1, 2],
+        'location': {'latitude': 45.8, 'longitude': 15.97},
+        'file': None,
+        'time': 1546300800000.5,
+    }
+
+    def test_round_trip(self):
+        for codec in CODECS:
+            with self.subTest(codec=codec.subprotocol):
+                self.assertEqual(codec.decode(codec.encode(self.attr)), self.attr)
+
+    def test_frame_matches_encoding_the_whole_frame(self):
+        for codec in CODECS:
+            with self.subTest(codec=codec.subprotocol):
+                frame = codec.frame('notification', codec.encode(self.attr))
+                self.assertEqual(codec.decode(frame), {'type': 'notification', 'attr': self.attr})
+
+    def test_array(self):
+        for codec in CODECS:
+            with self.subTest(codec=codec.subprotocol):
+                items = [codec.frame('notification', codec.encode({'id': i})) for i in range(3)]
+                self.assertEqual(
+                    codec.decode(codec.array(items)),
+                    [{'type': 'notification', 'attr': {'id': i}} for i in range(3)]
+                )
+
+    def test_shared_frame(self):
+        shared_attr = share_attr(self.attr)
+
+        for codec in CODECS:
+            with self.subTest(codec=codec.subprotocol):
+                for frame_type in ('response', 'notification'):
+                    frame = encode_shared_frame(codec, shared_frame(frame_type, shared_attr))
+                    self.assertEqual(codec.decode(frame), {'type': frame_type, 'attr': self.attr})
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate(['flack.msgpack', 'flack.json']), (MESSAGEPACK, 'flack.msgpack'))
+        self.assertEqual(negotiate(['other', 'flack.json']), (JSON, 'flack.json'))
+        self.assertEqual(negotiate([]), (JSON, None))
+
+
+class CompressedReplayTests(SimpleTestCase):
+    class Replay:
+        object_name = 'message'
+
+        def __init__(self, count):
+            self.chunks = [[{'id': i}] for i in range(count)]
+
+        def next_chunk(self):
+            return self.chunks.pop(0) if self.chunks else []
+
+    def test_replay_is_compressed_in_bounded_frames(self):
+        consumer = GlobalConsumer({'type': 'websocket'})
+        consumer.codec = JSON
+        consumer.event_db_seconds = 0
+        sent = []
+
+        class Outbound:
+            async def put(self, message):
+                sent.append(message)
+
+        consumer.outbound = Outbound()
+        buffer = []
+
+        with mock.patch('app_ws.consumers.REPLAY_CHUNK_SIZE', 1), \
+                mock.patch('app_ws.consumers.REPLAY_COMPRESSED_BATCHES', 2):
+            loop = asyncio.new_event_loop()
+            try:
+                count, frames = loop.run_until_complete(consumer.send_batches_to_client(self.Replay(5), buffer))
+            finally:
+                loop.close()
+
+        self.assertEqual((count, frames), (5, 2))
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(
+            [[batch['attr']['notifications'] for batch in JSON.decode(zlib.decompress(message['bytes']))]
+             for message in sent],
+            [[[{'id': 0}], [{'id': 1}]], [[{'id': 2}], [{'id': 3}]]]
+        )
+
+
+class OutboundQueueTests(SimpleTestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.sent = []
+        self.closed = []
+        self.queues = []
+        # sends wait for the gate, so frames pile up like for a slow client
+        self.gate = asyncio.Event()
+
+    def tearDown(self):
+        # the tasks sending queued frames are finished before the loop is closed
+        for queue in self.queues:
+            queue.stop()
+        self.loop.run_until_complete(
+            asyncio.gather(*(queue._task for queue in self.queues), return_exceptions=True)
+        )
+
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_scenario(self, policy, scenario):
+        async def send(message):
+            await self.gate.wait()
+            if message == 'fail':
+                raise IOError("connection lost")
+            self.sent.append(message)
+
+        async def close(reason):
+            self.closed.append(reason)
+
+        async def run():
+            queue = OutboundQueue(send, 'resync', close, high_watermark=4, low_watermark=1, policy=policy)
+            self.queues.append(queue)
+            await scenario(queue)
+            self.gate.set()
+            await self.settle()
+            return queue
+
+        return self.loop.run_until_complete(run())
+
+    async def settle(self):
+        for _ in range(20):
+            await asyncio.sleep(0)
+
+    def test_coalesce_replaces_queued_frames_with_resync(self):
+        async def scenario(queue):
+            await queue.put('first')
+            await self.settle()
+            for i in range(6):
+                await queue.offer(i)
+            self.assertTrue(queue.lagging)
+
+        queue = self.run_scenario(COALESCE, scenario)
+
+        self.assertEqual(self.sent, ['first', 'resync'])
+        self.assertFalse(queue.lagging)
+
+    def test_drop_sends_resync_once_caught_up(self):
+        async def scenario(queue):
+            await queue.put('first')
+            await self.settle()
+            for i in range(6):
+                await queue.offer(i)
+
+        queue = self.run_scenario(DROP, scenario)
+
+        self.assertEqual(self.sent, ['first', 0, 1, 2, 3, 'resync'])
+        self.assertFalse(queue.lagging)
+
+    def test_disconnect_closes_lagging_connection(self):
+        async def scenario(queue):
+            await queue.put('first')
+            await self.settle()
+            for i in range(6):
+                await queue.offer(i)
+
+        queue = self.run_scenario(DISCONNECT, scenario)
+
+        self.assertEqual(self.closed, ['lagging'])
+        self.assertTrue(queue.stopped)
+        self.assertEqual(self.sent, [])
+
+    def test_frames_which_are_not_droppable_are_kept(self):
+        async def scenario(queue):
+            await queue.put('first')
+            await self.settle()
+            await queue.offer('presence', droppable=False)
+            for i in range(4):
+                await queue.offer(i)
+            await queue.offer('later presence', droppable=False)
+
+        self.run_scenario(COALESCE, scenario)
+
+        self.assertEqual(self.sent, ['first', 'presence', 'resync', 'later presence'])
+
+    def test_frame_with_key_replaces_queued_one(self):
+        async def scenario(queue):
+            await queue.put('first')
+            await self.settle()
+            await queue.offer('typing 1', key='typing')
+            await queue.offer('other')
+            await queue.offer('typing 2', key='typing')
+
+        self.run_scenario(COALESCE, scenario)
+
+        self.assertEqual(self.sent, ['first', 'typing 2', 'other'])
+
+    def test_failed_send_stops_queue(self):
+        async def scenario(queue):
+            await queue.put('fail')
+            await queue.put('never sent')
+
+        queue = self.run_scenario(COALESCE, scenario)
+
+        self.assertEqual(self.closed, ['failed'])
+        self.assertTrue(queue.stopped)
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(self.sent, [])
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class MessageCreateTests(TransactionTestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.carol = User.objects.create(username='carol')
+
+        self.room = Room.objects.create(creator=self.alice, name='room')
+        self.room.participants.add(self.alice, self.bob)
+
+    def send_message(self, user, room):
+        from flack.routing import application
+
+        token, _ = Token.objects.get_or_create(user=user)
+
+        async def run():
+            communicator = WebsocketCommunicator(application, '/{token}/'.format(token=token.key))
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            await communicator.send_json_to({
+                'type': 'create',
+                'attr': {
+                    'object': 'message',
+                    'sender_unique': 'unique',
+                    'content': 'hi',
+                    'file': None,
+                    'room': room,
+                    'location': None
+                }
+            })
+
+            frames = []
+            while not await communicator.receive_nothing(0.5):
+                frames.append(await communicator.receive_json_from())
+
+            await communicator.disconnect()
+            return [frame for frame in frames if frame['type'] in ('response', 'error')]
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+    def test_participant_can_send_message(self):
+        frames = self.send_message(self.alice, self.room.pk)
+
+        self.assertEqual([frame['type'] for frame in frames], ['response'])
+        self.assertEqual(frames[0]['attr']['seq'], 1)
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 1)
+
+    def test_other_users_cannot_send_message(self):
+        frames = self.send_message(self.carol, self.room.pk)
+
+        self.assertEqual([(frame['type'], frame['attr']['reason']) for frame in frames], [('error', 'room_not_found')])
+        self.assertFalse(Message.objects.exists())
+
+    def test_unknown_room_is_not_found(self):
+        for room in (self.room.pk + 1, 'room'):
+            frames = self.send_message(self.alice, room)
+            self.assertEqual([frame['attr']['reason'] for frame in frames], ['room_not_found'])
+
+
+class IntervalThrottleTests(SimpleTestCase):
+    def test_one_event_per_key_and_interval(self):
+        throttle = IntervalThrottle(3)
+
+        with mock.patch('app_ws.throttle.time.monotonic', return_value=100):
+            self.assertTrue(throttle.allow(('alice', 1)))
+            self.assertFalse(throttle.allow(('alice', 1)))
+            self.assertTrue(throttle.allow(('alice', 2)))
+            self.assertTrue(throttle.allow(('bob', 1)))
+
+        with mock.patch('app_ws.throttle.time.monotonic', return_value=103):
+            self.assertTrue(throttle.allow(('alice', 1)))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class TypingTests(TransactionTestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+
+        self.room = Room.objects.create(creator=self.alice, name='room')
+        self.room.participants.add(self.alice, self.bob)
+
+        patcher = mock.patch('app_ws.consumers.typing_throttle', IntervalThrottle(3))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def send_typing(self, *rooms):
+        """Sends a typing request of alice for each of `rooms`, returns the frames alice and bob receive."""
+        from flack.routing import application
+
+        async def frames_of(communicator):
+            frames = []
+            while not await communicator.receive_nothing(0.5):
+                frames.append(await communicator.receive_json_from())
+            return [frame for frame in frames if frame['type'] in ('typing', 'error')]
+
+        async def run():
+            communicators = []
+            for user in (self.alice, self.bob):
+                token, _ = Token.objects.get_or_create(user=user)
+                communicator = WebsocketCommunicator(application, '/{token}/'.format(token=token.key))
+                connected, _ = await communicator.connect()
+                self.assertTrue(connected)
+                communicators.append(communicator)
+
+            for room in rooms:
+                await communicators[0].send_json_to({
+                    'type': 'typing',
+                    'attr': {'room': room, 'sender_unique': 'unique'}
+                })
+
+            frames = [await frames_of(communicator) for communicator in communicators]
+
+            for communicator in communicators:
+                await communicator.disconnect()
+            return frames
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+    def test_typing_is_relayed_to_other_participants_once_per_interval(self):
+        alice_frames, bob_frames = self.send_typing(self.room.pk, str(self.room.pk), self.room.pk)
+
+        self.assertEqual(alice_frames, [])
+        self.assertEqual([frame['attr'] for frame in bob_frames], [{
+            'room': self.room.pk,
+            'sender': 'alice',
+            'sender_id': self.alice.pk,
+            'sender_unique': 'unique'
+        }])
+
+    def test_room_given_as_string_is_relayed(self):
+        _, bob_frames = self.send_typing(str(self.room.pk))
+
+        self.assertEqual([frame['attr']['room'] for frame in bob_frames], [self.room.pk])
+
+    def test_invalid_room_is_rejected(self):
+        alice_frames, bob_frames = self.send_typing('room', None)
+
+        self.assertEqual([frame['attr']['reason'] for frame in alice_frames], ['invalid_request'] * 2)
+        self.assertEqual(bob_frames, [])
+
+    def test_rooms_of_others_are_ignored(self):
+        alice_frames, bob_frames = self.send_typing(self.room.pk + 1)
+
+        self.assertEqual((alice_frames, bob_frames), ([], []))
@@ -0,0 +1,93 @@
+import time
+
+from django.conf import settings
+
+# minimum number of seconds between two typing events of a user in a room
+# relayed to the other participants
+TYPING_INTERVAL = getattr(settings, 'FLACK_TYPING_INTERVAL', 3.0)
+# number of messages and rooms a user can create per second on average, and
+# in a burst. None lifts the limit.
+MESSAGE_RATE = getattr(settings, 'FLACK_MESSAGE_RATE', 5)
+MESSAGE_BURST = getattr(settings, 'FLACK_MESSAGE_BURST', 20)
+ROOM_RATE = getattr(settings, 'FLACK_ROOM_RATE', 0.2)
+ROOM_BURST = getattr(settings, 'FLACK_ROOM_BURST', 5)
+# maximum size of a frame received from a client, in characters of text
+# frames or bytes of binary ones, and maximum length of message content
+WS_MAX_FRAME_SIZE = getattr(settings, 'FLACK_WS_MAX_FRAME_SIZE', 64 * 1024)
+MESSAGE_MAX_LENGTH = getattr(settings, 'FLACK_MESSAGE_MAX_LENGTH', 10000)
+
+
+class IntervalThrottle:
+    """
+    Lets through at most one event per key every `interval` seconds, for all
+    consumers of the process. Only used from the event loop.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._last = {}
+        self._next_prune = 0
+
+    def allow(self, key):
+        now = time.monotonic()
+        self._prune(now)
+
+        last = self._last.get(key)
+        if last is not None and now - last < self.interval:
+            return False
+
+        self._last[key] = now
+        return True
+
+    def _prune(self, now):
+        # keys which would be let through anyway are forgotten, so keys of
+        # users who stopped typing don't pile up
+        if now >= self._next_prune:
+            self._last = {key: last for key, last in self._last.items() if now - last < self.interval}
+            self._next_prune = now + self.interval
+
+
+class TokenBucketThrottle:
+    """
+    Lets through bursts of up to `burst` events per key, refilled at `rate`
+    events per second, for all consumers of the process. Only used from the
+    event loop.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._next_prune = 0
+
+    def allow(self, key):
+        now = time.monotonic()
+        self._prune(now)
+
+        tokens = self._tokens(key, now)
+        if tokens < 1:
+            return False
+
+        self._buckets[key] = (tokens - 1, now)
+        return True
+
+    def retry_after(self, key):
+        """Seconds until the next event of a key is let through."""
+        return max(1 - self._tokens(key, time.monotonic()), 0) / self.rate
+
+    def _tokens(self, key, now):
+        tokens, last = self._buckets.get(key, (self.burst, now))
+        return min(tokens + (now - last) * self.rate, self.burst)
+
+    def _prune(self, now):
+        # full buckets are forgotten, they are refilled the same when missing
+        if now >= self._next_prune:
+            self._buckets = {
+                key: bucket for key, bucket in self._buckets.items() if self._tokens(key, now) < self.burst
+            }
+            self._next_prune = now + self.burst / self.rate
+
+
+typing_throttle = IntervalThrottle(TYPING_INTERVAL)
+message_throttle = TokenBucketThrottle(MESSAGE_RATE, MESSAGE_BURST) if MESSAGE_RATE else None
+room_throttle = TokenBucketThrottle(ROOM_RATE, ROOM_BURST) if ROOM_RATE else None
@@ -0,0 +1,73 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from channels.db import database_sync_to_async
+
+# whether SQLite connections use WAL journaling, letting reads proceed while
+# a write is in progress, and writes are performed by one thread per process
+SQLITE_WAL = getattr(settings, 'FLACK_SQLITE_WAL', False)
+# pragmas set on every new SQLite connection when SQLITE_WAL is enabled
+SQLITE_PRAGMAS = getattr(settings, 'FLACK_SQLITE_PRAGMAS', {
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+})
+
+_writer = threading.local()
+writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+
+
+# connected once this module is imported, which happens while the models of
+# the apps using it are loaded, before any connection is made
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if not SQLITE_WAL or connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute('PRAGMA {name}={value}'.format(name=name, value=value))
+
+
+def writes_serialized():
+    """Whether writes are performed by the writer thread."""
+    return SQLITE_WAL and connections[DEFAULT_DB_ALIAS].vendor == 'sqlite'
+
+
+def _write(func, args, kwargs):
+    # the writer keeps its connection open, it is the only one writing anyway
+    _writer.active = True
+    return func(*args, **kwargs)
+
+
+def run_write(func, *args, **kwargs):
+    """
+    Calls `func` on the writer thread and returns its result, or calls it
+    right away if writes aren't serialized, this is the writer thread or a
+    transaction is open. The writer has a connection of its own, its writes
+    would be left out of the transaction and wait for it to end.
+    """
+    if (not writes_serialized() or getattr(_writer, 'active', False)
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+        return func(*args, **kwargs)
+
+    return writer_executor.submit(_write, func, args, kwargs).result()
+
+
+def database_write_to_async(func):
+    """Like `database_sync_to_async`, but for functions writing to the database, which run on the writer thread."""
+    if not writes_serialized():
+        return database_sync_to_async(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.wrap_future(writer_executor.submit(_write, func, args, kwargs))
+
+    return wrapper
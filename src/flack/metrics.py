@@ -0,0 +1,352 @@
+import atexit
+import functools
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# whether metrics are collected and served at /metrics/
+METRICS = getattr(settings, 'FLACK_METRICS', True)
+# directory shared by the processes of a server, each of which writes its
+# metrics there so any of them can serve the metrics of all. None serves the
+# metrics of the process answering only. Files of processes which are gone
+# are removed, so it must not be shared by processes of several hosts.
+METRICS_DIR = getattr(settings, 'FLACK_METRICS_DIR', None)
+# seconds between two writes of the metrics of a process to METRICS_DIR
+METRICS_INTERVAL = getattr(settings, 'FLACK_METRICS_INTERVAL', 5)
+# secret allowing scrapers to fetch metrics as a bearer token, besides staff
+# users. None allows staff users only.
+METRICS_TOKEN = getattr(settings, 'FLACK_METRICS_TOKEN', None)
+
+# upper bounds, in seconds, of the buckets of latency histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Metric:
+    """
+    Values of a metric by label values, given positionally in the order of
+    `labelnames`. Metrics given a `function` have no values of their own,
+    the function is called for their value whenever they are collected.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+
+        registry.register(self)
+
+    def collect(self):
+        """Returns the values of the metric by label values."""
+        if self.function is not None:
+            return {(): self.function()}
+
+        with self._lock:
+            return {labels: self._copy(value) for labels, value in self._values.items()}
+
+    def _copy(self, value):
+        return value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+        registry.recorded = True
+
+
+class Gauge(Metric):
+    """Gauges of processes which stopped writing their metrics are left out."""
+
+    type = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+        registry.recorded = True
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+        registry.recorded = True
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    """
+    Counts of observations per bucket, along with their sum. Values are
+    lists of the counts of every bucket, not cumulative, followed by the
+    count in none of them, then the sum.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+
+            counts[index] += 1
+            counts[-1] += value
+        registry.recorded = True
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def _copy(self, value):
+        return list(value)
+
+
+def timed(histogram, *labels):
+    """Decorates a function, observing how long its calls take in `histogram`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(*labels):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def timed_async(histogram, *labels):
+    """Like `timed`, for coroutine functions."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with histogram.time(*labels):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class Registry:
+    """
+    Metrics of the process. With a `directory`, they are also written there
+    every `interval` seconds, and the metrics written by other processes are
+    added to those of this one when rendered. Metrics of processes which are
+    gone are dropped, their counters with them.
+    """
+
+    def __init__(self, directory=None, interval=5):
+        self.directory = directory
+        self.interval = interval
+        # whether anything was recorded at all. Processes which never record
+        # anything, such as most management commands, don't write anything.
+        self.recorded = False
+        self._metrics = []
+        self._thread = None
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def start(self):
+        if self.directory is not None and self._thread is None:
+            os.makedirs(self.directory, exist_ok=True)
+
+            self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.remove)
+
+    def snapshot(self):
+        return {
+            'time': time.time(),
+            'metrics': {
+                metric.name: [[list(labels), value] for labels, value in metric.collect().items()]
+                for metric in self._metrics
+            }
+        }
+
+    def write(self):
+        """Writes the metrics of this process to the directory, if anything was recorded."""
+        if not self.recorded:
+            return
+
+        path = self._path()
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def remove(self):
+        """Removes the metrics of this process from the directory, once it exits."""
+        try:
+            os.remove(self._path())
+        except FileNotFoundError:
+            pass
+
+    def render(self):
+        """Returns the metrics of all processes in the Prometheus text format."""
+        snapshots = [self.snapshot()]
+
+        if self.directory is not None:
+            own = self._path()
+            for path in glob.glob(os.path.join(self.directory, '*.json')):
+                if path == own:
+                    continue
+
+                if not _alive(path):
+                    # a process which crashed, or was killed, never removes its file
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    # written while read, or gone
+                    continue
+
+        lines = []
+        for metric in self._metrics:
+            values = self._merge(metric, snapshots)
+
+            lines.append('# HELP {name} {doc}'.format(name=metric.name, doc=metric.documentation))
+            lines.append('# TYPE {name} {type}'.format(name=metric.name, type=metric.type))
+
+            for labels, value in sorted(values.items()):
+                lines.extend(self._samples(metric, labels, value))
+
+        return '\n'.join(lines) + '\n'
+
+    def _merge(self, metric, snapshots):
+        values = {}
+        stale = time.time() - 3 * self.interval
+
+        for i, snapshot in enumerate(snapshots):
+            # gauges of processes which stopped writing are meaningless
+            if metric.type == 'gauge' and i > 0 and snapshot['time'] < stale:
+                continue
+
+            for labels, value in snapshot['metrics'].get(metric.name, []):
+                labels = tuple(labels)
+
+                if metric.type == 'histogram':
+                    merged = values.get(labels)
+                    values[labels] = value if merged is None else [a + b for a, b in zip(merged, value)]
+                else:
+                    values[labels] = values.get(labels, 0) + value
+
+        return values
+
+    def _samples(self, metric, labels, value):
+        pairs = ['{name}="{value}"'.format(name=name, value=_escape(label))
+                 for name, label in zip(metric.labelnames, labels)]
+
+        if metric.type != 'histogram':
+            return ['{name}{labels} {value}'.format(name=metric.name, labels=_labels(pairs), value=value)]
+
+        samples = []
+        cumulative = 0
+        for bound, count in zip(metric.buckets + (float('inf'),), value):
+            cumulative += count
+            bucket_pairs = pairs + ['le="{bound}"'.format(bound='+Inf' if bound == float('inf') else bound)]
+            samples.append('{name}_bucket{labels} {value}'.format(
+                name=metric.name, labels=_labels(bucket_pairs), value=cumulative
+            ))
+
+        samples.append('{name}_count{labels} {value}'.format(name=metric.name, labels=_labels(pairs), value=cumulative))
+        samples.append('{name}_sum{labels} {value}'.format(name=metric.name, labels=_labels(pairs), value=value[-1]))
+        return samples
+
+    def _path(self):
+        # the process ID is read on every write, so forked processes write
+        # files of their own
+        return os.path.join(self.directory, '{pid}.json'.format(pid=os.getpid()))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+
+            try:
+                self.write()
+            except OSError as e:
+                print("writing metrics failed: {error}".format(error=e))
+
+
+def _alive(path):
+    """Tells whether the process which wrote the metrics file `path` is still running."""
+    try:
+        pid = int(os.path.basename(path).split('.')[0])
+    except ValueError:
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(pairs):
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+registry = Registry(METRICS_DIR, METRICS_INTERVAL)
+
+if METRICS:
+    registry.start()
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'flack_http_request_seconds', "Time taken by HTTP requests, by view, method and status class.",
+    ['view', 'method', 'status']
+)
+
+
+class RequestMetricsMiddleware:
+    """Observes how long every HTTP request takes. Goes first in MIDDLEWARE."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+
+        match = request.resolver_match
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            match.view_name if match is not None else '',
+            request.method,
+            '{class_}xx'.format(class_=response.status_code // 100)
+        )
+
+        return response
@@ -31,6 +31,10 @@ ALLOWED_HOSTS = ['*']
 # Application definition
 
 INSTALLED_APPS = [
+    # listed first, so its runserver command, which negotiates WebSocket
+    # compression, replaces the ones of channels and staticfiles
+    'app_ws',
+
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -45,13 +49,14 @@ INSTALLED_APPS = [
     'channels',
 
     'app_auth',
-    'app_ws',
     'app_rooms',
     'app_files',
     'app_messages',
 ]
 
 MIDDLEWARE = [
+    # times everything below it
+    'flack.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -141,3 +146,179 @@ CHANNEL_LAYERS = {
         },
     },
 }
+
+
+# WebSocket synchronization
+
+# Maximum number of rooms or messages loaded and sent to the client in a
+# single batch frame while it catches up after connecting.
+FLACK_REPLAY_CHUNK_SIZE = 500
+
+# Clients connecting with ?compress=true receive replays in frames holding
+# up to FLACK_REPLAY_COMPRESSED_BATCHES batch frames each, compressed with
+# zlib at FLACK_REPLAY_COMPRESSION_LEVEL.
+FLACK_REPLAY_COMPRESSION_LEVEL = 9
+FLACK_REPLAY_COMPRESSED_BATCHES = 10
+
+# With FLACK_WS_COMPRESSION enabled, runserver compresses WebSocket
+# connections of clients offering permessage-deflate at the default zlib
+# compression level, using the given window size (base two logarithm) and
+# memory level.
+FLACK_WS_COMPRESSION = True
+FLACK_WS_COMPRESSION_WINDOW_BITS = 15
+FLACK_WS_COMPRESSION_MEM_LEVEL = 8
+
+# Frames waiting to be sent to a client are queued. Once the queue holds
+# FLACK_OUTBOUND_HIGH_WATERMARK frames, the client is lagging until it gets
+# down to FLACK_OUTBOUND_LOW_WATERMARK, and frames for it are handled
+# according to FLACK_OUTBOUND_POLICY: 'coalesce' replaces the queued ones by a
+# single resync frame, 'drop' drops them and sends a resync frame once the
+# client stops lagging, 'disconnect' closes the connection. With
+# FLACK_WS_BACKPRESSURE enabled, runserver only takes frames off the queue
+# as fast as the client reads them.
+FLACK_OUTBOUND_HIGH_WATERMARK = 256
+FLACK_OUTBOUND_LOW_WATERMARK = 64
+FLACK_OUTBOUND_POLICY = 'coalesce'
+FLACK_WS_BACKPRESSURE = True
+
+
+# Presence
+
+# With FLACK_PRESENCE enabled, users sharing a room with a user are told when
+# the user comes online or goes offline, in frames sent every
+# FLACK_PRESENCE_INTERVAL seconds. Enable FLACK_PRESENCE_SHARED when running
+# several processes, so they exchange their connected users through the
+# channel layer, in full every FLACK_PRESENCE_SNAPSHOT_INTERVAL seconds.
+FLACK_PRESENCE = True
+FLACK_PRESENCE_INTERVAL = 1.0
+FLACK_PRESENCE_SHARED = False
+FLACK_PRESENCE_SNAPSHOT_INTERVAL = 30
+
+# Typing requests of a user in a room are relayed to the other participants
+# at most once every FLACK_TYPING_INTERVAL seconds.
+FLACK_TYPING_INTERVAL = 3.0
+
+
+# Request limits
+
+# Users can create FLACK_MESSAGE_RATE messages and FLACK_ROOM_RATE rooms per
+# second in every process, after bursts of up to FLACK_MESSAGE_BURST messages
+# and FLACK_ROOM_BURST rooms. Set a rate to None to lift its limit.
+FLACK_MESSAGE_RATE = 5
+FLACK_MESSAGE_BURST = 20
+FLACK_ROOM_RATE = 0.2
+FLACK_ROOM_BURST = 5
+
+# Frames received over FLACK_WS_MAX_FRAME_SIZE characters (bytes if binary)
+# and messages over FLACK_MESSAGE_MAX_LENGTH characters are rejected.
+FLACK_WS_MAX_FRAME_SIZE = 64 * 1024
+FLACK_MESSAGE_MAX_LENGTH = 10000
+
+
+# Room cache
+
+# Summaries of up to FLACK_ROOM_CACHE_SIZE rooms and the rooms of up to
+# FLACK_ROOM_CACHE_USERS users are cached in every process. Changes made in
+# the process are applied right away, changes made by other processes are
+# picked up once entries expire after FLACK_ROOM_CACHE_TTL seconds.
+FLACK_ROOM_CACHE_SIZE = 50000
+FLACK_ROOM_CACHE_USERS = 10000
+FLACK_ROOM_CACHE_TTL = 300
+
+
+# Token authentication
+
+# Resolved tokens are cached in every process for FLACK_AUTH_CACHE_TTL seconds,
+# up to FLACK_AUTH_CACHE_SIZE tokens. Set FLACK_AUTH_CACHE_ALIAS to the alias
+# of a cache in CACHES to share resolved tokens between processes. Deleting a
+# token or changing a user only clears the cache of the process doing it and
+# the shared cache, the other processes keep using it for up to the TTL.
+FLACK_AUTH_CACHE_SIZE = 10000
+FLACK_AUTH_CACHE_TTL = 60
+FLACK_AUTH_CACHE_ALIAS = None
+
+
+# IPFS storage
+
+# Seconds to wait for the IPFS daemon on each call, the number of pooled HTTP
+# connections to it and the number of calls allowed in flight at once.
+IPFS_STORAGE_TIMEOUT = 30
+IPFS_STORAGE_MAX_CONNECTIONS = 10
+IPFS_STORAGE_MAX_CONCURRENCY = 10
+
+# Uploads passing the token in the query string are streamed to the IPFS
+# daemon in chunks of FLACK_UPLOAD_CHUNK_SIZE bytes, with at most
+# IPFS_STORAGE_STREAM_QUEUE_SIZE chunks per upload waiting for the daemon.
+# At most IPFS_STORAGE_MAX_STREAMS uploads are streamed at once, apart from
+# the calls counted by IPFS_STORAGE_MAX_CONCURRENCY.
+FLACK_UPLOAD_CHUNK_SIZE = 64 * 2 ** 10
+IPFS_STORAGE_STREAM_QUEUE_SIZE = 4
+IPFS_STORAGE_MAX_STREAMS = 10
+
+# Content read from IPFS is cached on disk in IPFS_STORAGE_CACHE_DIR, keeping
+# at most IPFS_STORAGE_CACHE_SIZE bytes. Set the directory to None to always
+# read from the daemon.
+IPFS_STORAGE_CACHE_DIR = os.path.join(BASE_DIR, 'ipfs-cache')
+IPFS_STORAGE_CACHE_SIZE = 2 ** 30
+
+# Local IPFS node gateway advertised in file lists. The address is detected
+# from the network interfaces every IPFS_LOCALNODE_REFRESH seconds unless
+# IPFS_LOCALNODE_ADDRESS fixes it.
+IPFS_LOCALNODE_ADDRESS = None
+IPFS_LOCALNODE_PORT = 8080
+IPFS_LOCALNODE_REFRESH = 300
+
+# Uploads requested with ?async=true are written to FLACK_UPLOAD_STAGING_DIR
+# and added to IPFS by FLACK_UPLOAD_WORKERS background threads per process.
+# Uploads still pending when the server stops are resumed by the
+# recover_uploads management command, run before the server is started.
+FLACK_UPLOAD_STAGING_DIR = os.path.join(BASE_DIR, 'upload-staging')
+FLACK_UPLOAD_WORKERS = 4
+
+
+# Message history
+
+# Pages of /api/messages/history/ hold FLACK_HISTORY_PAGE_SIZE messages unless
+# the client asks for another number, up to FLACK_HISTORY_MAX_PAGE_SIZE.
+FLACK_HISTORY_PAGE_SIZE = 50
+FLACK_HISTORY_MAX_PAGE_SIZE = 200
+
+
+# Message writes
+
+# With FLACK_MESSAGE_BATCHING enabled, messages sent over WebSocket are stored
+# by a writer thread in every process, up to FLACK_MESSAGE_BATCH_SIZE of them
+# in a single transaction. The writer waits FLACK_MESSAGE_BATCH_DELAY seconds
+# for more messages after the first one of a batch.
+FLACK_MESSAGE_BATCHING = False
+FLACK_MESSAGE_BATCH_SIZE = 100
+FLACK_MESSAGE_BATCH_DELAY = 0.005
+
+
+# Metrics
+
+# With FLACK_METRICS enabled, metrics are served in the Prometheus text format
+# at /metrics/ to staff users and to requests with an "Authorization: Bearer
+# <FLACK_METRICS_TOKEN>" header, if the token is set. When running several
+# processes of a host, set FLACK_METRICS_DIR to a directory they share: each
+# one writes its metrics there every FLACK_METRICS_INTERVAL seconds, and the
+# metrics of all of them are served by any of them.
+FLACK_METRICS = True
+FLACK_METRICS_DIR = None
+FLACK_METRICS_INTERVAL = 5
+FLACK_METRICS_TOKEN = None
+
+
+# SQLite
+
+# With FLACK_SQLITE_WAL enabled, SQLite connections use WAL journaling and the
+# pragmas in FLACK_SQLITE_PRAGMAS, and writes from consumers and views are
+# performed by a single writer thread in every process.
+FLACK_SQLITE_WAL = True
+FLACK_SQLITE_PRAGMAS = {
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 20000,
+}
@@ -0,0 +1,84 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+
+from .metrics import Counter, Gauge, Registry
+
+
+class MetricsViewTests(TestCase):
+    url = '/metrics/'
+
+    def test_anonymous_scrapers_are_forbidden(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_scrapers_authenticate_with_the_token(self):
+        with mock.patch('flack.views.METRICS_TOKEN', 's3cret'):
+            response = self.client.get(self.url, HTTP_AUTHORIZATION='Bearer s3cret')
+            wrong = self.client.get(self.url, HTTP_AUTHORIZATION='Bearer s3cre')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE flack_http_request_seconds histogram', response.content.decode())
+        self.assertEqual(wrong.status_code, 403)
+
+    def test_no_token_is_accepted_unless_one_is_set(self):
+        response = self.client.get(self.url, HTTP_AUTHORIZATION='Bearer None')
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_staff_is_let_through(self):
+        user = get_user_model().objects.create(username='admin', is_staff=True)
+        self.client.force_login(user)
+
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+
+class RegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        self.registry = Registry(self.directory, interval=5)
+        with mock.patch('flack.metrics.registry', self.registry):
+            self.counter = Counter('flack_test_total', "Test counter.")
+            self.gauge = Gauge('flack_test_open', "Test gauge.")
+
+    def write_snapshot(self, pid, counter, gauge, age=0):
+        path = os.path.join(self.directory, '{pid}.json'.format(pid=pid))
+        with open(path, 'w') as f:
+            json.dump({
+                'time': time.time() - age,
+                'metrics': {'flack_test_total': [[[], counter]], 'flack_test_open': [[[], gauge]]}
+            }, f)
+        return path
+
+    def rendered(self):
+        return [line for line in self.registry.render().splitlines() if not line.startswith('#')]
+
+    def test_metrics_of_other_processes_are_added(self):
+        self.counter.inc(amount=1)
+        self.gauge.set(1)
+        self.write_snapshot(os.getppid(), 2, 3)
+
+        self.assertEqual(self.rendered(), ['flack_test_total 3', 'flack_test_open 4'])
+
+    def test_files_of_dead_processes_are_pruned(self):
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        path = self.write_snapshot(process.pid, 2, 3)
+        self.counter.inc(amount=1)
+
+        self.assertEqual(self.rendered(), ['flack_test_total 1'])
+        self.assertFalse(os.path.exists(path))
+
+    def test_stale_gauges_are_dropped(self):
+        self.write_snapshot(os.getppid(), 2, 3, age=60)
+
+        self.assertEqual(self.rendered(), ['flack_test_total 2'])
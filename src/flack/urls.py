@@ -19,7 +19,8 @@ from django.urls import path, include
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
-from .views import dashboard
+from .metrics import METRICS
+from .views import dashboard, metrics
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -37,3 +38,6 @@ urlpatterns = [
     path('api/messages/', include('app_messages.api.urls', namespace='message-api')),
     path('api/files/', include('app_files.api.urls', namespace='file-api')),
 ]
+
+if METRICS:
+    urlpatterns.append(path('metrics/', metrics, name='metrics'))
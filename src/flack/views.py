@@ -1,5 +1,24 @@
+import hmac
+
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import render
 
+from .metrics import METRICS_TOKEN, registry
+
 
 def dashboard(request):
     return render(request, "dashboard.html", {})
+
+
+def metrics(request):
+    # the client address is the proxy's behind a reverse proxy, so scrapers
+    # authenticate with the shared secret instead
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    authorized = METRICS_TOKEN is not None and hmac.compare_digest(
+        authorization.encode(), 'Bearer {token}'.format(token=METRICS_TOKEN).encode()
+    )
+
+    if not authorized and not request.user.is_staff:
+        return HttpResponseForbidden()
+
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')